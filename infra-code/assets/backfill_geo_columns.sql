@@ -0,0 +1,14 @@
+-- Fills the coordinate and geohash cell columns of the trips ingested before they existed.
+-- Rows still in the streaming buffer cannot be updated: run it again later if it reports so.
+UPDATE
+    `${project_id}.${dataset_id}.${table_id}`
+SET
+    origin_lon = ST_X(SAFE.ST_GEOGFROMTEXT(origin_coord)),
+    origin_lat = ST_Y(SAFE.ST_GEOGFROMTEXT(origin_coord)),
+    origin_cell = ST_GEOHASH(SAFE.ST_GEOGFROMTEXT(origin_coord), 6),
+    destination_lon = ST_X(SAFE.ST_GEOGFROMTEXT(destination_coord)),
+    destination_lat = ST_Y(SAFE.ST_GEOGFROMTEXT(destination_coord)),
+    destination_cell = ST_GEOHASH(SAFE.ST_GEOGFROMTEXT(destination_coord), 6)
+WHERE
+    origin_cell IS NULL
+    OR destination_cell IS NULL
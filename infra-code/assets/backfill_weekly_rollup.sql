@@ -0,0 +1,48 @@
+-- Adds the trips of every ingestion not in the weekly rollup yet, such as the ones finished
+-- before it existed. Run assets/backfill_geo_columns.sql first: trips without cells are skipped.
+-- Run it while no ingestion is in progress, so only complete ingestions are added.
+BEGIN TRANSACTION;
+
+CREATE TEMP TABLE ingestions AS
+SELECT DISTINCT
+    ingestion_id
+FROM
+    `${project_id}.${dataset_id}.${table_id}`
+WHERE
+    ingestion_id NOT IN (
+        SELECT ingestion_id FROM `${project_id}.${dataset_id}.${rollup_table_id}_ingestions`
+    );
+
+MERGE `${project_id}.${dataset_id}.${rollup_table_id}` AS rollup
+USING (
+    SELECT
+        origin_cell,
+        destination_cell,
+        TIMESTAMP_BUCKET(TIMESTAMP(datetime), INTERVAL 1 WEEK) AS week,
+        COUNT(1) AS count_of_trips
+    FROM
+        `${project_id}.${dataset_id}.${table_id}`
+    WHERE
+        ingestion_id IN (SELECT ingestion_id FROM ingestions)
+        AND origin_cell IS NOT NULL
+        AND destination_cell IS NOT NULL
+    GROUP BY
+        1, 2, 3
+) AS trips
+ON rollup.origin_cell = trips.origin_cell
+    AND rollup.destination_cell = trips.destination_cell
+    AND rollup.week = trips.week
+WHEN MATCHED THEN
+    UPDATE SET count_of_trips = rollup.count_of_trips + trips.count_of_trips
+WHEN NOT MATCHED THEN
+    INSERT (origin_cell, destination_cell, week, count_of_trips)
+    VALUES (trips.origin_cell, trips.destination_cell, trips.week, trips.count_of_trips);
+
+INSERT INTO `${project_id}.${dataset_id}.${rollup_table_id}_ingestions` (ingestion_id, added_at)
+SELECT
+    ingestion_id,
+    CURRENT_TIMESTAMP()
+FROM
+    ingestions;
+
+COMMIT TRANSACTION;
@@ -0,0 +1,53 @@
+-- Groups the trips between the same origin and destination geohash cells, in the same hour of
+-- the day, keeping the groups of 2 or more trips and the trip closest to the mean of each.
+-- Replace the ${...} placeholders and run it again whenever the groups should be refreshed.
+CREATE OR REPLACE TABLE `${project_id}.${dataset_id}.trips_similar_groups`
+CLUSTER BY origin_cell, destination_cell
+AS
+WITH trips AS (
+    SELECT
+        origin_cell,
+        destination_cell,
+        FORMAT_TIME('%H:%M', TIME_TRUNC(TIME(datetime), HOUR)) AS time_bucket,
+        origin_coord,
+        destination_coord,
+        datetime,
+        origin_lon,
+        origin_lat,
+        destination_lon,
+        destination_lat
+    FROM
+        `${project_id}.${dataset_id}.${table_id}`
+    WHERE
+        origin_cell IS NOT NULL
+        AND destination_cell IS NOT NULL
+),
+grouped AS (
+    SELECT
+        *,
+        COUNT(1) OVER groups AS count_of_trips,
+        POW(origin_lon - AVG(origin_lon) OVER groups, 2)
+            + POW(origin_lat - AVG(origin_lat) OVER groups, 2)
+            + POW(destination_lon - AVG(destination_lon) OVER groups, 2)
+            + POW(destination_lat - AVG(destination_lat) OVER groups, 2) AS distance
+    FROM
+        trips
+    WINDOW groups AS (PARTITION BY origin_cell, destination_cell, time_bucket)
+)
+SELECT
+    origin_cell,
+    destination_cell,
+    time_bucket,
+    count_of_trips,
+    origin_coord,
+    destination_coord,
+    FORMAT_DATETIME('%Y-%m-%d %H:%M:%S', datetime) AS datetime
+FROM
+    grouped
+WHERE
+    count_of_trips >= 2
+QUALIFY
+    ROW_NUMBER() OVER (
+        PARTITION BY origin_cell, destination_cell, time_bucket
+        ORDER BY distance, datetime
+    ) = 1
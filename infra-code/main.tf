@@ -10,9 +10,18 @@ resource "google_bigquery_table" "trips" {
   schema              = file("./assets/trips_schema.json")
   deletion_protection = false
 
+  # Area queries with a time range only read the days in between. Adding it to an existing
+  # table replaces the table: copy its rows aside first (see docs/architecture.md).
+  time_partitioning {
+    type  = "DAY"
+    field = "datetime"
+  }
+
+  # Geohash cells of the origin and destination (see assets/backfill_geo_columns.sql),
+  # which area queries filter on with range predicates.
   clustering = [
-    "origin_coord",
-    "destination_coord",
+    "origin_cell",
+    "destination_cell",
     "datetime"
   ]
 
@@ -32,10 +41,51 @@ resource "google_bigquery_table" "ingestion-control" {
   deletion_protection = false
 }
 
+# Weekly trip counts per origin and destination cell, which the notification service adds
+# every finished ingestion to, and the ingestions it already added.
+resource "google_bigquery_table" "trips-weekly-rollup" {
+  dataset_id = google_bigquery_dataset.events-dataset.dataset_id
+  table_id   = "trips_weekly_rollup"
+
+  schema = jsonencode([
+    { name = "origin_cell", type = "STRING", mode = "REQUIRED" },
+    { name = "destination_cell", type = "STRING", mode = "REQUIRED" },
+    { name = "week", type = "TIMESTAMP", mode = "REQUIRED" },
+    { name = "count_of_trips", type = "INTEGER", mode = "REQUIRED" }
+  ])
+  deletion_protection = false
+
+  clustering = [
+    "origin_cell",
+    "destination_cell",
+    "week"
+  ]
+
+}
+
+resource "google_bigquery_table" "trips-weekly-rollup-ingestions" {
+  dataset_id = google_bigquery_dataset.events-dataset.dataset_id
+  table_id   = "${google_bigquery_table.trips-weekly-rollup.table_id}_ingestions"
+
+  schema = jsonencode([
+    { name = "ingestion_id", type = "STRING", mode = "REQUIRED" },
+    { name = "added_at", type = "TIMESTAMP", mode = "REQUIRED" }
+  ])
+  deletion_protection = false
+
+}
+
 resource "google_pubsub_topic" "events-topic" {
   name = "events_topic"
 }
 
+# Extra events topics, events_topic_1 to events_topic_{N-1}, used by the Ingestion API
+# when EVENTS_TOPIC_SHARDS is set to the same shard count.
+resource "google_pubsub_topic" "events-topic-shard" {
+  count = var.events_topic_shards - 1
+  name  = "events_topic_${count.index + 1}"
+}
+
 resource "google_pubsub_topic" "status-topic" {
   name = "status_topic"
 }
@@ -51,4 +101,14 @@ resource "google_pubsub_subscription" "bq-subscription" {
 
 }
 
+resource "google_pubsub_subscription" "bq-subscription-shard" {
+  count = var.events_topic_shards - 1
+  name  = "bigquery-subscription-${count.index + 1}"
+  topic = google_pubsub_topic.events-topic-shard[count.index].id
 
+  bigquery_config {
+    table            = "${google_bigquery_table.trips.project}.${google_bigquery_table.trips.dataset_id}.${google_bigquery_table.trips.table_id}"
+    use_table_schema = true
+  }
+
+}
@@ -19,16 +19,51 @@ resource "google_cloudfunctions2_function" "notification-service" {
     min_instance_count             = 1
     timeout_seconds                = 120
     all_traffic_on_latest_revision = true
+
+    # The checks of many jobs run at once, so their counts share queries (COUNT_BATCH_*).
+    max_instance_request_concurrency = 50
+    available_cpu                    = "1"
+    available_memory                 = "512M"
+
     environment_variables = {
-      SLACK_WEBHOOK = var.slack_webhook
+      SLACK_WEBHOOK              = var.slack_webhook
+      POLL_DEADLINE_SECONDS      = 21600
+      COUNT_BATCH_WINDOW_SECONDS = 1
+      COUNT_BATCH_MAX_IDS        = 1000
     }
     service_account_email = jsondecode(file("./credentials.json"))["client_email"]
   }
+}
+
+# Pushes the status events to the function. An unfinished job is nacked and redelivered
+# with exponential backoff, from 10 s up to 10 min between two checks.
+resource "google_pubsub_subscription" "notification-subscription" {
+  name                 = "notification-subscription"
+  topic                = google_pubsub_topic.status-topic.id
+  ack_deadline_seconds = 120
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
 
-  event_trigger {
-    trigger_region = var.location
-    event_type     = "google.cloud.pubsub.topic.v1.messagePublished"
-    pubsub_topic   = google_pubsub_topic.status-topic.id
+  push_config {
+    push_endpoint = google_cloudfunctions2_function.notification-service.service_config[0].uri
 
+    oidc_token {
+      service_account_email = jsondecode(file("./credentials.json"))["client_email"]
+    }
   }
+
+  expiration_policy {
+    ttl = ""
+  }
+}
+
+resource "google_cloud_run_service_iam_member" "notification-invoker" {
+  project  = var.project_name
+  location = var.location
+  service  = google_cloudfunctions2_function.notification-service.name
+  role     = "roles/run.invoker"
+  member   = "serviceAccount:${jsondecode(file("./credentials.json"))["client_email"]}"
 }
\ No newline at end of file
@@ -13,3 +13,14 @@ variable "notification-service-bucket" {
 variable "slack_webhook" {
   type = string
 }
+
+variable "events_topic_shards" {
+  type        = number
+  default     = 1
+  description = "Number of events topics, each with its own BigQuery subscription."
+
+  validation {
+    condition     = var.events_topic_shards >= 1
+    error_message = "events_topic_shards must be at least 1."
+  }
+}
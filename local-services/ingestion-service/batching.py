@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from google.cloud import pubsub_v1
+
+# Pub/Sub accepts at most 1000 messages and 10 MB per publish request.
+MIN_MESSAGES, MAX_MESSAGES = 100, 1000
+MIN_BYTES, MAX_BYTES = 64 * 1024, 9 * 1024 * 1024
+# Batches of bulk loads fill up by size well before this latency; small calls are not held back.
+BULK_LATENCY, INTERACTIVE_LATENCY = 0.5, 0.01
+
+
+class AdaptiveBatchSettings:
+    """
+    Tunes the batch settings of a publisher client from the publish latency and error rate
+    observed on its recent messages.
+
+    The batch size grows while messages are acknowledged within `target_latency` without
+    errors, and is halved as soon as latency or errors go over their targets. The batch
+    latency follows the traffic: calls sending many records at once (bulk file loads)
+    get long batch latencies, so batches fill up by size, while small calls such as
+    `/ingest` get batches committed almost right away.
+    """
+
+    def __init__(
+        self,
+        target_latency: float = 2.0,
+        max_error_rate: float = 0.01,
+        window: int = 500,
+        bulk_records: int = 100,
+    ) -> None:
+        """
+        Initializes the AdaptiveBatchSettings with small, low-latency batches.
+
+        Args:
+            target_latency (float, optional): The 95th percentile, in seconds, of the time
+                between publishing a message and its acknowledgement above which batches shrink.
+                Defaults to 2.0.
+            max_error_rate (float, optional): The share of failed messages above which batches
+                shrink. Defaults to 0.01.
+            window (int, optional): The number of recent messages the statistics and every
+                adjustment are based on. Defaults to 500.
+            bulk_records (int, optional): The average number of records per `send` call from
+                which the traffic is treated as a bulk load. Defaults to 100.
+        """
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.bulk_records = bulk_records
+
+        self.max_messages = MIN_MESSAGES
+        self.max_bytes = 1024 * 1024
+        self.max_latency = INTERACTIVE_LATENCY
+        self.adjustments = 0
+        self.last_adjustment: Optional[str] = None
+
+        self._records_per_send = 1.0
+        self._observations: deque = deque(maxlen=window)
+        self._since_adjustment = 0
+        self._lock = threading.Lock()
+
+    @property
+    def batch_settings(self) -> pubsub_v1.types.BatchSettings:
+        """
+        The batch settings to give to the publisher client.
+        """
+        return pubsub_v1.types.BatchSettings(
+            max_messages=self.max_messages,
+            max_bytes=self.max_bytes,
+            max_latency=self.max_latency,
+        )
+
+    def observe_send(self, records: int) -> bool:
+        """
+        Records the size of a `send` call, switching between bulk and interactive latencies.
+
+        Args:
+            records (int): The number of records of the call.
+
+        Returns:
+            bool: True if the batch settings changed.
+        """
+        with self._lock:
+            # Exponential moving average, so a single large call does not flip the mode.
+            self._records_per_send += 0.2 * (records - self._records_per_send)
+            latency = (
+                BULK_LATENCY
+                if self._records_per_send >= self.bulk_records
+                else INTERACTIVE_LATENCY
+            )
+
+            if latency == self.max_latency:
+                return False
+
+            self.max_latency = latency
+            self._adjusted("bulk" if latency == BULK_LATENCY else "interactive")
+            return True
+
+    def observe(self, latency: float, failed: bool) -> bool:
+        """
+        Records the outcome of a published message, adjusting the batch size once every
+        `window` messages.
+
+        Args:
+            latency (float): The seconds between publishing the message and its resolution.
+            failed (bool): True if the message could not be published.
+
+        Returns:
+            bool: True if the batch settings changed.
+        """
+        with self._lock:
+            self._observations.append((latency, failed))
+            self._since_adjustment += 1
+
+            if self._since_adjustment < self.window:
+                return False
+
+            self._since_adjustment = 0
+            stats = self._stats()
+
+            if (
+                stats["error_rate"] > self.max_error_rate
+                or stats["p95_latency_seconds"] > self.target_latency
+            ):
+                if self.max_messages == MIN_MESSAGES and self.max_bytes == MIN_BYTES:
+                    return False
+                self.max_messages = max(MIN_MESSAGES, self.max_messages // 2)
+                self.max_bytes = max(MIN_BYTES, self.max_bytes // 2)
+                self._adjusted("shrink")
+                return True
+
+            if self.max_messages == MAX_MESSAGES and self.max_bytes == MAX_BYTES:
+                return False
+
+            self.max_messages = min(MAX_MESSAGES, self.max_messages * 2)
+            self.max_bytes = min(MAX_BYTES, self.max_bytes * 2)
+            self._adjusted("grow")
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Summarizes the current settings and the recent publish statistics.
+
+        Returns:
+            Dict[str, Any]: The current 'batch_settings', the 'mode' of the traffic, the
+            number of 'adjustments' and the last one, and the statistics of the recent
+            messages: their count, error rate and 50th, 95th and max latencies.
+        """
+        with self._lock:
+            return {
+                "batch_settings": {
+                    "max_messages": self.max_messages,
+                    "max_bytes": self.max_bytes,
+                    "max_latency": self.max_latency,
+                },
+                "mode": "bulk" if self.max_latency == BULK_LATENCY else "interactive",
+                "records_per_send": round(self._records_per_send, 1),
+                "adjustments": self.adjustments,
+                "last_adjustment": self.last_adjustment,
+                "recent": self._stats(),
+            }
+
+    def _stats(self) -> Dict[str, Any]:
+        latencies = sorted(latency for latency, _ in self._observations)
+        failed = sum(1 for _, is_failed in self._observations if is_failed)
+
+        if not latencies:
+            return {
+                "messages": 0,
+                "error_rate": 0.0,
+                "p50_latency_seconds": 0.0,
+                "p95_latency_seconds": 0.0,
+                "max_latency_seconds": 0.0,
+            }
+
+        return {
+            "messages": len(latencies),
+            "error_rate": round(failed / len(latencies), 4),
+            "p50_latency_seconds": round(latencies[len(latencies) // 2], 4),
+            "p95_latency_seconds": round(latencies[int(len(latencies) * 0.95)], 4),
+            "max_latency_seconds": round(latencies[-1], 4),
+        }
+
+    def _adjusted(self, reason: str) -> None:
+        self.adjustments += 1
+        self.last_adjustment = f"{reason} at {time.strftime('%Y-%m-%dT%H:%M:%S')}"
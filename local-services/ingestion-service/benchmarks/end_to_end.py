@@ -0,0 +1,423 @@
+"""
+Measures the ingestion throughput end to end, from files and HTTP calls to Pub/Sub.
+
+Every scenario runs in a fresh process against either the Pub/Sub emulator (when
+`PUBSUB_EMULATOR_HOST` is set) or an in-process stand-in of the publisher client that
+acknowledges messages after `--standin-latency-ms`. Each one reports rows/s, the p50 and
+p99 latency of its unit of work and the peak RSS of its process:
+
+    formatter   reading, parsing, validating and serializing chunks (`DataFormatter`)
+    publisher   publishing parsed chunks and waiting for them (`PubSubService`)
+    ingest_api  POST /ingest calls of `--events-per-request` events
+    csv_file    GET /ingest/dir/{dir}/file/{file}, once per `--repeat`
+    csv_dir     GET /ingest/dir/{dir} over `--files` files (emulator only, as the files
+                are ingested by worker processes)
+
+Results can be saved with `--save` and compared with a previous run with `--baseline`, in
+which case the exit code is 1 when a scenario got slower than `--tolerance`.
+
+Usage (from `local-services/ingestion-service`):
+
+    python benchmarks/generate_trips.py /tmp/bench/trips.csv --rows 200000
+    python benchmarks/end_to_end.py /tmp/bench/trips.csv --save /tmp/bench/run.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(SERVICE_DIR))
+
+SCENARIOS = ["formatter", "publisher", "ingest_api", "csv_file", "csv_dir"]
+
+
+class StandInPublisherClient:
+    """
+    Stands in for `pubsub_v1.PublisherClient`, acknowledging every message after a fixed
+    latency from a background thread, so the benchmarks run without any cloud resource.
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs) -> None:
+        self.batch_settings = kwargs.get("batch_settings")
+        self.latency = latency
+        self._queue: queue.Queue = queue.Queue()
+        threading.Thread(target=self._acknowledge, daemon=True).start()
+
+    def topic_path(self, project_id: str, topic_id: str) -> str:
+        return f"projects/{project_id}/topics/{topic_id}"
+
+    def publish(self, topic: str, data: bytes, **attributes) -> Future:
+        future: Future = Future()
+        self._queue.put((time.monotonic() + self.latency, future))
+        return future
+
+    def _acknowledge(self) -> None:
+        while True:
+            due, future = self._queue.get()
+            if (delay := due - time.monotonic()) > 0:
+                time.sleep(delay)
+            future.set_result("0")
+
+
+def _setup(options: Dict[str, Any]) -> None:
+    """
+    Points the service at a scratch directory and, without an emulator, at the stand-in.
+    Must run before the service modules are imported.
+    """
+    os.environ["FILES_BASE_DIR"] = options["workdir"]
+    os.environ.setdefault("PROJECT_ID", "benchmark")
+    os.environ.setdefault("EVENTS_TOPIC_ID", "events_topic")
+    os.environ.setdefault("STATUS_TOPIC_ID", "status_topic")
+    os.environ.setdefault("CSV_PROCESSED_FOLDER", "processed")
+    os.environ.setdefault("CSV_CHUNK_SIZE", str(options["chunk_size"]))
+    os.environ.setdefault("TRIPS_SCHEMA_PATH", str(options["schema"]))
+
+    if "PUBSUB_EMULATOR_HOST" in os.environ:
+        _create_topics()
+        return
+
+    from google.cloud import pubsub_v1
+
+    latency = options["standin_latency_ms"] / 1000
+    pubsub_v1.PublisherClient = lambda **kwargs: StandInPublisherClient(
+        latency=latency, **kwargs
+    )
+
+
+def _create_topics() -> None:
+    from google.api_core.exceptions import AlreadyExists
+    from google.cloud import pubsub_v1
+
+    client = pubsub_v1.PublisherClient()
+    for topic in (os.environ["EVENTS_TOPIC_ID"], os.environ["STATUS_TOPIC_ID"]):
+        try:
+            client.create_topic(name=client.topic_path(os.environ["PROJECT_ID"], topic))
+        except AlreadyExists:
+            pass
+
+
+def _stage(
+    options: Dict[str, Any], directory: str, copies: int = 1, prefix: str = ""
+) -> List[str]:
+    """
+    Copies the input file into a directory of the scratch base path.
+    """
+    source = Path(options["input"])
+    target = Path(options["workdir"]) / directory
+    target.mkdir(parents=True, exist_ok=True)
+    names = []
+
+    for copy in range(copies):
+        name = f"{prefix}{copy}_{source.name}"
+        shutil.copyfile(source, target / name)
+        # Distinct content, so the manifest does not skip the copies as already ingested.
+        with open(target / name, mode="ab") as f:
+            f.write(b"\n" * copy)
+        names.append(name)
+
+    return names
+
+
+def _reset_manifest(options: Dict[str, Any]) -> None:
+    # The folder itself belongs to the app, which created it on import.
+    for entry in (Path(options["workdir"]) / "manifests").glob("*.json"):
+        entry.unlink()
+
+
+def run_formatter(options: Dict[str, Any]) -> Dict[str, Any]:
+    from serializers import JsonSerializer
+    from utils import DataFormatter, FileHandler
+    from validation import BatchValidator
+
+    file_handler = FileHandler(dir=str(Path(options["input"]).parent))
+    formatter, validator, serializer = (
+        DataFormatter(),
+        BatchValidator(),
+        JsonSerializer(),
+    )
+    rows, latencies = 0, []
+
+    for chunk in file_handler.read_csv_chunks(
+        Path(options["input"]).name,
+        has_header=options["has_header"],
+        chunk_size=options["chunk_size"],
+    ):
+        start = time.perf_counter()
+        batch = validator.validate(formatter.from_csv_batch(chunk))
+        for _ in serializer.encode(batch.to_records()):
+            pass
+        latencies.append(time.perf_counter() - start)
+        rows += len(chunk)
+
+    return {"rows": rows, "latencies": latencies, "unit": "chunk"}
+
+
+def run_publisher(options: Dict[str, Any]) -> Dict[str, Any]:
+    from gcp import PubSubService
+    from utils import DataFormatter, FileHandler
+
+    file_handler = FileHandler(dir=str(Path(options["input"]).parent))
+    formatter = DataFormatter()
+    batches = [
+        list(formatter.from_csv_batch(chunk).to_records())
+        for chunk in file_handler.read_csv_chunks(
+            Path(options["input"]).name,
+            has_header=options["has_header"],
+            chunk_size=options["chunk_size"],
+        )
+    ]
+    publisher = PubSubService(
+        project_id=os.environ["PROJECT_ID"], topic_id=os.environ["EVENTS_TOPIC_ID"]
+    )
+    latencies = []
+
+    start_all = time.perf_counter()
+    for batch in batches:
+        start = time.perf_counter()
+        report = publisher.wait(publisher.send(batch))
+        latencies.append(time.perf_counter() - start)
+        assert report["failed"] == 0, report
+
+    return {
+        "rows": sum(len(batch) for batch in batches),
+        "latencies": latencies,
+        "unit": "chunk",
+        "seconds": time.perf_counter() - start_all,
+    }
+
+
+def run_ingest_api(options: Dict[str, Any]) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+    from utils import CSV_COLUMNS, FileHandler
+
+    import main
+
+    client = TestClient(main.app)
+    file_handler = FileHandler(dir=str(Path(options["input"]).parent))
+    events = [
+        dict(zip(CSV_COLUMNS, line.rstrip("\n").split(",")))
+        for line in file_handler.read_csv(
+            Path(options["input"]).name, has_header=options["has_header"]
+        )
+    ]
+    size = options["events_per_request"]
+    requests = [events[i : i + size] for i in range(0, len(events), size)]
+    latencies = []
+
+    start_all = time.perf_counter()
+    for body in requests:
+        start = time.perf_counter()
+        response = client.post("/ingest", json=body)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+
+    return {
+        "rows": len(events),
+        "latencies": latencies,
+        "unit": "request",
+        "seconds": time.perf_counter() - start_all,
+    }
+
+
+def run_csv_file(options: Dict[str, Any]) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    rows, latencies = 0, []
+
+    for run in range(options["repeat"]):
+        _reset_manifest(options)
+        (name,) = _stage(options, "bench_file", prefix=f"{run}_")
+
+        start = time.perf_counter()
+        response = client.get(
+            f"/ingest/dir/bench_file/file/{name}",
+            headers={"has_header": str(int(options["has_header"]))},
+        )
+        latencies.append(time.perf_counter() - start)
+
+        status = response.json()
+        rows += status["count"] + status["rejected"]
+
+    return {"rows": rows, "latencies": latencies, "unit": "file"}
+
+
+def run_csv_dir(options: Dict[str, Any]) -> Dict[str, Any]:
+    if "PUBSUB_EMULATOR_HOST" not in os.environ:
+        return {"skipped": "needs PUBSUB_EMULATOR_HOST"}
+
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    _reset_manifest(options)
+    _stage(options, "bench_dir", copies=options["files"])
+
+    start = time.perf_counter()
+    response = client.get(
+        "/ingest/dir/bench_dir",
+        headers={"has_header": str(int(options["has_header"]))},
+    )
+    elapsed = time.perf_counter() - start
+    files = response.json()["files"]
+
+    return {
+        "rows": sum(f.get("count", 0) + f.get("rejected", 0) for f in files),
+        "latencies": [elapsed],
+        "unit": "directory",
+    }
+
+
+RUNNERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "formatter": run_formatter,
+    "publisher": run_publisher,
+    "ingest_api": run_ingest_api,
+    "csv_file": run_csv_file,
+    "csv_dir": run_csv_dir,
+}
+
+
+def run_scenario(name: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs a scenario in the current process and summarizes it.
+    """
+    _setup(options)
+
+    start = time.perf_counter()
+    result = RUNNERS[name](options)
+    seconds = result.pop("seconds", time.perf_counter() - start)
+
+    if "skipped" in result:
+        return {"scenario": name, **result}
+
+    latencies = sorted(result.pop("latencies"))
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    return {
+        "scenario": name,
+        "rows": result["rows"],
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(result["rows"] / seconds, 1) if seconds else 0.0,
+        "unit": result["unit"],
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: Path, tolerance: float
+) -> List[str]:
+    """
+    Lists the scenarios that got slower than a baseline run by more than `tolerance`.
+    """
+    previous = {r["scenario"]: r for r in json.loads(baseline.read_text())}
+    regressions = []
+
+    for result in results:
+        before = previous.get(result["scenario"])
+        if not before or "skipped" in result or "skipped" in before:
+            continue
+
+        if result["rows_per_second"] < before["rows_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{result['scenario']}: {result['rows_per_second']} rows/s, "
+                f"was {before['rows_per_second']}"
+            )
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['scenario']}: p99 {result['p99_ms']} ms, was {before['p99_ms']}"
+            )
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "input", type=Path, help="A CSV file, e.g. from generate_trips.py"
+    )
+    parser.add_argument("--no-header", action="store_true")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--events-per-request", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--standin-latency-ms", type=float, default=5.0)
+    parser.add_argument(
+        "--schema",
+        type=Path,
+        default=SERVICE_DIR / "../../infra-code/assets/trips_schema.json",
+    )
+    parser.add_argument("--save", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="ingestion-benchmark-") as workdir:
+        options = {
+            "input": str(args.input.resolve()),
+            "has_header": not args.no_header,
+            "chunk_size": args.chunk_size,
+            "events_per_request": args.events_per_request,
+            "repeat": args.repeat,
+            "files": args.files,
+            "standin_latency_ms": args.standin_latency_ms,
+            "schema": str(args.schema.resolve()),
+            "workdir": workdir,
+        }
+        context = multiprocessing.get_context("spawn")
+
+        for name in args.scenarios:
+            # A fresh process per scenario, so its peak RSS is its own.
+            with context.Pool(processes=1) as pool:
+                result = pool.apply(run_scenario, (name, options))
+            results.append(result)
+
+            if "skipped" in result:
+                print(f"{name:>10}: skipped ({result['skipped']})")
+                continue
+
+            print(
+                f"{name:>10}: {result['rows']:>9} rows in {result['seconds']:>8.3f}s "
+                f"{result['rows_per_second']:>11.1f} rows/s  "
+                f"p50 {result['p50_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms "
+                f"per {result['unit']:<9} peak RSS {result['peak_rss_mb']:>7.1f} MB"
+            )
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
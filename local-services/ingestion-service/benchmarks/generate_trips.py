@@ -0,0 +1,217 @@
+"""
+Generates synthetic trips at any scale, shaped like the sample files in `data/`.
+
+Trips start and end around a few hotspots of each region, popular regions and datasources
+can be skewed with a Zipf-like distribution, and a share of invalid rows can be mixed in
+to exercise the validation. The output format follows the file extension: .csv, .csv.gz,
+.csv.zst or .parquet.
+
+Usage (from `local-services/ingestion-service`):
+
+    python benchmarks/generate_trips.py /tmp/trips.csv.gz --rows 1000000 \
+        --regions 20 --skew 1.2 --invalid-rate 0.001
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from utils import CSV_COLUMNS  # noqa: E402
+
+# Bounding boxes (min lon, min lat, max lon, max lat) of the regions of the sample files.
+REGIONS = {
+    "Prague": (14.318, 49.989, 14.667, 50.125),
+    "Turin": (7.513, 44.976, 7.740, 45.139),
+    "Hamburg": (9.803, 53.428, 10.215, 53.652),
+}
+DATASOURCES = [
+    "cheap_mobile",
+    "pt_search_app",
+    "bad_diesel_vehicles",
+    "baba_car",
+    "funny_car",
+]
+INVALID_ROWS = [
+    "{region},POINT (999 999),POINT (14.4 50.0),2018-05-28 09:03:40,funny_car",
+    "{region},POINT (14.4 50.0),POINT (14.5 50.1),2018-02-30 25:61:00,funny_car",
+    "{region},POINT (14.4 50.0),2018-05-28 09:03:40",
+]
+
+
+class TripGenerator:
+    """
+    Generates trips row by row, from a seeded random generator.
+    """
+
+    def __init__(
+        self,
+        regions: int = 3,
+        skew: float = 0.0,
+        hotspots: int = 5,
+        start: datetime = datetime(2018, 5, 1),
+        days: int = 31,
+        invalid_rate: float = 0.0,
+        seed: int = 42,
+    ) -> None:
+        """
+        Initializes the TripGenerator.
+
+        Args:
+            regions (int, optional): The number of regions. The sample regions come first, and
+                the others are placed at random across Europe. Defaults to 3.
+            skew (float, optional): The Zipf exponent of the region and datasource popularity;
+                0 makes them uniform. Defaults to 0.0.
+            hotspots (int, optional): The number of hotspots per region that trips start from
+                and end at. Defaults to 5.
+            start (datetime, optional): The earliest trip datetime. Defaults to 2018-05-01.
+            days (int, optional): The number of days the trips spread over. Defaults to 31.
+            invalid_rate (float, optional): The share of invalid rows. Defaults to 0.0.
+            seed (int, optional): The random seed, so runs are reproducible. Defaults to 42.
+        """
+        self.random = random.Random(seed)
+        self.start = start
+        self.seconds = days * 24 * 3600
+        self.invalid_rate = invalid_rate
+
+        boxes = dict(list(REGIONS.items())[:regions])
+        for region in range(len(boxes), regions):
+            lon, lat = self.random.uniform(-9, 28), self.random.uniform(37, 60)
+            boxes[f"Region_{region}"] = (lon, lat, lon + 0.3, lat + 0.2)
+
+        self.regions = list(boxes)
+        self.region_weights = _zipf_weights(len(self.regions), skew)
+        self.datasource_weights = _zipf_weights(len(DATASOURCES), skew)
+        self.hotspots: Dict[str, List[Tuple[float, float, float]]] = {
+            region: [
+                (
+                    self.random.uniform(box[0], box[2]),
+                    self.random.uniform(box[1], box[3]),
+                    (box[2] - box[0]) / 10,
+                )
+                for _ in range(hotspots)
+            ]
+            for region, box in boxes.items()
+        }
+
+    def rows(self, count: int) -> Iterator[List[str]]:
+        """
+        Yields trips as lists of CSV fields, in the order of `CSV_COLUMNS`.
+
+        Args:
+            count (int): The number of rows.
+
+        Yields:
+            List[str]: A trip, or an invalid row at the `invalid_rate`.
+        """
+        rand = self.random
+
+        for _ in range(count):
+            region = rand.choices(self.regions, self.region_weights)[0]
+
+            if self.invalid_rate and rand.random() < self.invalid_rate:
+                yield next(
+                    csv.reader([rand.choice(INVALID_ROWS).format(region=region)])
+                )
+                continue
+
+            when = self.start + timedelta(seconds=rand.randrange(self.seconds))
+
+            yield [
+                region,
+                self._point(region),
+                self._point(region),
+                when.strftime("%Y-%m-%d %H:%M:%S"),
+                rand.choices(DATASOURCES, self.datasource_weights)[0],
+            ]
+
+    def _point(self, region: str) -> str:
+        lon, lat, spread = self.random.choice(self.hotspots[region])
+        return (
+            f"POINT ({self.random.gauss(lon, spread)} "
+            f"{self.random.gauss(lat, spread * 0.7)})"
+        )
+
+
+def _zipf_weights(count: int, skew: float) -> List[float]:
+    return [1 / (rank**skew) for rank in range(1, count + 1)]
+
+
+def write(path: Path, rows: Iterator[List[str]], has_header: bool = True) -> None:
+    """
+    Writes rows to a CSV (plain, .gz or .zst) or a Parquet file, based on its extension.
+    """
+    if path.suffix == ".parquet":
+        import pyarrow as pa
+        from pyarrow import parquet as pq
+
+        schema = pa.schema([(column, pa.string()) for column in CSV_COLUMNS])
+        valid = (row for row in rows if len(row) == len(CSV_COLUMNS))
+
+        with pq.ParquetWriter(path, schema) as writer:
+            while chunk := [row for _, row in zip(range(100000), valid)]:
+                writer.write_table(pa.table(dict(zip(CSV_COLUMNS, zip(*chunk)))))
+        return
+
+    if path.suffix == ".gz":
+        f = gzip.open(path, mode="wt", newline="")
+    elif path.suffix == ".zst":
+        import zstandard
+
+        f = io.TextIOWrapper(
+            zstandard.ZstdCompressor().stream_writer(open(path, mode="wb")),
+            encoding="utf-8",
+            newline="",
+        )
+    else:
+        f = open(path, mode="w", newline="")
+
+    with f:
+        writer = csv.writer(
+            f, lineterminator="\n", quoting=csv.QUOTE_NONE, escapechar="\\"
+        )
+        if has_header:
+            writer.writerow(CSV_COLUMNS)
+        writer.writerows(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--regions", type=int, default=3)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--hotspots", type=int, default=5)
+    parser.add_argument(
+        "--start", type=datetime.fromisoformat, default=datetime(2018, 5, 1)
+    )
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--invalid-rate", type=float, default=0.0)
+    parser.add_argument("--no-header", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    generator = TripGenerator(
+        regions=args.regions,
+        skew=args.skew,
+        hotspots=args.hotspots,
+        start=args.start,
+        days=args.days,
+        invalid_rate=args.invalid_rate,
+        seed=args.seed,
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    write(args.output, generator.rows(args.rows), has_header=not args.no_header)
+
+    print(f"{args.rows} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares the size of the events on the wire between the JSON and the packed Avro formats.
+
+Usage (from `local-services/ingestion-service`):
+
+    python benchmarks/wire_format.py data/teste.csv --has-header \
+        --schema ../../infra-code/assets/trips_schema.json
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from geo import add_geo_columns  # noqa: E402
+from serializers import AvroPackedSerializer, JsonSerializer  # noqa: E402
+from utils import DataFormatter, FileHandler  # noqa: E402
+
+
+def measure(serializer, records) -> dict:
+    """
+    Encodes the records with a serializer and checks that they decode back unchanged.
+    """
+    start = time.perf_counter()
+    messages = [message for message, _ in serializer.encode(dict(r) for r in records)]
+    elapsed = time.perf_counter() - start
+
+    decoded = [record for message in messages for record in serializer.decode(message)]
+    assert [{k: str(v) for k, v in r.items()} for r in records] == [
+        {k: str(v) for k, v in r.items()} for r in decoded
+    ], f"{serializer.encoding} round trip changed the records"
+
+    return {
+        "encoding": serializer.encoding,
+        "messages": len(messages),
+        "bytes": sum(len(message) for message in messages),
+        "encode_seconds": elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("csv_file", type=Path)
+    parser.add_argument("--has-header", action="store_true")
+    parser.add_argument("--schema", default="../../infra-code/assets/trips_schema.json")
+    parser.add_argument("--records-per-message", type=int, default=1000)
+    args = parser.parse_args()
+
+    file_handler = FileHandler(dir=str(args.csv_file.parent.resolve()))
+
+    formatter = DataFormatter()
+    batch = formatter.from_csv_batch(
+        list(file_handler.read_csv(args.csv_file.name, has_header=args.has_header))
+    )
+    # Published events carry the geo columns, as in `BatchPublisher.publish`.
+    batch.table = add_geo_columns(batch.table)
+    records = list(batch.to_records())
+
+    results = [
+        measure(JsonSerializer(), records),
+        measure(
+            AvroPackedSerializer(
+                schema_path=args.schema, records_per_message=args.records_per_message
+            ),
+            records,
+        ),
+    ]
+
+    print(f"{len(records)} records")
+    for result in results:
+        print(
+            f"{result['encoding']:>10}: {result['messages']:>8} messages "
+            f"{result['bytes']:>12} bytes "
+            f"({result['bytes'] / len(records):.1f} bytes/record) "
+            f"encoded in {result['encode_seconds']:.3f}s"
+        )
+    print(f"size reduction: {results[0]['bytes'] / results[1]['bytes']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
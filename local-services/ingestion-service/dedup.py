@@ -0,0 +1,360 @@
+import fcntl
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from metrics import DEDUP_KEYS
+from utils import CSV_COLUMNS, TripBatch
+
+# Header of a saved Bloom filter: a magic, its number of bits and of hash functions.
+BLOOM_MAGIC = b"TRIPBLM1"
+# Maximum number of parameters of a single SQLite statement.
+SQL_VARIABLES = 900
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of 16-byte digests. It answers "definitely new" or "maybe
+    seen", with a false positive rate that stays close to `error_rate` up to `capacity`
+    keys and then degrades gracefully, while its size never changes.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        """
+        Initializes an empty BloomFilter sized for a number of keys.
+
+        Args:
+            capacity (int): The number of keys the filter is sized for.
+            error_rate (float): The false positive rate at `capacity` keys.
+        """
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: bytes) -> Iterable[int]:
+        # Double hashing (Kirsch-Mitzenmacher) over the two halves of the digest.
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, digest: bytes) -> None:
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(digest)
+        )
+
+    def merge(self, data: bytes) -> bool:
+        """
+        Adds the keys of a filter saved by `to_bytes`, if it has the same size.
+
+        Args:
+            data (bytes): The saved filter.
+
+        Returns:
+            bool: False if the saved filter was sized differently and was ignored.
+        """
+        header = BLOOM_MAGIC + self.size.to_bytes(8, "little")
+        header += self.hashes.to_bytes(4, "little")
+
+        if not data.startswith(header) or len(data) != len(header) + len(self.bits):
+            return False
+
+        merged = int.from_bytes(self.bits, "little") | int.from_bytes(
+            data[len(header) :], "little"
+        )
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "little"))
+        return True
+
+    def to_bytes(self) -> bytes:
+        return (
+            BLOOM_MAGIC
+            + self.size.to_bytes(8, "little")
+            + self.hashes.to_bytes(4, "little")
+            + bytes(self.bits)
+        )
+
+
+class TripDeduplicator:
+    """
+    Detects trips that were already ingested, by the hash of all of their fields, across
+    ingestions, files and worker processes.
+
+    Every key is looked up in an in-memory `BloomFilter` first: the vast majority of new
+    trips are "definitely new" and are claimed in one bulk insert, while the likely hits are
+    confirmed against the exact index, a SQLite table of the keys with the ingestion and
+    line that claimed them. The index is the source of truth; the filter, saved next to it,
+    only saves lookups, so a stale or lost filter costs speed, never correctness.
+
+    A key claimed by the same ingestion at the same line is not a duplicate: it is the same
+    row read again when a file ingestion resumes after its last acknowledged chunk. The keys
+    of a batch that failed to publish are released (see `release`), so a later ingestion of
+    the same trips does not drop them. The digests of a batch returned by `filter_batch` are
+    kept as long as the batch, so releasing it does not hash its rows again.
+
+    Keys are kept for `retention_days` after they were claimed, which bounds the index to
+    the trips ingested over that window; its size is exported as `ingestion_dedup_keys`.
+    The filter is not shrunk by the pruning: the bits of pruned keys only cost lookups.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        capacity: int = 10_000_000,
+        error_rate: float = 0.01,
+        retention_days: float = 90,
+    ) -> None:
+        """
+        Initializes the TripDeduplicator, creating its folder, index and filter if needed.
+
+        Args:
+            path (Path): The folder of the index (`trips.sqlite`) and filter (`trips.bloom`).
+            capacity (int, optional): The number of trips the filter is sized for, which
+                bounds its size to about 1.2 bytes per trip at a 1% error rate. Defaults to
+                10 million.
+            error_rate (float, optional): The false positive rate of the filter at
+                `capacity` trips. Defaults to 0.01.
+            retention_days (float, optional): The days a key is kept for after it was
+                claimed, 0 to keep keys forever. Defaults to 90.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path / "trips.sqlite"
+        self.filter_path = self.path / "trips.bloom"
+        self.retention_days = retention_days
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._claimed: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._db = sqlite3.connect(
+            self.index_path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS trip_keys ("
+            "digest BLOB PRIMARY KEY, ingestion_id BLOB NOT NULL, line INTEGER NOT NULL, "
+            "claimed_at INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS trip_keys_claimed_at ON trip_keys (claimed_at)"
+        )
+        self.prune()
+
+        self.filter = BloomFilter(capacity=capacity, error_rate=error_rate)
+        if not self._load_filter():
+            for (digest,) in self._db.execute("SELECT digest FROM trip_keys"):
+                self.filter.add(digest)
+            self._dirty = True
+
+    @staticmethod
+    def digests(batch: TripBatch) -> List[bytes]:
+        """
+        Hashes the fields of every trip of a batch. The fields of a row are joined by Arrow,
+        so only the hash itself runs once per row in Python.
+
+        Args:
+            batch (TripBatch): The batch.
+
+        Returns:
+            List[bytes]: A 16-byte BLAKE2 digest per row.
+        """
+        rows = pc.binary_join_element_wise(
+            *(pc.fill_null(batch.table.column(column), "") for column in CSV_COLUMNS),
+            "\x1f",
+        )
+
+        return [
+            hashlib.blake2b(row, digest_size=16).digest()
+            for row in rows.cast(pa.binary()).to_pylist()
+        ]
+
+    def filter_batch(self, batch: TripBatch) -> Tuple[TripBatch, int]:
+        """
+        Drops the trips of a batch that were already ingested, or that appear earlier in the
+        batch, and claims the others for the ingestion of the batch.
+
+        Args:
+            batch (TripBatch): A validated batch.
+
+        Returns:
+            Tuple[TripBatch, int]: The batch without its duplicates, and their number.
+        """
+        if not len(batch):
+            return batch, 0
+
+        claim = batch.ingestion_id.bytes
+        lines = batch.line_numbers.to_pylist()
+        digests = self.digests(batch)
+        first: Dict[bytes, int] = {}
+        for row, digest in enumerate(digests):
+            first.setdefault(digest, row)
+
+        with self._lock:
+            duplicates = self._claim(
+                {digest: lines[row] for digest, row in first.items()}, claim
+            )
+
+        keep = [False] * len(batch)
+        for digest, row in first.items():
+            keep[row] = digest not in duplicates
+
+        dropped = len(batch) - sum(keep)
+        if dropped:
+            mask = pa.array(keep)
+            digests = [digest for digest, kept in zip(digests, keep) if kept]
+            batch = TripBatch(
+                batch.table.filter(mask),
+                ingestion_id=batch.ingestion_id,
+                line_numbers=batch.line_numbers.filter(mask),
+                rejected=batch.rejected,
+            )
+
+        with self._lock:
+            self._claimed[batch] = digests
+
+        return batch, dropped
+
+    def _claim(self, keys: Dict[bytes, int], claim: bytes) -> set:
+        """
+        Claims keys in the index, in one transaction, and returns those claimed before by
+        another ingestion or line.
+        """
+        maybe = [digest for digest in keys if digest in self.filter]
+        duplicates = set()
+        owned = set()
+
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for digest, ingestion_id, line in self._lookup(maybe):
+                if ingestion_id == claim and line == keys[digest]:
+                    owned.add(digest)
+                else:
+                    duplicates.add(digest)
+
+            new = [
+                digest
+                for digest in keys
+                if digest not in duplicates and digest not in owned
+            ]
+            before = self._db.total_changes
+            claimed_at = int(time.time())
+            self._db.executemany(
+                "INSERT OR IGNORE INTO trip_keys VALUES (?, ?, ?, ?)",
+                ((digest, claim, keys[digest], claimed_at) for digest in new),
+            )
+
+            if self._db.total_changes - before != len(new):
+                # Keys missing from this process' filter, claimed by another process or
+                # by a row that was not seen since the filter was saved.
+                for digest, ingestion_id, line in self._lookup(new):
+                    if ingestion_id != claim or line != keys[digest]:
+                        duplicates.add(digest)
+
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+        for digest in new:
+            self.filter.add(digest)
+        self._dirty = self._dirty or bool(new)
+
+        return duplicates
+
+    def release(self, batch: TripBatch) -> None:
+        """
+        Releases the keys claimed by a batch returned by `filter_batch`, when it could not be
+        published, so its trips are not dropped as duplicates when they are sent again.
+
+        Args:
+            batch (TripBatch): The batch without its duplicates.
+        """
+        claim = batch.ingestion_id.bytes
+        lines = batch.line_numbers.to_pylist()
+
+        with self._lock:
+            digests = self._claimed.pop(batch, None)
+
+        if digests is None:
+            digests = self.digests(batch)
+
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM trip_keys "
+                "WHERE digest = ? AND ingestion_id = ? AND line = ?",
+                ((digest, claim, line) for digest, line in zip(digests, lines)),
+            )
+
+    def prune(self) -> None:
+        """
+        Deletes the keys claimed more than `retention_days` ago, and updates the
+        `ingestion_dedup_keys` gauge with the number of keys left.
+        """
+        with self._lock:
+            if self.retention_days:
+                self._db.execute(
+                    "DELETE FROM trip_keys WHERE claimed_at < ?",
+                    (int(time.time() - self.retention_days * 86400),),
+                )
+
+            (keys,) = self._db.execute("SELECT COUNT(*) FROM trip_keys").fetchone()
+            DEDUP_KEYS.set(keys)
+
+    def _lookup(self, digests: List[bytes]) -> Iterable[Tuple[bytes, bytes, int]]:
+        for start in range(0, len(digests), SQL_VARIABLES):
+            chunk = digests[start : start + SQL_VARIABLES]
+            yield from self._db.execute(
+                "SELECT digest, ingestion_id, line FROM trip_keys "
+                f"WHERE digest IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+
+    def _load_filter(self) -> bool:
+        try:
+            return self.filter.merge(self.filter_path.read_bytes())
+        except FileNotFoundError:
+            return False
+
+    def save(self) -> None:
+        """
+        Prunes the expired keys, then saves the filter atomically, merged with the filter
+        saved meanwhile by other processes. The filter is not saved when no key was added
+        since the last save.
+        """
+        self.prune()
+
+        with self._lock:
+            if not self._dirty:
+                return
+
+            with open(self.path / "trips.bloom.lock", mode="w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._load_filter()
+
+                with tempfile.NamedTemporaryFile(
+                    mode="wb", dir=self.path, suffix=".tmp", delete=False
+                ) as f:
+                    f.write(self.filter.to_bytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                os.replace(f.name, self.filter_path)
+
+            self._dirty = False
@@ -1,45 +1,449 @@
-from typing import Dict, List, Union
+import itertools
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent import futures
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Union
 
+from batching import AdaptiveBatchSettings
 from google.cloud import pubsub_v1
+from metrics import (
+    INFLIGHT_BYTES,
+    INFLIGHT_MESSAGES,
+    PUBLISH_LATENCY,
+    PUBLISHED_BYTES,
+    PUBLISHED_MESSAGES,
+    STAGE_SECONDS,
+)
+from serializers import JsonSerializer
 
 
 class PubSubService:
 
-    def __init__(self, project_id: str, topic_id: str):
+    def __init__(
+        self,
+        project_id: str,
+        topic_id: str,
+        max_inflight_messages: int = 10000,
+        max_inflight_bytes: int = 100 * 1024 * 1024,
+        serializer=None,
+        adaptive_batching: bool = True,
+    ):
+        """
+        Initializes the PubSubService with a publisher client bound to a single topic.
+
+        Args:
+            project_id (str): The Google Cloud project ID.
+            topic_id (str): The Pub/Sub topic ID where events will be published.
+            max_inflight_messages (int, optional): The maximum number of messages published but
+                not yet acknowledged by Pub/Sub. Defaults to 10000.
+            max_inflight_bytes (int, optional): The maximum size in bytes of messages published
+                but not yet acknowledged by Pub/Sub. Defaults to 100 MB.
+            serializer (optional): The wire format of the events, such as `JsonSerializer` or
+                `AvroPackedSerializer` (see `serializers.py`). Defaults to `JsonSerializer`.
+            adaptive_batching (bool, optional): If True, the batch settings are tuned at runtime
+                from the observed publish latency and error rate (see `AdaptiveBatchSettings`).
+                Otherwise batches are fixed to 300 messages, 1 MB or 1 second. Defaults to True.
+
+        Note:
+            When one of the in-flight limits is reached, `send` blocks until Pub/Sub acknowledges
+            enough messages, which bounds the memory used by the client buffers.
+        """
+        self._batching = AdaptiveBatchSettings() if adaptive_batching else None
         self.__client = pubsub_v1.PublisherClient(
-            batch_settings=pubsub_v1.types.BatchSettings(
-                max_messages=300,
-                max_bytes=51200,  # 50 MB (1024 * 50)
-                max_latency=1,  # 1 second
-                # Publish when one of the above conditions is met 300 msgs or 50 MB or 1 second
-            )
+            batch_settings=(
+                self._batching.batch_settings
+                if self._batching
+                else pubsub_v1.types.BatchSettings(
+                    max_messages=300,
+                    max_bytes=1024 * 1024,  # 1 MB
+                    max_latency=1,  # 1 second
+                    # Publish when one of the above conditions is met 300 msgs or 1 MB or 1 second
+                )
+            ),
+            publisher_options=pubsub_v1.types.PublisherOptions(
+                flow_control=pubsub_v1.types.PublishFlowControl(
+                    message_limit=max_inflight_messages,
+                    byte_limit=max_inflight_bytes,
+                    limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+                )
+            ),
         )
         self._topic_path = self.__client.topic_path(project_id, topic_id)
+        self.serializer = serializer or JsonSerializer()
+
+        self.max_inflight_messages = max_inflight_messages
+        self.max_inflight_bytes = max_inflight_bytes
+        self._inflight_messages = 0
+        self._inflight_bytes = 0
+        self._delivery_reports: OrderedDict = OrderedDict()
+        self._max_delivery_reports = 10000
+        self._records_per_future = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        # Labelled once, as looking labels up on every message is a measurable cost.
+        self._metrics = {
+            "serialize": STAGE_SECONDS.labels("serialize"),
+            "inflight_messages": INFLIGHT_MESSAGES.labels(self._topic_path),
+            "inflight_bytes": INFLIGHT_BYTES.labels(self._topic_path),
+            "published_bytes": PUBLISHED_BYTES.labels(self._topic_path),
+            "delivered": PUBLISHED_MESSAGES.labels(self._topic_path, "delivered"),
+            "failed": PUBLISHED_MESSAGES.labels(self._topic_path, "failed"),
+            "latency": PUBLISH_LATENCY.labels(self._topic_path),
+        }
 
-    def send(self, data: Union[List[Dict[str, str]], Dict[str, str]]) -> None:
+    def send(self, data: Union[Iterable[Dict[str, str]], Dict[str, str]]) -> List[Future]:
         """
         Publishes event data to a Google Cloud Pub/Sub topic.
 
-        This method accepts a single dictionary or a list of dictionaries representing event data,
-        encodes each dictionary as a JSON string, and publishes it to the configured Pub/Sub topic.
-        The events are published in batches according to the settings defined for the client, with
-        a maximum of 300 messages, 50 MB in size, or a 1-second latency.
+        This method accepts a single dictionary or an iterable of dictionaries representing event data,
+        encodes them with the configured serializer (one JSON string per dictionary by default), and
+        publishes the messages to the configured Pub/Sub topic.
+        The events are published in batches according to the settings of the client, which adapt
+        to the traffic and to the observed publish latency when adaptive batching is enabled.
+
+        Every publish future is tracked: once resolved, the records of its message are counted
+        as delivered or failed for their `ingestion_id` (see `delivery_report`). Packed messages
+        only ever hold records of a single ingestion.
 
         Args:
-            data (Union[List[Dict[str, str]], Dict[str, str]]): Event data to publish.
+            data (Union[Iterable[Dict[str, str]], Dict[str, str]]): Event data to publish.
                 - If a dictionary is provided, it is treated as a single event.
-                - If a list of dictionaries is provided, each dictionary represents an individual event.
+                - If an iterable of dictionaries is provided (such as a list or
+                  `TripBatch.to_records()`), each dictionary represents an individual event.
 
         Returns:
-            None
+            List[Future]: One publish future per message, resolved once Pub/Sub acknowledges it.
 
         Note:
-            Uses the Google Cloud Pub/Sub client with pre-configured batch settings.
+            Uses the Google Cloud Pub/Sub client with pre-configured batch settings and flow control,
+            so this call blocks while the in-flight limits are reached.
         """
-        import json
+        data = [data] if isinstance(data, dict) else data
+
+        publish_futures = []
+        total = 0
+        serialize_seconds = 0.0
+
+        for ingestion_id, records in itertools.groupby(
+            data, key=lambda d: str(d.get("ingestion_id"))
+        ):
+            messages = self.serializer.encode(records)
+
+            while True:
+                start = time.perf_counter()
+                encoded = next(messages, None)
+                serialize_seconds += time.perf_counter() - start
+
+                if encoded is None:
+                    break
+
+                message, count = encoded
+                publish_futures.append(
+                    self._publish(data=message, ingestion_id=ingestion_id, count=count)
+                )
+                total += count
+
+        self._metrics["serialize"].observe(serialize_seconds)
+
+        if self._batching and self._batching.observe_send(total):
+            self.__client.batch_settings = self._batching.batch_settings
+
+        return publish_futures
+
+    def _publish(self, data: bytes, ingestion_id: str, count: int) -> Future:
+        """
+        Publishes a single encoded message and registers its future in the delivery tracking.
+        """
+        size = len(data)
+        published_at = time.monotonic()
+
+        with self._lock:
+            self._inflight_messages += 1
+            self._inflight_bytes += size
+
+        self._metrics["inflight_messages"].inc()
+        self._metrics["inflight_bytes"].inc(size)
+        self._metrics["published_bytes"].inc(size)
+
+        future = self.__client.publish(
+            topic=self._topic_path, data=data, **self.serializer.attributes(count)
+        )
+
+        with self._lock:
+            self._records_per_future[future] = count
+
+        future.add_done_callback(
+            lambda f: self._on_done(
+                future=f,
+                ingestion_id=ingestion_id,
+                size=size,
+                count=count,
+                latency=time.monotonic() - published_at,
+            )
+        )
+
+        return future
+
+    def _on_done(
+        self, future: Future, ingestion_id: str, size: int, count: int, latency: float
+    ) -> None:
+        """
+        Releases the in-flight counters of a resolved future and records its outcome.
+        """
+        outcome = "failed" if future.exception() is not None else "delivered"
+
+        if self._batching and self._batching.observe(latency, outcome == "failed"):
+            self.__client.batch_settings = self._batching.batch_settings
+
+        self._metrics["inflight_messages"].dec()
+        self._metrics["inflight_bytes"].dec(size)
+        self._metrics[outcome].inc()
+        self._metrics["latency"].observe(latency)
+
+        with self._lock:
+            self._inflight_messages -= 1
+            self._inflight_bytes -= size
+
+            report = self._delivery_reports.setdefault(
+                ingestion_id, {"delivered": 0, "failed": 0}
+            )
+            report[outcome] += count
+            self._delivery_reports.move_to_end(ingestion_id)
+
+            if len(self._delivery_reports) > self._max_delivery_reports:
+                self._delivery_reports.popitem(last=False)
+
+    def wait(self, publish_futures: List[Future]) -> Dict[str, int]:
+        """
+        Blocks until the given publish futures are resolved and summarizes their outcome.
+
+        Args:
+            publish_futures (List[Future]): Futures returned by `send`.
+
+        Returns:
+            Dict[str, int]: A dictionary with the 'delivered' and 'failed' counts of the records
+            carried by the futures' messages.
+        """
+        report = {"delivered": 0, "failed": 0}
+        done, _ = futures.wait(publish_futures)
+
+        with self._lock:
+            for future in done:
+                outcome = "failed" if future.exception() is not None else "delivered"
+                report[outcome] += self._records_per_future.get(future, 1)
+
+        return report
+
+    def delivery_report(self, ingestion_id: str) -> Dict[str, int]:
+        """
+        Returns the number of delivered and failed messages of an ingestion.
+
+        Args:
+            ingestion_id (str): The ingestion ID carried by the published events.
+
+        Returns:
+            Dict[str, int]: A dictionary with the 'delivered' and 'failed' counts of resolved
+            publish futures, aggregated over every `send` call of the ingestion. Messages still
+            in flight are not counted.
+        """
+        with self._lock:
+            return dict(
+                self._delivery_reports.get(
+                    str(ingestion_id), {"delivered": 0, "failed": 0}
+                )
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Summarizes the current batch settings, the recent publish statistics and the messages
+        in flight.
+
+        Returns:
+            Dict[str, Any]: The 'topic', the in-flight 'messages' and 'bytes', and the settings
+            and statistics of `AdaptiveBatchSettings.stats`, when adaptive batching is enabled.
+        """
+        with self._lock:
+            inflight = {"messages": self._inflight_messages, "bytes": self._inflight_bytes}
+
+        stats = {"topic": self._topic_path, "inflight": inflight}
+
+        if self._batching:
+            stats.update(self._batching.stats())
+        else:
+            settings = self.__client.batch_settings
+            stats["batch_settings"] = {
+                "max_messages": settings.max_messages,
+                "max_bytes": settings.max_bytes,
+                "max_latency": settings.max_latency,
+            }
+
+        return stats
+
+    def is_saturated(self) -> bool:
+        """
+        Checks whether the publisher reached one of its in-flight limits.
+
+        Returns:
+            bool: True if a new `send` call would block waiting for acknowledgements.
+        """
+        with self._lock:
+            return (
+                self._inflight_messages >= self.max_inflight_messages
+                or self._inflight_bytes >= self.max_inflight_bytes
+            )
+
+
+class ShardedPubSubService:
+    """
+    Publishes events across several Pub/Sub topics, each with its own publisher client and
+    BigQuery subscription, to go past the throughput of a single topic.
+
+    Shard 0 is `topic_id` itself and shard `i` is `{topic_id}_{i}`, as created by Terraform
+    from `events_topic_shards`, so a single shard behaves exactly like `PubSubService`.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        topic_id: str,
+        shards: int = 1,
+        shard_key: str = "hash",
+        key_spread: int = 1,
+        max_inflight_messages: int = 10000,
+        max_inflight_bytes: int = 100 * 1024 * 1024,
+        serializer=None,
+        adaptive_batching: bool = True,
+    ):
+        """
+        Initializes the ShardedPubSubService with one `PubSubService` per shard.
+
+        Args:
+            project_id (str): The Google Cloud project ID.
+            topic_id (str): The Pub/Sub topic ID of the first shard.
+            shards (int, optional): The number of topics. Defaults to 1.
+            shard_key (str, optional): The record field routing the records, such as "region",
+                or "hash" to spread records evenly by a hash of all their fields. Defaults
+                to "hash".
+            key_spread (int, optional): The number of consecutive shards the records of a same
+                key may go to. Each record goes to the least loaded of them, so a hot key does
+                not saturate a single topic. Defaults to 1.
+            max_inflight_messages (int, optional): The maximum number of messages published but
+                not yet acknowledged, split evenly between the shards. Defaults to 10000.
+            max_inflight_bytes (int, optional): The maximum size in bytes of messages published
+                but not yet acknowledged, split evenly between the shards. Defaults to 100 MB.
+            serializer (optional): The wire format of the events, shared by every shard.
+                Defaults to `JsonSerializer`.
+            adaptive_batching (bool, optional): If True, the batch settings of every shard are
+                tuned at runtime. Defaults to True.
+        """
+        self.shard_key = shard_key
+        self.key_spread = max(1, min(key_spread, shards))
+        self.shards = [
+            PubSubService(
+                project_id=project_id,
+                topic_id=topic_id if shard == 0 else f"{topic_id}_{shard}",
+                max_inflight_messages=max(1, max_inflight_messages // shards),
+                max_inflight_bytes=max(1, max_inflight_bytes // shards),
+                serializer=serializer,
+                adaptive_batching=adaptive_batching,
+            )
+            for shard in range(shards)
+        ]
+
+    def send(self, data: Union[Iterable[Dict[str, str]], Dict[str, str]]) -> List[Future]:
+        """
+        Routes event data to the shards and publishes it (see `PubSubService.send`).
+
+        Args:
+            data (Union[Iterable[Dict[str, str]], Dict[str, str]]): Event data to publish.
+
+        Returns:
+            List[Future]: One publish future per message, resolved once Pub/Sub acknowledges it.
+        """
+        if len(self.shards) == 1:
+            return self.shards[0].send(data)
 
         data = [data] if isinstance(data, dict) else data
+        routed: List[List[Dict[str, str]]] = [[] for _ in self.shards]
+
+        for record in data:
+            routed[self._route(record, routed)].append(record)
+
+        return [
+            future
+            for shard, records in zip(self.shards, routed)
+            if records
+            for future in shard.send(records)
+        ]
+
+    def _route(self, record: Dict[str, str], routed: List[List[Dict[str, str]]]) -> int:
+        """
+        Picks the shard of a record: the least loaded of the `key_spread` shards of its key,
+        counting both its messages in flight and the records already routed to it.
+        """
+        if self.shard_key == "hash":
+            key = "\x1f".join(str(value) for value in record.values())
+        else:
+            key = str(record.get(self.shard_key))
+
+        first = zlib.crc32(key.encode("utf-8")) % len(self.shards)
+
+        if self.key_spread == 1:
+            return first
+
+        candidates = [
+            (first + offset) % len(self.shards) for offset in range(self.key_spread)
+        ]
+
+        return min(
+            candidates,
+            key=lambda shard: self.shards[shard]._inflight_messages
+            + len(routed[shard]),
+        )
+
+    def wait(self, publish_futures: List[Future]) -> Dict[str, int]:
+        """
+        Blocks until the given publish futures are resolved and summarizes their outcome
+        (see `PubSubService.wait`).
+        """
+        report = {"delivered": 0, "failed": 0}
 
-        for d in data:
-            encoded_data = json.dumps(d, default=str).encode("utf-8")
-            self.__client.publish(topic=self._topic_path, data=encoded_data)
+        for shard in self.shards:
+            owned = [f for f in publish_futures if f in shard._records_per_future]
+            if owned:
+                for outcome, count in shard.wait(owned).items():
+                    report[outcome] += count
+
+        return report
+
+    def delivery_report(self, ingestion_id: str) -> Dict[str, int]:
+        """
+        Returns the number of delivered and failed records of an ingestion, over every shard
+        (see `PubSubService.delivery_report`).
+        """
+        report = {"delivered": 0, "failed": 0}
+
+        for shard in self.shards:
+            for outcome, count in shard.delivery_report(ingestion_id).items():
+                report[outcome] += count
+
+        return report
+
+    def is_saturated(self) -> bool:
+        """
+        Checks whether one of the shards reached one of its in-flight limits.
+
+        Returns:
+            bool: True if a new `send` call may block waiting for acknowledgements.
+        """
+        return any(shard.is_saturated() for shard in self.shards)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Summarizes the batch settings and publish statistics of every shard
+        (see `PubSubService.stats`).
+        """
+        return {"shards": [shard.stats() for shard in self.shards]}
@@ -0,0 +1,147 @@
+import math
+import re
+from typing import Dict, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+NUMBER_PATTERN = r"[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?"
+POINT_PATTERN = (
+    rf"^POINT ?\(\s*(?P<lon>{NUMBER_PATTERN})\s+(?P<lat>{NUMBER_PATTERN})\s*\)$"
+)
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# 6 characters are cells of about 1.2 km x 0.6 km, the same as BigQuery ST_GEOHASH(geo, 6).
+GEOHASH_PRECISION = 6
+# The columns derived from each coordinate column, in the order they are added.
+GEO_COLUMNS = {
+    "origin_coord": ("origin_lon", "origin_lat", "origin_cell"),
+    "destination_coord": ("destination_lon", "destination_lat", "destination_cell"),
+}
+
+_point = re.compile(POINT_PATTERN)
+_alphabet = pa.array(list(GEOHASH_ALPHABET))
+
+
+def geohash(lon: float, lat: float, precision: int = GEOHASH_PRECISION) -> str:
+    """
+    Encodes a point as a geohash.
+
+    Args:
+        lon (float): The longitude, in [-180, 180].
+        lat (float): The latitude, in [-90, 90].
+        precision (int, optional): The number of characters. Defaults to 6.
+
+    Returns:
+        str: The geohash of the cell containing the point.
+    """
+    bits = precision * 5
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    x = min(math.floor((lon + 180) / 360 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    y = min(math.floor((lat + 90) / 180 * (1 << lat_bits)), (1 << lat_bits) - 1)
+
+    code = 0
+    for i in range(bits):
+        if i % 2 == 0:
+            lon_bits -= 1
+            code = (code << 1) | ((x >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            code = (code << 1) | ((y >> lat_bits) & 1)
+
+    return "".join(
+        GEOHASH_ALPHABET[(code >> (5 * (precision - 1 - i))) & 31]
+        for i in range(precision)
+    )
+
+
+def point_fields(column: str, coord: Optional[str]) -> Dict[str, Optional[object]]:
+    """
+    Derives the longitude, latitude and cell columns of one coordinate.
+
+    Args:
+        column (str): The coordinate column, `origin_coord` or `destination_coord`.
+        coord (str, optional): A `POINT (lon lat)` WKT.
+
+    Returns:
+        Dict[str, Optional[object]]: The derived columns, None when the WKT is not a point.
+    """
+    lon_column, lat_column, cell_column = GEO_COLUMNS[column]
+    match = _point.match(coord or "")
+
+    if not match:
+        return {lon_column: None, lat_column: None, cell_column: None}
+
+    lon, lat = float(match["lon"]), float(match["lat"])
+    return {lon_column: lon, lat_column: lat, cell_column: geohash(lon, lat)}
+
+
+def parse_points(coords: pa.ChunkedArray) -> Tuple[pa.ChunkedArray, pa.ChunkedArray]:
+    """
+    Parses `POINT (lon lat)` WKT values into longitudes and latitudes, null when malformed.
+    """
+    points = pc.extract_regex(coords, POINT_PATTERN)
+
+    return (
+        pc.cast(pc.struct_field(points, "lon"), pa.float64()),
+        pc.cast(pc.struct_field(points, "lat"), pa.float64()),
+    )
+
+
+def geohashes(
+    lon: pa.ChunkedArray, lat: pa.ChunkedArray, precision: int = GEOHASH_PRECISION
+) -> pa.ChunkedArray:
+    """
+    Encodes points as geohashes, with Arrow compute kernels, like `geohash` does for one point.
+    """
+    bits = precision * 5
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    x = _quantize(lon, -180, 360, lon_bits)
+    y = _quantize(lat, -90, 180, lat_bits)
+
+    # Interleaves the bits, the longitude taking the first one.
+    code = pc.multiply(x, 0)
+    for i in range(bits):
+        if i % 2 == 0:
+            lon_bits -= 1
+            bit = pc.bit_wise_and(pc.shift_right(x, lon_bits), 1)
+        else:
+            lat_bits -= 1
+            bit = pc.bit_wise_and(pc.shift_right(y, lat_bits), 1)
+        code = pc.bit_wise_or(code, pc.shift_left(bit, bits - 1 - i))
+
+    characters = [
+        pc.take(
+            _alphabet,
+            pc.bit_wise_and(pc.shift_right(code, 5 * (precision - 1 - i)), 31),
+        )
+        for i in range(precision)
+    ]
+
+    return pc.binary_join_element_wise(*characters, "")
+
+
+def _quantize(
+    values: pa.ChunkedArray, start: float, span: float, bits: int
+) -> pa.ChunkedArray:
+    scaled = pc.floor(pc.multiply(pc.subtract(values, start), (1 << bits) / span))
+    return pc.min_element_wise(pc.cast(scaled, pa.int64()), (1 << bits) - 1)
+
+
+def add_geo_columns(table: pa.Table) -> pa.Table:
+    """
+    Appends the longitude, latitude and geohash cell of the origin and destination of every
+    trip, so queries can filter on numbers and cells instead of parsing WKT per row.
+
+    Args:
+        table (pa.Table): Trips with valid `origin_coord` and `destination_coord` columns.
+
+    Returns:
+        pa.Table: The table with the `GEO_COLUMNS` appended.
+    """
+    for column, (lon_column, lat_column, cell_column) in GEO_COLUMNS.items():
+        lon, lat = parse_points(table[column])
+        table = table.append_column(lon_column, lon)
+        table = table.append_column(lat_column, lat)
+        table = table.append_column(cell_column, geohashes(lon, lat))
+
+    return table
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
+from typing import Any, Callable, Dict, Optional
+
+
+class Job:
+    """
+    Tracks the progress of an ingestion running in the background.
+    """
+
+    def __init__(self, ingestion_id: str) -> None:
+        """
+        Initializes a queued Job.
+
+        Args:
+            ingestion_id (str): The ingestion ID identifying the job.
+        """
+        self.ingestion_id = ingestion_id
+        self.state = "queued"
+        self.rows_read = 0
+        self.rows_published = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Identifier of the thread running the job, used to profile it.
+        self.thread_id: Optional[int] = None
+
+    def update(self, rows_read: int, rows_published: int) -> None:
+        """
+        Records the number of rows read and published so far.
+
+        Args:
+            rows_read (int): The number of rows read from the source.
+            rows_published (int): The number of rows acknowledged by Pub/Sub.
+        """
+        self.rows_read = rows_read
+        self.rows_published = rows_published
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Summarizes the job, including its elapsed time and publish throughput.
+
+        Returns:
+            Dict[str, Any]: The state, row counts, elapsed seconds, rows per second and,
+            once finished, the result or the error of the job.
+        """
+        elapsed = 0.0
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        return {
+            "ingestion_id": self.ingestion_id,
+            "state": self.state,
+            "rows_read": self.rows_read,
+            "rows_published": self.rows_published,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows_published / elapsed, 1)
+            if elapsed
+            else 0.0,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobRegistry:
+    """
+    Runs ingestions in the background on a bounded pool of threads and keeps track of them.
+    """
+
+    def __init__(
+        self, max_workers: int, max_pending: int, max_jobs: int = 1000
+    ) -> None:
+        """
+        Initializes the JobRegistry.
+
+        Args:
+            max_workers (int): The number of jobs running at the same time.
+            max_pending (int): The number of jobs queued or running at the same time. New jobs
+                are rejected beyond this limit.
+            max_jobs (int, optional): The number of jobs kept in the registry, including finished
+                ones. The oldest finished jobs are forgotten first. Defaults to 1000.
+        """
+        self.__executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingestion-job"
+        )
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self._pending = 0
+        self._jobs: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self, ingestion_id: str, fn: Callable[[Job], Dict[str, Any]]
+    ) -> Optional[Job]:
+        """
+        Queues an ingestion.
+
+        Args:
+            ingestion_id (str): The ingestion ID identifying the job.
+            fn (Callable[[Job], Dict[str, Any]]): The ingestion to run. It receives the job to
+                report its progress on and returns the result of the ingestion.
+
+        Returns:
+            Optional[Job]: The queued job, or None if the registry is already running or
+            queueing `max_pending` jobs.
+        """
+        job = Job(ingestion_id=str(ingestion_id))
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+
+            self._pending += 1
+            self._jobs[job.ingestion_id] = job
+            self._evict()
+
+        self.__executor.submit(self._run, job, fn)
+
+        return job
+
+    def alias(self, job: Job, ingestion_id: str) -> None:
+        """
+        Identifies a job by another ingestion ID as well, such as the ID of the interrupted
+        ingestion a file resumes, and reports that ID in its summary.
+
+        Args:
+            job (Job): A job of the registry.
+            ingestion_id (str): The other ingestion ID of the job.
+        """
+        with self._lock:
+            job.ingestion_id = str(ingestion_id)
+            self._jobs[job.ingestion_id] = job
+
+    def get(self, ingestion_id: str) -> Optional[Job]:
+        """
+        Returns the job of an ingestion ID, or None if it is unknown.
+        """
+        with self._lock:
+            return self._jobs.get(str(ingestion_id))
+
+    def _run(self, job: Job, fn: Callable[[Job], Dict[str, Any]]) -> None:
+        """
+        Runs a job and records its outcome.
+        """
+        job.state = "running"
+        job.started_at = time.time()
+        job.thread_id = threading.get_ident()
+
+        try:
+            job.result = fn(job)
+            job.state = "finished"
+        except Exception as e:
+            job.error = repr(e)
+            job.state = "failed"
+        finally:
+            job.finished_at = time.time()
+            job.thread_id = None
+
+            with self._lock:
+                self._pending -= 1
+
+    def _evict(self) -> None:
+        """
+        Forgets the oldest finished jobs beyond `max_jobs`. Must be called holding the lock.
+        """
+        for ingestion_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[ingestion_id].state in ("finished", "failed"):
+                del self._jobs[ingestion_id]
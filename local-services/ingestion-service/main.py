@@ -1,19 +1,393 @@
+import functools
+import hmac
 import os
-from typing import List
-
+import tempfile
+import uuid
+import zlib
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+import pyarrow as pa
+from dedup import TripDeduplicator
 from fastapi import FastAPI, Request
-from gcp import PubSubService
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from gcp import PubSubService, ShardedPubSubService
+from jobs import Job, JobRegistry
+from manifest import IngestionManifest
+from metrics import render
 from models import Event
-from utils import DataFormatter, FileHandler
+from pipeline import (
+    BatchPublisher,
+    ingest_files_in_parallel,
+    stream_columnar,
+    stream_file,
+)
+from profiling import sample_stacks
+from serializers import AvroPackedSerializer, JsonSerializer
+from utils import TRIP_SCHEMA, DataFormatter, FileHandler
+from validation import BatchValidator, DeadLetterSink
+from watcher import DirectoryWatcher
 
 PROJECT_ID = os.environ["PROJECT_ID"]
 EVENTS_TOPIC_ID = os.environ["EVENTS_TOPIC_ID"]
 STATUS_TOPIC_ID = os.environ["STATUS_TOPIC_ID"]
 CSV_PROCESSED_FOLDER = os.environ["CSV_PROCESSED_FOLDER"]
+CSV_REJECTED_FOLDER = os.environ.get("CSV_REJECTED_FOLDER", "rejected")
+CSV_CHUNK_SIZE = int(os.environ.get("CSV_CHUNK_SIZE", 10000))
+MANIFEST_FOLDER = os.environ.get("MANIFEST_FOLDER", "manifests")
+DEDUP_ENABLED = bool(int(os.environ.get("DEDUP_ENABLED", 0)))
+DEDUP_FOLDER = os.environ.get("DEDUP_FOLDER", "dedup")
+DEDUP_CAPACITY = int(os.environ.get("DEDUP_CAPACITY", 10_000_000))
+DEDUP_ERROR_RATE = float(os.environ.get("DEDUP_ERROR_RATE", 0.01))
+DEDUP_RETENTION_DAYS = float(os.environ.get("DEDUP_RETENTION_DAYS", 90))
+WATCH_DIRS = [d for d in os.environ.get("WATCH_DIRS", "").split(",") if d]
+WATCH_HAS_HEADER = bool(int(os.environ.get("WATCH_HAS_HEADER", 1)))
+WATCH_POLL_SECONDS = float(os.environ.get("WATCH_POLL_SECONDS", 2))
+DEBUG_PROFILE_TOKEN = os.environ.get("DEBUG_PROFILE_TOKEN")
+DEBUG_PROFILE_MAX_SECONDS = float(os.environ.get("DEBUG_PROFILE_MAX_SECONDS", 60))
+PUBLISHER_MAX_INFLIGHT_MESSAGES = int(
+    os.environ.get("PUBLISHER_MAX_INFLIGHT_MESSAGES", 10000)
+)
+PUBLISHER_MAX_INFLIGHT_BYTES = int(
+    os.environ.get("PUBLISHER_MAX_INFLIGHT_BYTES", 100 * 1024 * 1024)
+)
+PUBLISHER_RETRY_AFTER_SECONDS = int(os.environ.get("PUBLISHER_RETRY_AFTER_SECONDS", 5))
+PUBLISHER_ADAPTIVE_BATCHING = bool(
+    int(os.environ.get("PUBLISHER_ADAPTIVE_BATCHING", 1))
+)
+EVENTS_WIRE_FORMAT = os.environ.get("EVENTS_WIRE_FORMAT", "json")
+AVRO_EVENTS_TOPIC_ID = os.environ.get("AVRO_EVENTS_TOPIC_ID")
+TRIPS_SCHEMA_PATH = os.environ.get(
+    "TRIPS_SCHEMA_PATH", "/home/user/schema/trips_schema.json"
+)
+RECORDS_PER_MESSAGE = int(os.environ.get("RECORDS_PER_MESSAGE", 1000))
+EVENTS_TOPIC_SHARDS = int(os.environ.get("EVENTS_TOPIC_SHARDS", 1))
+EVENTS_SHARD_KEY = os.environ.get("EVENTS_SHARD_KEY", "hash")
+EVENTS_SHARD_KEY_SPREAD = int(os.environ.get("EVENTS_SHARD_KEY_SPREAD", 1))
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", os.cpu_count() or 1))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", 100))
+BULK_CHUNK_BYTES = int(os.environ.get("BULK_CHUNK_BYTES", 4 * 1024 * 1024))
+BULK_SPOOL_MAX_BYTES = int(os.environ.get("BULK_SPOOL_MAX_BYTES", 64 * 1024 * 1024))
+
+if EVENTS_WIRE_FORMAT not in ("json", "avro"):
+    raise ValueError(
+        f"Unsupported EVENTS_WIRE_FORMAT {EVENTS_WIRE_FORMAT}. Use 'json' or 'avro'."
+    )
+# The BigQuery subscription of the events topic writes one row per JSON message, so packed
+# messages go to a topic whose consumers decode them with `AvroPackedSerializer.decode`.
+if EVENTS_WIRE_FORMAT == "avro" and not AVRO_EVENTS_TOPIC_ID:
+    raise ValueError(
+        "EVENTS_WIRE_FORMAT=avro requires AVRO_EVENTS_TOPIC_ID, the topic of the consumers "
+        "decoding packed messages: the BigQuery subscription cannot write them."
+    )
+
+BULK_CONTENT_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+EVENTS_PUBLISHER_CONFIG = {
+    "project_id": PROJECT_ID,
+    "topic_id": (
+        AVRO_EVENTS_TOPIC_ID if EVENTS_WIRE_FORMAT == "avro" else EVENTS_TOPIC_ID
+    ),
+    "shards": EVENTS_TOPIC_SHARDS,
+    "shard_key": EVENTS_SHARD_KEY,
+    "key_spread": EVENTS_SHARD_KEY_SPREAD,
+    "max_inflight_messages": PUBLISHER_MAX_INFLIGHT_MESSAGES,
+    "max_inflight_bytes": PUBLISHER_MAX_INFLIGHT_BYTES,
+    "adaptive_batching": PUBLISHER_ADAPTIVE_BATCHING,
+    "serializer": (
+        AvroPackedSerializer(
+            schema_path=TRIPS_SCHEMA_PATH, records_per_message=RECORDS_PER_MESSAGE
+        )
+        if EVENTS_WIRE_FORMAT == "avro"
+        else JsonSerializer()
+    ),
+}
+
+DEDUP_CONFIG = (
+    {
+        "path": FileHandler(dir=DEDUP_FOLDER).path,
+        "capacity": DEDUP_CAPACITY,
+        "error_rate": DEDUP_ERROR_RATE,
+        "retention_days": DEDUP_RETENTION_DAYS,
+    }
+    if DEDUP_ENABLED
+    else None
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Watches the `WATCH_DIRS` directories while the app is running, ingesting every new file
+    as soon as it is fully written.
+    """
+    watchers = []
+
+    for directory in WATCH_DIRS:
+        file_handler = FileHandler(dir=directory)
+        watchers.append(
+            DirectoryWatcher(
+                file_handler=file_handler,
+                on_file=functools.partial(_ingest_watched_file, file_handler),
+                poll_interval=WATCH_POLL_SECONDS,
+            )
+        )
 
-app = FastAPI()
-events_publisher = PubSubService(project_id=PROJECT_ID, topic_id=EVENTS_TOPIC_ID)
+    for watcher in watchers:
+        watcher.start()
+
+    yield
+
+    for watcher in watchers:
+        watcher.stop()
+
+    # The filter is saved by every file and bulk ingestion, but not by `/ingest` calls.
+    if deduplicator:
+        deduplicator.save()
+
+
+app = FastAPI(lifespan=lifespan)
+events_publisher = ShardedPubSubService(**EVENTS_PUBLISHER_CONFIG)
 status_publisher = PubSubService(project_id=PROJECT_ID, topic_id=STATUS_TOPIC_ID)
+job_registry = JobRegistry(max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING)
+manifest = IngestionManifest(FileHandler(dir=MANIFEST_FOLDER).path)
+deduplicator = TripDeduplicator(**DEDUP_CONFIG) if DEDUP_CONFIG else None
+
+
+def _too_many_requests(message: str) -> JSONResponse:
+    """
+    Builds a 429 response asking the invoker to retry after `PUBLISHER_RETRY_AFTER_SECONDS`.
+    """
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(PUBLISHER_RETRY_AFTER_SECONDS)},
+        content={
+            "message": f"{message} Please retry in {PUBLISHER_RETRY_AFTER_SECONDS} seconds."
+        },
+    )
+
+
+def _run(
+    request: Request,
+    ingestion_id: uuid.UUID,
+    fn: Callable[[Optional[Job]], Dict[str, Any]],
+):
+    """
+    Runs an ingestion right away, or as a background job when the "background" header is 1.
+
+    Args:
+        request (Request): The HTTP request of the ingestion.
+        ingestion_id (uuid.UUID): The ingestion ID identifying the job.
+        fn (Callable[[Optional[Job]], Dict[str, Any]]): The ingestion, receiving the job to
+            report its progress on (None when run right away) and returning its result.
+
+    Returns:
+        The result of the ingestion, or a 202 response pointing to `/jobs/{ingestion_id}` for
+        background jobs, or a 429 response when the job queue is full.
+    """
+    if not bool(int(request.headers.get("background") or 0)):
+        return fn(None)
+
+    job = job_registry.submit(ingestion_id=ingestion_id, fn=fn)
+
+    if job is None:
+        return _too_many_requests("The ingestion job queue is full.")
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": (
+                "The Ingestion Job was queued at backend side. "
+                f"Its progress can be followed at /jobs/{job.ingestion_id}."
+            ),
+            "ingestion_id": job.ingestion_id,
+        },
+    )
+
+
+async def _read_body(request: Request) -> AsyncGenerator[bytes, None]:
+    """
+    Yields the request body as it arrives, gunzipped when the "Content-Encoding" header is gzip.
+    Decompressed pieces are capped at `BULK_CHUNK_BYTES`, so a small compressed upload cannot
+    expand into a large buffer at once.
+    """
+    if request.headers.get("content-encoding", "").lower() != "gzip":
+        async for data in request.stream():
+            yield data
+        return
+
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+    async for data in request.stream():
+        while data:
+            decompressed = decompressor.decompress(data, BULK_CHUNK_BYTES)
+            data = decompressor.unconsumed_tail
+            if decompressed:
+                yield decompressed
+
+    if tail := decompressor.flush():
+        yield tail
+
+
+class LineTooLong(ValueError):
+    """
+    Raised when an NDJSON upload has a line longer than the chunks it is parsed in allow.
+    """
+
+
+async def _ndjson_chunks(
+    body: AsyncGenerator[bytes, None], chunk_bytes: int
+) -> AsyncGenerator[bytes, None]:
+    """
+    Regroups a byte stream into chunks of about `chunk_bytes` made of complete NDJSON lines.
+
+    Raises:
+        LineTooLong: If a line is longer than `2 * chunk_bytes`, which bounds the buffer of
+            a body without newlines.
+    """
+    buffer = bytearray()
+
+    async for data in body:
+        buffer += data
+
+        if len(buffer) >= chunk_bytes:
+            end = buffer.rfind(b"\n") + 1
+            if end:
+                yield bytes(buffer[:end])
+                del buffer[:end]
+
+        if len(buffer) > 2 * chunk_bytes:
+            raise LineTooLong(f"A line is longer than {2 * chunk_bytes} bytes.")
+
+    if buffer.strip():
+        yield bytes(buffer)
+
+
+def _ingest_file(
+    file_handler: FileHandler,
+    file_name: str,
+    has_header: bool,
+    ingestion_id: uuid.UUID,
+    job: Optional[Job],
+) -> Dict[str, Any]:
+    """
+    Streams a file through the events publisher, publishes its ingestion status, marks it as
+    completed in the manifest and moves it to `CSV_PROCESSED_FOLDER`.
+
+    The manifest entry of the file is opened here, as hashing the file reads all of it: a
+    file that was already ingested is only moved, and an interrupted one resumes under the
+    ingestion ID of its entry, which then also identifies the job.
+
+    Args:
+        file_handler (FileHandler): The handler pointing to the directory of the file.
+        file_name (str): The name of the file, relative to the directory.
+        has_header (bool): If True, the first line of a CSV file is skipped.
+        ingestion_id (uuid.UUID): The ingestion ID of the file, unless it resumes.
+        job (Job, optional): The background job to report progress on, if any.
+
+    Returns:
+        Dict[str, Any]: A confirmation message and the ingestion status of the file.
+
+    Raises:
+        RuntimeError: If the ingestion status could not be published. The file is left in
+            place and is not marked as completed, so a retry publishes the status again.
+    """
+    digest = manifest.file_digest(file_handler.path / file_name)
+
+    # A copy of the file ingested at the same time waits here, then finds it completed.
+    with manifest.lock(digest):
+        checkpoint = manifest.get(digest)
+
+        if checkpoint.completed:
+            file_handler.move_file(file_name, processed_folder=CSV_PROCESSED_FOLDER)
+
+            return {
+                "message": (
+                    "The file was already ingested and was not published again. "
+                    "Files were moved to processed folder."
+                ),
+                **checkpoint.status,
+            }
+
+        formatter = DataFormatter(ingestion_id=checkpoint.ingestion_id or ingestion_id)
+        if job and checkpoint.ingestion_id:
+            job_registry.alias(job, formatter.ingestion_id)
+
+        checkpoint.start(file_name, formatter.ingestion_id)
+
+        counts = stream_file(
+            file_handler=file_handler,
+            file=file_name,
+            has_header=has_header,
+            formatter=formatter,
+            publisher=events_publisher,
+            chunk_size=CSV_CHUNK_SIZE,
+            progress=job.update if job else None,
+            dead_letter=DeadLetterSink(
+                file_handler.dead_letter_path(
+                    file_name, rejected_folder=CSV_REJECTED_FOLDER
+                )
+            ),
+            checkpoint=checkpoint,
+            deduplicator=deduplicator,
+        )
+
+        status = formatter.generate_ingestion_status(**counts)
+
+        if status_publisher.wait(status_publisher.send(status))["failed"]:
+            raise RuntimeError(
+                f"The ingestion status of {file_name} could not be published. "
+                "The file was left in place, retry its ingestion to publish it again."
+            )
+
+        checkpoint.complete()
+        file_handler.move_file(file_name, processed_folder=CSV_PROCESSED_FOLDER)
+
+        return {
+            "message": (
+                "The Ingestion Job was successfully created at backend side. "
+                "A notification will be sent to #ingestion-jobs slack channel as soon as "
+                "the ingestion finishes. "
+                "Files were moved to processed folder."
+            ),
+            **status,
+        }
+
+
+def _ingest_watched_file(file_handler: FileHandler, file: Path) -> bool:
+    """
+    Queues the ingestion of a file reported by a `DirectoryWatcher` as a background job.
+
+    Args:
+        file_handler (FileHandler): The handler pointing to the watched directory.
+        file (Path): The path of the file, relative to the watched directory.
+
+    Returns:
+        bool: False if the job queue is full, so the watcher offers the file again later.
+    """
+    ingestion_id = uuid.uuid4()
+
+    job = job_registry.submit(
+        ingestion_id=ingestion_id,
+        fn=lambda job: _ingest_file(
+            file_handler=file_handler,
+            file_name=str(file),
+            has_header=WATCH_HAS_HEADER,
+            ingestion_id=ingestion_id,
+            job=job,
+        ),
+    )
+
+    return job is not None
 
 
 @app.get("/")
@@ -22,17 +396,23 @@ def read_root():
 
 
 @app.post("/ingest")
-def ingest(events: List[Event]):
+def ingest(request: Request, events: List[Event]):
     """
     Ingests a list of event data, formats it, and initiates the ingestion process.
 
     This endpoint accepts a list of `Event` objects, processes each event to the
     required data format, and then publishes both the data and ingestion status
-    using dedicated publishers. The function returns a success message and the
-    ingestion status, indicating that the backend ingestion job has been successfully
-    created.
+    using dedicated publishers. The events are only reported once Pub/Sub has
+    acknowledged them, and the ingestion status carries the number of delivered events.
+    With `DEDUP_ENABLED`, the events are first validated like those of `/ingest/bulk`, so
+    no key is claimed for an event BigQuery would refuse: invalid events are written to the
+    `{ingestion_id}.rejected.csv` dead-letter file in `CSV_REJECTED_FOLDER` and reported as
+    'rejected'. The events that were already ingested are then dropped, and reported as
+    'duplicates'.
 
     Args:
+        request (Request): The HTTP request object containing headers with metadata.
+            - "background" (str, optional): 1 to run the ingestion as a background job.
         events (List[Event]): A list of event data objects to be ingested.
 
     Returns:
@@ -40,18 +420,187 @@ def ingest(events: List[Event]):
             - "message" (str): Confirmation message for the ingestion job.
             - `status` (dict): Status details about the ingestion process, as
               generated by the `DataFormatter`.
+            - "delivered" (int) and "failed" (int): The publish outcome of the events.
+
+        When the events publisher has reached its in-flight limits, a 429 response with
+        a `Retry-After` header is returned instead and nothing is published. Background
+        jobs are answered right away with a 202 response carrying the ingestion ID.
 
     Note:
         A notification will be sent to the #ingestion-jobs Slack channel upon
         completion of the ingestion process.
     """
 
+    if events_publisher.is_saturated():
+        return _too_many_requests("The ingestion backend is saturated.")
+
     formatter = DataFormatter()
-    data = list(formatter.from_pydantic(data=events))
-    status = formatter.generate_ingestion_status(data)
 
-    events_publisher.send(data)
-    status_publisher.send(status)
+    def run(job: Optional[Job]) -> Dict[str, Any]:
+        kept, rejected, duplicates = events, 0, 0
+
+        if deduplicator:
+            batch = BatchValidator().validate(
+                formatter.from_arrow(
+                    pa.Table.from_pylist(
+                        [event.__dict__ for event in events], schema=TRIP_SCHEMA
+                    )
+                )
+            )
+            rejected = len(batch.rejected)
+            if rejected:
+                dead_letter = DeadLetterSink(
+                    FileHandler(dir=CSV_REJECTED_FOLDER).dead_letter_path(
+                        str(formatter.ingestion_id), rejected_folder=CSV_REJECTED_FOLDER
+                    )
+                )
+                dead_letter.write(batch.rejected)
+                dead_letter.close()
+
+            batch, duplicates = deduplicator.filter_batch(batch)
+            kept = [events[line - 1] for line in batch.line_numbers.to_pylist()]
+
+        data = list(formatter.from_pydantic(data=kept))
+
+        delivery_report = events_publisher.wait(events_publisher.send(data))
+        if deduplicator and delivery_report["failed"]:
+            deduplicator.release(batch)
+        if job:
+            job.update(
+                rows_read=len(events), rows_published=delivery_report["delivered"]
+            )
+
+        status = formatter.generate_ingestion_status(
+            count=delivery_report["delivered"], rejected=rejected, duplicates=duplicates
+        )
+        status_publisher.send(status)
+
+        return {
+            "message": (
+                "The Ingestion Job was successfully created at backend side. "
+                "A notification will be sent to #ingestion-jobs slack channel as soon as "
+                "the ingestion finishes."
+            ),
+            **status,
+            **delivery_report,
+        }
+
+    return _run(request=request, ingestion_id=formatter.ingestion_id, fn=run)
+
+
+@app.post("/ingest/bulk")
+async def ingest_bulk(request: Request):
+    """
+    Ingests a large upload of events while it is being received.
+
+    This endpoint reads the request body incrementally and publishes the events in columnar
+    batches, without building a pydantic model per event. The format of the body is taken from
+    the "Content-Type" header:
+        - "application/x-ndjson" (or "application/jsonl"): one JSON event per line, parsed in
+          chunks of about `BULK_CHUNK_BYTES` as they arrive.
+        - "application/vnd.apache.arrow.stream": an Arrow IPC stream.
+        - "application/vnd.apache.parquet" (or "application/x-parquet"): a Parquet file.
+    Arrow and Parquet bodies are spooled to a temporary file (in memory up to
+    `BULK_SPOOL_MAX_BYTES`, on disk beyond) and read back batch by batch. Any body can be
+    gzip-compressed, with the "Content-Encoding: gzip" header.
+
+    Events are validated batch by batch, and invalid ones are written with their record number
+    to the `{ingestion_id}.rejected.csv` dead-letter file in `CSV_REJECTED_FOLDER`. With
+    `DEDUP_ENABLED`, the events that were already ingested are dropped and counted as
+    'duplicates'.
+
+    Args:
+        request (Request): The HTTP request carrying the events in its body.
+
+    Returns:
+        dict: A dictionary containing:
+            - "message" (str): Confirmation message for the ingestion job.
+            - `status` (dict): Status details about the ingestion process, as
+              generated by the `DataFormatter`, with the counts of accepted and rejected events.
+
+        A 415 response is returned for unsupported content types, a 429 response when the
+        events publisher is saturated, a 400 response when the body cannot be parsed, and a
+        413 response when an NDJSON line is longer than `2 * BULK_CHUNK_BYTES`. In the latter
+        cases, the events published before the error are kept and reported.
+
+    Note:
+        A notification will be sent to the #ingestion-jobs Slack channel upon
+        completion of the ingestion process.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body_format = BULK_CONTENT_TYPES.get(content_type)
+
+    if body_format is None:
+        return JSONResponse(
+            status_code=415,
+            content={
+                "message": f"Unsupported content type {content_type}. "
+                f"Supported content types are {', '.join(BULK_CONTENT_TYPES)}."
+            },
+        )
+
+    if events_publisher.is_saturated():
+        return _too_many_requests("The ingestion backend is saturated.")
+
+    formatter = DataFormatter()
+    batch_publisher = BatchPublisher(
+        publisher=events_publisher,
+        dead_letter=DeadLetterSink(
+            FileHandler(dir=CSV_REJECTED_FOLDER).dead_letter_path(
+                str(formatter.ingestion_id), rejected_folder=CSV_REJECTED_FOLDER
+            )
+        ),
+        deduplicator=deduplicator,
+    )
+    error = None
+    status_code = 400
+
+    try:
+        if body_format == "ndjson":
+            async for chunk in _ndjson_chunks(_read_body(request), BULK_CHUNK_BYTES):
+                await run_in_threadpool(
+                    lambda: batch_publisher.publish(
+                        formatter.from_ndjson_batch(
+                            chunk,
+                            first_line=batch_publisher.rows + 1,
+                        )
+                    )
+                )
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MAX_BYTES) as spool:
+                async for data in _read_body(request):
+                    spool.write(data)
+                spool.seek(0)
+
+                await run_in_threadpool(
+                    stream_columnar,
+                    source=spool,
+                    file_format=body_format,
+                    formatter=formatter,
+                    batch_publisher=batch_publisher,
+                    chunk_size=CSV_CHUNK_SIZE,
+                )
+    except (pa.ArrowInvalid, KeyError, zlib.error) as e:
+        error = f"The request body could not be parsed: {e}"
+    except LineTooLong as e:
+        error = f"The request body was rejected: {e}"
+        status_code = 413
+
+    counts = await run_in_threadpool(batch_publisher.close)
+
+    status = formatter.generate_ingestion_status(**counts)
+    if counts["count"]:
+        status_publisher.send(status)
+
+    if error:
+        return JSONResponse(
+            status_code=status_code,
+            content={
+                "message": error,
+                **status,
+                "ingestion_id": str(formatter.ingestion_id),
+            },
+        )
 
     return {
         "message": (
@@ -69,13 +618,27 @@ def ingest_csv_file(request: Request, directory: str, file_name: str):
     Ingests data from a specified CSV file, processes it, and initiates the ingestion process.
 
     This endpoint retrieves and processes a CSV file specified by `directory` and `file_name`.
-    The file data is formatted, ingested, and the ingestion status is published. Upon successful
-    ingestion, the file is moved to a designated "processed" folder.
+    Gzip (.csv.gz) and zstd (.csv.zst) compressed CSV files and Parquet files are read directly,
+    the format being detected from the extension or the magic bytes of the file. The file is streamed in chunks of `CSV_CHUNK_SIZE` lines through the formatter and the
+    publisher, so memory usage does not grow with the file size. Once every chunk is published,
+    the ingestion status carrying the total count is published and the file is moved to a
+    designated "processed" folder. If the status cannot be published, the ingestion fails and
+    the file is left in place, and retrying it publishes the status again.
+
+    Every chunk is validated as a whole: malformed lines, invalid POINT coordinates and invalid
+    datetimes are written with their line number to the `{file_name}.rejected.csv` dead-letter
+    file in `CSV_REJECTED_FOLDER`, while the other lines keep flowing.
+
+    Progress is checkpointed in the manifest of `MANIFEST_FOLDER`, keyed by the content hash of
+    the file, every time a chunk is acknowledged by Pub/Sub. Retrying an interrupted ingestion
+    resumes after the last acknowledged chunk, under the same ingestion ID, and a file that was
+    already fully ingested is moved to the "processed" folder without being published again.
 
     Args:
         request (Request): The HTTP request object containing headers with metadata.
             - "has_header" (str): A header specifying if the CSV file includes a header row
               (1 for True, 0 for False).
+            - "background" (str, optional): 1 to run the ingestion as a background job.
         directory (str): The directory where the CSV file is located.
         file_name (str): The name of the CSV file to be ingested.
 
@@ -83,39 +646,31 @@ def ingest_csv_file(request: Request, directory: str, file_name: str):
         dict: A dictionary containing:
             - "message" (str): Confirmation message for the ingestion job and file move.
             - `status` (dict): Status details about the ingestion process, as generated by
-              the `DataFormatter`.
+              the `DataFormatter`, with the counts of accepted, rejected and duplicate lines.
+
+        Background jobs are answered right away with a 202 response carrying the ingestion ID,
+        before the file is hashed. When the file resumes an interrupted ingestion, the job
+        takes the ingestion ID of the latter, and can be followed under both.
     """
 
-    formatter = DataFormatter()
     file_handler = FileHandler(dir=directory)
     file_has_header = bool(int(request.headers.get("has_header")))
 
-    try:
-        data = [
-            formatter.from_csv(line)
-            for line in file_handler.read_csv(
-                file=file_name, has_header=file_has_header
-            )
-        ]
-
-        status = formatter.generate_ingestion_status(data)
+    if not (file_handler.path / file_name).is_file():
+        return {f"Either file {file_name} or directory {directory} were not found."}
 
-        events_publisher.send(data)
-        status_publisher.send(status)
+    ingestion_id = uuid.uuid4()
 
-        file_handler.move_file(file_name, processed_folder=CSV_PROCESSED_FOLDER)
+    def run(job: Optional[Job]) -> Dict[str, Any]:
+        return _ingest_file(
+            file_handler=file_handler,
+            file_name=file_name,
+            has_header=file_has_header,
+            ingestion_id=ingestion_id,
+            job=job,
+        )
 
-        return {
-            "message": (
-                "The Ingestion Job was successfully created at backend side. "
-                "A notification will be sent to #ingestion-jobs slack channel as soon as "
-                "the ingestion finishes. "
-                "Files were moved to processed folder."
-            ),
-            **status,
-        }
-    except FileNotFoundError:
-        return {f"Either file {file_name} or directory {directory} were not found."}
+    return _run(request=request, ingestion_id=ingestion_id, fn=run)
 
 
 @app.get("/ingest/dir/{directory}")
@@ -123,60 +678,223 @@ def ingest_csv_files(request: Request, directory: str):
     """
     Ingests data from all CSV files in a specified directory, processes the data, and initiates the ingestion process.
 
-    This endpoint reads all CSV files found in the specified `directory`, formats their data, and publishes
-    both the data and ingestion status. After successful ingestion, the files are moved to a designated
-    "processed" folder.
+    This endpoint reads all CSV files (plain, .csv.gz or .csv.zst) and Parquet files found in the
+    specified `directory` in parallel, using a pool of
+    worker processes. Each file is streamed through the formatter and the publisher as its own ingestion,
+    with its own ingestion ID and ingestion status. A file is moved to a designated "processed" folder
+    only after all of its events were acknowledged by Pub/Sub.
 
     Args:
         request (Request): The HTTP request object containing headers with metadata.
             - "has_header" (str): A header specifying if the CSV files include header rows
               (1 for True, 0 for False).
+            - "parallelism" (str, optional): The number of files ingested at the same time.
+              Defaults to, and is capped by, `INGESTION_WORKERS`.
+            - "background" (str, optional): 1 to run the ingestion as a background job. The job
+              is identified by its own ID, and its progress is updated as each file completes.
         directory (str): The directory from which CSV files are read.
 
     Returns:
         dict: A dictionary containing:
             - "message" (str): Confirmation message indicating ingestion job creation and file movement.
-            - `status` (dict): Status details about the ingestion process, generated by `DataFormatter`.
+            - "files" (list): The status of each file: its ingestion ID and counts of accepted,
+              rejected and duplicate lines, as generated by `DataFormatter`, or the error that
+              stopped its ingestion.
+
+        Background jobs are answered right away with a 202 response carrying the job ID.
 
     Side Effects:
         - Reads and formats data from all CSV files in the specified directory.
-        - Sends formatted data and ingestion status to publishers (`events_publisher` and `status_publisher`).
-        - Moves all processed files to the `CSV_PROCESSED_FOLDER`.
+        - Sends formatted data and one ingestion status per file to the events and status topics.
+        - Moves every successfully ingested file to the `CSV_PROCESSED_FOLDER`.
 
     Notes:
         - Returns a message if no files are found in the directory.
-        - A notification is sent to the #ingestion-jobs Slack channel upon ingestion completion.
-        - Processed files are moved to a dedicated folder after successful ingestion.
+        - A notification is sent to the #ingestion-jobs Slack channel upon completion of each file ingestion.
+        - A file that fails, including when its ingestion status cannot be published, is left in
+          place with its 'error' and does not prevent the other files from being ingested.
+        - Progress is checkpointed per file in the manifest of `MANIFEST_FOLDER`: a retried file
+          resumes after its last acknowledged chunk, and a file already fully ingested is moved
+          without being published again.
     """
 
-    formatter = DataFormatter()
     file_handler = FileHandler(dir=directory)
     file_has_header = bool(int(request.headers.get("has_header") or 0))
+    parallelism = min(
+        int(request.headers.get("parallelism") or INGESTION_WORKERS), INGESTION_WORKERS
+    )
 
     files = list(file_handler.list_files())
 
     if len(files) == 0:
         return f"No files were found under directory {directory}"
 
-    data = [
-        formatter.from_csv(line)
-        for file in files
-        for line in file_handler.read_csv(file=file, has_header=file_has_header)
-    ]
+    def run(job: Optional[Job]) -> Dict[str, Any]:
+        statuses = []
+        rows_read = 0
+        rows_published = 0
+
+        for result in ingest_files_in_parallel(
+            directory=directory,
+            files=files,
+            has_header=file_has_header,
+            chunk_size=CSV_CHUNK_SIZE,
+            parallelism=parallelism,
+            publisher_config=EVENTS_PUBLISHER_CONFIG,
+            rejected_folder=CSV_REJECTED_FOLDER,
+            manifest_path=manifest.path,
+            dedup_config=DEDUP_CONFIG,
+        ):
+            file = result.pop("file")
+
+            if "error" not in result:
+                checkpoint = manifest.get(result.pop("digest"))
+                if not checkpoint.completed:
+                    delivery = status_publisher.wait(status_publisher.send(result))
+                    if delivery["failed"]:
+                        result["error"] = "The ingestion status could not be published."
+                    else:
+                        checkpoint.complete()
+
+            if "error" not in result:
+                file_handler.move_file(file, processed_folder=CSV_PROCESSED_FOLDER)
+
+                rows_read += result["count"] + result["rejected"] + result["duplicates"]
+                rows_published += result["count"]
+                if job:
+                    job.update(rows_read=rows_read, rows_published=rows_published)
+
+            statuses.append({"file": file.name, **result})
 
-    status = formatter.generate_ingestion_status(data)
+        return {
+            "message": (
+                "The Ingestion Jobs were successfully created at backend side. "
+                "A notification will be sent to #ingestion-jobs slack channel as soon as "
+                "each ingestion finishes. "
+                "Successfully ingested files were moved to processed folder."
+            ),
+            "files": statuses,
+        }
+
+    return _run(request=request, ingestion_id=uuid.uuid4(), fn=run)
 
-    events_publisher.send(data)
-    status_publisher.send(status)
 
-    file_handler.move_files(files, processed_folder=CSV_PROCESSED_FOLDER)
+@app.get("/publisher/stats")
+def get_publisher_stats():
+    """
+    Reports the current batch settings and recent publish statistics of the publishers.
 
+    Returns:
+        dict: For the events publisher (one entry per shard) and the status publisher, the
+        messages and bytes in flight, the batch settings in use and, with adaptive batching,
+        the traffic mode, the adjustments made and the count, error rate and latencies of the
+        recent messages.
+    """
     return {
-        "message": (
-            "The Ingestion Job was successfully created at backend side. "
-            "A notification will be sent to #ingestion-jobs slack channel as soon as "
-            "the ingestion finishes. "
-            "Files were moved to processed folder."
-        ),
-        **status,
+        "events": events_publisher.stats(),
+        "status": status_publisher.stats(),
     }
+
+
+@app.get("/jobs/{ingestion_id}")
+def get_job(ingestion_id: str):
+    """
+    Reports the progress of an ingestion running in the background.
+
+    Args:
+        ingestion_id (str): The ID returned by an ingestion endpoint called with the
+            "background" header.
+
+    Returns:
+        dict: The state of the job ("queued", "running", "finished" or "failed"), the number
+        of rows read and published, the elapsed time, the publish throughput and, once
+        finished, the result or error of the ingestion. A 404 response is returned for
+        unknown IDs.
+    """
+    job = job_registry.get(ingestion_id)
+
+    if job is None:
+        return JSONResponse(
+            status_code=404, content={"message": f"Job {ingestion_id} was not found."}
+        )
+
+    return job.to_dict()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Exposes the ingestion metrics in the Prometheus text format.
+
+    Returns:
+        Response: Per-stage latency histograms (`ingestion_stage_seconds`), rows and bytes
+        counters (`ingestion_rows_total`, `ingestion_published_bytes_total`), publish outcomes
+        and latencies, and the publisher queue depth (`ingestion_publisher_inflight_messages`).
+    """
+    data, content_type = render()
+
+    return Response(content=data, media_type=content_type)
+
+
+@app.get("/debug/profile")
+def debug_profile(
+    request: Request,
+    seconds: float = 5,
+    interval: float = 0.01,
+    ingestion_id: Optional[str] = None,
+):
+    """
+    Samples the Python stacks of the running ingestions and returns a profile.
+
+    The endpoint is disabled unless `DEBUG_PROFILE_TOKEN` is set, and requires the same token
+    in the "x-debug-token" header. Files ingested by `/ingest/dir/{directory}` run in worker
+    processes and are not visible to this endpoint.
+
+    Args:
+        request (Request): The HTTP request, carrying the "x-debug-token" header.
+        seconds (float, optional): How long to sample for, capped by
+            `DEBUG_PROFILE_MAX_SECONDS`. Defaults to 5.
+        interval (float, optional): The seconds between two samples. Defaults to 0.01.
+        ingestion_id (str, optional): The background job to profile. Defaults to every thread
+            of the app.
+
+    Returns:
+        dict: The profile, as returned by `sample_stacks`: the most frequent stacks in the
+        collapsed format of flame graph tools and the functions seen the most. A 404 response
+        is returned when profiling is disabled or the job is unknown, a 403 response for a
+        wrong token, and a 409 response when the job is not running.
+    """
+    if not DEBUG_PROFILE_TOKEN:
+        return JSONResponse(status_code=404, content={"message": "Not Found"})
+
+    token = request.headers.get("x-debug-token", "")
+    if not hmac.compare_digest(token.encode(), DEBUG_PROFILE_TOKEN.encode()):
+        return JSONResponse(
+            status_code=403, content={"message": "Invalid debug token."}
+        )
+
+    thread_ids = None
+
+    if ingestion_id:
+        job = job_registry.get(ingestion_id)
+
+        if job is None:
+            return JSONResponse(
+                status_code=404,
+                content={"message": f"Job {ingestion_id} was not found."},
+            )
+
+        thread_id = job.thread_id
+        if thread_id is None:
+            return JSONResponse(
+                status_code=409,
+                content={"message": f"Job {ingestion_id} is not running."},
+            )
+
+        thread_ids = [thread_id]
+
+    return sample_stacks(
+        seconds=max(0.0, min(seconds, DEBUG_PROFILE_MAX_SECONDS)),
+        interval=max(interval, 0.001),
+        thread_ids=thread_ids,
+    )
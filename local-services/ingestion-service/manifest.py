@@ -0,0 +1,232 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+
+class FileCheckpoint:
+    """
+    The manifest entry of a single input file: its ingestion ID and how many of its rows
+    were confirmed as published by Pub/Sub.
+    """
+
+    def __init__(
+        self, manifest: "IngestionManifest", digest: str, entry: Dict[str, Any]
+    ) -> None:
+        """
+        Initializes the FileCheckpoint.
+
+        Args:
+            manifest (IngestionManifest): The manifest the entry is saved to.
+            digest (str): The SHA-256 hash of the file content.
+            entry (Dict[str, Any]): The last saved entry, empty for a new file.
+        """
+        self.manifest = manifest
+        self.digest = digest
+        self.entry = entry
+
+    @property
+    def ingestion_id(self) -> Optional[uuid.UUID]:
+        """
+        The ingestion ID of a previous attempt, if any.
+        """
+        if "ingestion_id" not in self.entry:
+            return None
+
+        return uuid.UUID(self.entry["ingestion_id"])
+
+    @property
+    def completed(self) -> bool:
+        """
+        True if the file was fully ingested and its ingestion status published.
+        """
+        return self.entry.get("state") == "completed"
+
+    @property
+    def rows(self) -> int:
+        """
+        The number of data rows (header excluded) confirmed as published, rejected or
+        suppressed as duplicates.
+        """
+        return self.entry.get("rows", 0)
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """
+        The 'count' of records published and the numbers of 'rejected' and 'duplicates'
+        records so far.
+        """
+        return {
+            "count": self.entry.get("count", 0),
+            "rejected": self.entry.get("rejected", 0),
+            "duplicates": self.entry.get("duplicates", 0),
+        }
+
+    @property
+    def status(self) -> Dict[str, Any]:
+        """
+        The ingestion status of the file, as generated by `DataFormatter`.
+        """
+        return {"ingestion_id": self.entry.get("ingestion_id"), **self.counts}
+
+    def start(self, file: str, ingestion_id: uuid.UUID) -> None:
+        """
+        Records the ingestion ID of the file before anything is published, so a retry
+        publishes the remaining rows under the same ID.
+
+        Args:
+            file (str): The name of the file, for reference only.
+            ingestion_id (uuid.UUID): The ingestion ID of the file.
+        """
+        self._save(
+            file=str(file),
+            ingestion_id=str(ingestion_id),
+            state="in_progress",
+            rows=self.rows,
+            **self.counts,
+        )
+
+    def update(self, rows: int, count: int, rejected: int, duplicates: int = 0) -> None:
+        """
+        Records the rows confirmed as published, rejected or suppressed so far.
+
+        Args:
+            rows (int): The number of data rows read up to the last acknowledged chunk.
+            count (int): The number of records published up to that chunk.
+            rejected (int): The number of records rejected up to that chunk.
+            duplicates (int, optional): The number of duplicate records dropped up to that
+                chunk. Defaults to 0.
+        """
+        self._save(rows=rows, count=count, rejected=rejected, duplicates=duplicates)
+
+    def complete(self) -> None:
+        """
+        Marks the file as fully ingested, once its ingestion status was published.
+        """
+        self._save(state="completed")
+
+    def _save(self, **fields: Any) -> None:
+        self.entry = {
+            **self.entry,
+            **fields,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.manifest.save(self.digest, self.entry)
+
+
+class IngestionManifest:
+    """
+    Keeps track of file ingestions in a local folder, with one JSON entry per file content
+    hash. Entries are rewritten atomically, so a crash never leaves a partial entry behind.
+    Files with the same content share their entry: an ingestion holds the `lock` of its
+    entry, so a copy ingested at the same time, by another thread or worker process, waits
+    for it and then finds the entry completed.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        Initializes the IngestionManifest, creating its folder if needed.
+
+        Args:
+            path (Path): The folder of the manifest entries.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def file_digest(file_path: Path) -> str:
+        """
+        Computes the SHA-256 hash of a file content, reading it in blocks.
+
+        Args:
+            file_path (Path): The path of the file.
+
+        Returns:
+            str: The hexadecimal digest.
+        """
+        digest = hashlib.sha256()
+
+        with open(file_path, mode="rb") as f:
+            while block := f.read(1024 * 1024):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    def open(self, file_path: Path) -> FileCheckpoint:
+        """
+        Returns the checkpoint of a file, keyed by its content hash, so a renamed or moved
+        copy of an ingested file is recognized as well.
+
+        Args:
+            file_path (Path): The path of the file.
+
+        Returns:
+            FileCheckpoint: The checkpoint of the file, empty if it was never ingested.
+        """
+        return self.get(self.file_digest(file_path))
+
+    @contextmanager
+    def lock(self, digest: str) -> Iterator[None]:
+        """
+        Holds the exclusive lock of the entry of a file content hash, waiting for it if needed.
+
+        Args:
+            digest (str): The SHA-256 hash of the file content.
+        """
+        with open(self.path / f"{digest}.lock", mode="w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, digest: str) -> FileCheckpoint:
+        """
+        Returns the checkpoint of a file content hash.
+
+        Args:
+            digest (str): The SHA-256 hash of the file content.
+
+        Returns:
+            FileCheckpoint: The checkpoint of the file, empty if it was never ingested.
+        """
+        return FileCheckpoint(self, digest, self.load(digest))
+
+    def load(self, digest: str) -> Dict[str, Any]:
+        """
+        Loads the entry of a file content hash.
+
+        Args:
+            digest (str): The SHA-256 hash of the file content.
+
+        Returns:
+            Dict[str, Any]: The saved entry, or an empty dictionary.
+        """
+        try:
+            with open(self.path / f"{digest}.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, digest: str, entry: Dict[str, Any]) -> None:
+        """
+        Atomically replaces the entry of a file content hash.
+
+        Args:
+            digest (str): The SHA-256 hash of the file content.
+            entry (Dict[str, Any]): The entry to save.
+        """
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=self.path, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(entry, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(f.name, self.path / f"{digest}.json")
@@ -0,0 +1,105 @@
+import os
+import time
+from typing import Iterable, Iterator, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Seconds spent per pipeline stage and call: reading a chunk ("read"), parsing it into a
+# batch ("parse"), validating it ("validate"), dropping its duplicates ("dedup"), adding
+# its coordinates and geohash cells ("geo"), handing its messages to the client ("publish",
+# which includes encoding them, also timed on its own as "serialize"), and waiting for the
+# previous batch to be acknowledged ("ack_wait").
+STAGE_SECONDS = Histogram(
+    "ingestion_stage_seconds",
+    "Time spent in each stage of the ingestion pipeline, per call.",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+ROWS = Counter(
+    "ingestion_rows_total",
+    "Rows ingested, by outcome (published, rejected or duplicate). Use rate() for rows/s.",
+    ["outcome"],
+)
+PUBLISHED_BYTES = Counter(
+    "ingestion_published_bytes_total",
+    "Bytes of the messages published to Pub/Sub. Use rate() for bytes/s.",
+    ["topic"],
+)
+PUBLISHED_MESSAGES = Counter(
+    "ingestion_published_messages_total",
+    "Messages published to Pub/Sub, by outcome (delivered or failed).",
+    ["topic", "outcome"],
+)
+PUBLISH_LATENCY = Histogram(
+    "ingestion_publish_latency_seconds",
+    "Time between publishing a message and its acknowledgement by Pub/Sub.",
+    ["topic"],
+)
+INFLIGHT_MESSAGES = Gauge(
+    "ingestion_publisher_inflight_messages",
+    "Messages published but not yet acknowledged, i.e. the publisher queue depth.",
+    ["topic"],
+    multiprocess_mode="livesum",
+)
+INFLIGHT_BYTES = Gauge(
+    "ingestion_publisher_inflight_bytes",
+    "Bytes of the messages published but not yet acknowledged.",
+    ["topic"],
+    multiprocess_mode="livesum",
+)
+
+DEDUP_KEYS = Gauge(
+    "ingestion_dedup_keys",
+    "Trip keys in the exact index of the deduplicator, after pruning the expired ones.",
+    multiprocess_mode="max",
+)
+
+
+def timed(stage: str, iterable: Iterable) -> Iterator:
+    """
+    Yields the items of an iterable, timing each `next` call as the given stage.
+
+    Args:
+        stage (str): The stage label, such as "read".
+        iterable (Iterable): The iterable to time, such as a generator reading a file.
+
+    Yields:
+        The items of the iterable.
+    """
+    histogram = STAGE_SECONDS.labels(stage)
+    iterator = iter(iterable)
+
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - start)
+        yield item
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Renders the metrics in the Prometheus text format.
+
+    When `PROMETHEUS_MULTIPROC_DIR` is set, the metrics of the worker processes of the
+    parallel directory ingestion are aggregated with those of the app.
+
+    Returns:
+        Tuple[bytes, str]: The rendered metrics and their content type.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
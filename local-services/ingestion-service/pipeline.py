@@ -0,0 +1,531 @@
+import multiprocessing
+from concurrent import futures
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Generator, Iterable, List, Optional, Union
+
+import pyarrow as pa
+from dedup import TripDeduplicator
+from gcp import PubSubService, ShardedPubSubService
+from geo import add_geo_columns
+from manifest import FileCheckpoint, IngestionManifest
+from metrics import ROWS, STAGE_SECONDS, timed
+from pyarrow import parquet as pq
+from utils import CSV_COLUMNS, DataFormatter, FileHandler, TripBatch
+from validation import BatchValidator, DeadLetterSink
+
+# Publisher and deduplicator of a worker process of `ingest_files_in_parallel`, created by
+# `_init_worker`.
+_worker_publisher = None
+_worker_deduplicator = None
+
+
+def stream_file(
+    file_handler: FileHandler,
+    file: str,
+    has_header: bool,
+    formatter: DataFormatter,
+    publisher: Union[PubSubService, ShardedPubSubService],
+    chunk_size: int,
+    progress: Optional[Callable[[int, int], None]] = None,
+    dead_letter: Optional[DeadLetterSink] = None,
+    checkpoint: Optional[FileCheckpoint] = None,
+    deduplicator: Optional[TripDeduplicator] = None,
+) -> Dict[str, int]:
+    """
+    Streams an input file through the formatter and the publisher, whatever its format.
+
+    CSV files (plain, gzip or zstd compressed) are streamed by `stream_csv_file`. Parquet
+    files are read batch by batch, with the same chunk size, validation and dead-letter
+    handling; `has_header` does not apply to them.
+
+    Args:
+        See `stream_csv_file`.
+
+    Returns:
+        Dict[str, int]: The 'count' of records published and the numbers of 'rejected' and
+        'duplicates' records, to be used in the ingestion status.
+    """
+    if file_handler.detect_format(file) != "parquet":
+        return stream_csv_file(
+            file_handler=file_handler,
+            file=file,
+            has_header=has_header,
+            formatter=formatter,
+            publisher=publisher,
+            chunk_size=chunk_size,
+            progress=progress,
+            dead_letter=dead_letter,
+            checkpoint=checkpoint,
+            deduplicator=deduplicator,
+        )
+
+    batch_publisher = BatchPublisher(
+        publisher=publisher,
+        progress=progress,
+        dead_letter=dead_letter,
+        checkpoint=checkpoint,
+        deduplicator=deduplicator,
+    )
+    _publish_record_batches(
+        file_handler.read_parquet(
+            file, batch_size=chunk_size, skip_rows=batch_publisher.rows
+        ),
+        formatter,
+        batch_publisher,
+        chunk_size,
+        first_row=batch_publisher.rows,
+    )
+
+    return batch_publisher.close()
+
+
+def stream_csv_file(
+    file_handler: FileHandler,
+    file: str,
+    has_header: bool,
+    formatter: DataFormatter,
+    publisher: Union[PubSubService, ShardedPubSubService],
+    chunk_size: int,
+    progress: Optional[Callable[[int, int], None]] = None,
+    dead_letter: Optional[DeadLetterSink] = None,
+    checkpoint: Optional[FileCheckpoint] = None,
+    deduplicator: Optional[TripDeduplicator] = None,
+) -> Dict[str, int]:
+    """
+    Streams a CSV file through the formatter and the publisher in fixed-size chunks.
+
+    Each chunk is parsed into a columnar `TripBatch` and handed to the publisher
+    while the previous chunk's publish futures are still in flight; the pipeline
+    only moves on once those futures are resolved. At most two chunks are held in
+    memory at any time, so peak memory stays flat regardless of the file size.
+
+    Every chunk is validated as a whole (see `BatchValidator`): malformed and invalid
+    lines are written to the dead-letter file with their line number, and the rest of
+    the file keeps flowing.
+
+    Args:
+        file_handler (FileHandler): The handler pointing to the directory of the file.
+        file (str): The name of the CSV file to ingest.
+        has_header (bool): If True, the first line of the file is skipped.
+        formatter (DataFormatter): The formatter holding the ingestion ID of this job.
+        publisher (Union[PubSubService, ShardedPubSubService]): The publisher used to send
+            the formatted events.
+        chunk_size (int): The number of lines parsed and published at a time.
+        progress (Callable[[int, int], None], optional): Called after every chunk with the
+            number of rows read and the number of rows acknowledged by Pub/Sub so far.
+        dead_letter (DeadLetterSink, optional): The sink of the rejected lines. Rejected lines
+            are only counted when not given.
+        checkpoint (FileCheckpoint, optional): The manifest entry of the file. When given, the
+            lines it records as done are skipped, its counts carry over, and it is updated every
+            time a chunk is acknowledged.
+        deduplicator (TripDeduplicator, optional): When given, the records that were already
+            ingested are dropped before being published, and counted as 'duplicates'.
+
+    Returns:
+        Dict[str, int]: The 'count' of records published and the numbers of 'rejected' and
+        'duplicates' records, to be used in the ingestion status.
+
+    Raises:
+        Exception: Any publish error raised by the Pub/Sub client futures.
+    """
+    batch_publisher = BatchPublisher(
+        publisher=publisher,
+        progress=progress,
+        dead_letter=dead_letter,
+        checkpoint=checkpoint,
+        deduplicator=deduplicator,
+    )
+    line = (2 if has_header else 1) + batch_publisher.rows
+
+    chunks = file_handler.read_csv_chunks(
+        file=file,
+        has_header=has_header,
+        chunk_size=chunk_size,
+        skip_rows=batch_publisher.rows,
+    )
+
+    for chunk in timed("read", chunks):
+        with STAGE_SECONDS.labels("parse").time():
+            batch = formatter.from_csv_batch(chunk, first_line=line)
+        batch_publisher.publish(batch, rows=len(chunk))
+        line += len(chunk)
+
+    return batch_publisher.close()
+
+
+def stream_columnar(
+    source: IO[bytes],
+    file_format: str,
+    formatter: DataFormatter,
+    batch_publisher: "BatchPublisher",
+    chunk_size: int,
+) -> None:
+    """
+    Streams an Arrow IPC stream or a Parquet file through the formatter and a batch publisher.
+
+    Args:
+        source (IO[bytes]): A readable (and, for Parquet, seekable) binary file object.
+        file_format (str): Either "arrow" or "parquet".
+        formatter (DataFormatter): The formatter holding the ingestion ID of this job.
+        batch_publisher (BatchPublisher): The publisher of the batches. It is not closed.
+        chunk_size (int): The maximum number of rows published at a time.
+
+    Raises:
+        pyarrow.ArrowInvalid: If the source is not valid Arrow or Parquet data, or lacks
+            one of the `CSV_COLUMNS`.
+    """
+    if file_format == "parquet":
+        batches = pq.ParquetFile(source).iter_batches(
+            batch_size=chunk_size, columns=CSV_COLUMNS
+        )
+    else:
+        batches = pa.ipc.open_stream(source)
+
+    _publish_record_batches(batches, formatter, batch_publisher, chunk_size)
+
+
+def _publish_record_batches(
+    batches: Iterable[pa.RecordBatch],
+    formatter: DataFormatter,
+    batch_publisher: "BatchPublisher",
+    chunk_size: int,
+    first_row: int = 0,
+) -> None:
+    """
+    Publishes Arrow record batches, slicing the large ones into chunks of `chunk_size` rows.
+    """
+    rows = first_row
+
+    for batch in timed("read", batches):
+        for offset in range(0, batch.num_rows, chunk_size):
+            chunk = batch.slice(offset, chunk_size)
+            with STAGE_SECONDS.labels("parse").time():
+                trips = formatter.from_arrow(chunk, first_line=rows + 1)
+            batch_publisher.publish(trips)
+            rows += chunk.num_rows
+
+
+class BatchPublisher:
+    """
+    Validates and publishes a stream of `TripBatch` objects, keeping at most one batch
+    in flight while the next one is being prepared.
+    """
+
+    def __init__(
+        self,
+        publisher: Union[PubSubService, ShardedPubSubService],
+        progress: Optional[Callable[[int, int], None]] = None,
+        dead_letter: Optional[DeadLetterSink] = None,
+        checkpoint: Optional[FileCheckpoint] = None,
+        deduplicator: Optional[TripDeduplicator] = None,
+    ) -> None:
+        """
+        Initializes the BatchPublisher.
+
+        Args:
+            publisher (Union[PubSubService, ShardedPubSubService]): The publisher used to send
+            the formatted events.
+            progress (Callable[[int, int], None], optional): Called after every batch with the
+                number of rows read and the number of rows acknowledged by Pub/Sub so far.
+            dead_letter (DeadLetterSink, optional): The sink of the rejected rows. Rejected rows
+                are only counted when not given.
+            checkpoint (FileCheckpoint, optional): The manifest entry of the source. Counting
+                starts from its rows and counts, and it is updated every time a batch is
+                acknowledged.
+            deduplicator (TripDeduplicator, optional): When given, the records that were
+                already ingested are dropped before being published. The batches that fail
+                to publish release their records, so a later ingestion can send them again.
+        """
+        self.publisher = publisher
+        self.progress = progress
+        self.dead_letter = dead_letter
+        self.checkpoint = checkpoint
+        self.deduplicator = deduplicator
+        self.validator = BatchValidator()
+        self.rows = checkpoint.rows if checkpoint else 0
+        self.count = checkpoint.counts["count"] if checkpoint else 0
+        self.rejected = checkpoint.counts["rejected"] if checkpoint else 0
+        self.duplicates = checkpoint.counts["duplicates"] if checkpoint else 0
+        self._acknowledged = self.count
+        self._pending: List[futures.Future] = []
+        self._pending_batch: Optional[TripBatch] = None
+        self._pending_checkpoint: Optional[Dict[str, int]] = None
+
+    def publish(self, batch: TripBatch, rows: Optional[int] = None) -> None:
+        """
+        Validates, deduplicates and publishes a batch, with the parsed coordinates and geohash
+        cells of its trips (see `add_geo_columns`), then waits for the previous batch to be
+        acknowledged.
+
+        Args:
+            batch (TripBatch): The batch to publish. Its invalid rows are sent to the dead-letter
+                sink instead, and its duplicates are dropped.
+            rows (int, optional): The number of source rows the batch was read from. Defaults to
+                the number of rows of the batch, including the rejected ones and the duplicates.
+
+        Raises:
+            Exception: Any publish error raised by the Pub/Sub client futures.
+        """
+        with STAGE_SECONDS.labels("validate").time():
+            batch = self.validator.validate(batch)
+
+        if batch.rejected:
+            self.rejected += len(batch.rejected)
+            ROWS.labels("rejected").inc(len(batch.rejected))
+            if self.dead_letter:
+                self.dead_letter.write(batch.rejected)
+
+        read = len(batch) + len(batch.rejected)
+
+        if self.deduplicator:
+            with STAGE_SECONDS.labels("dedup").time():
+                batch, duplicates = self.deduplicator.filter_batch(batch)
+            self.duplicates += duplicates
+            ROWS.labels("duplicate").inc(duplicates)
+
+        with STAGE_SECONDS.labels("geo").time():
+            batch.table = add_geo_columns(batch.table)
+
+        try:
+            with STAGE_SECONDS.labels("publish").time():
+                in_flight = self.publisher.send(batch.to_records())
+            published = self.count
+            self.count += len(batch)
+            self.rows += rows if rows is not None else read
+
+            with STAGE_SECONDS.labels("ack_wait").time():
+                _wait(self._pending)
+        except BaseException:
+            self._release(self._pending_batch, batch)
+            raise
+        ROWS.labels("published").inc(published - self._acknowledged)
+        self._acknowledged = published
+        self._save_checkpoint()
+        self._pending = in_flight
+        self._pending_batch = batch
+        self._pending_checkpoint = {
+            "rows": self.rows,
+            "count": self.count,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+        }
+
+        if self.progress:
+            self.progress(self.count + self.rejected + self.duplicates, published)
+
+    def close(self) -> Dict[str, int]:
+        """
+        Waits for the last batch to be acknowledged, closes the dead-letter sink and saves the
+        filter of the deduplicator.
+
+        Returns:
+            Dict[str, int]: The 'count' of records published and the numbers of 'rejected' and
+            'duplicates' records.
+
+        Raises:
+            Exception: Any publish error raised by the Pub/Sub client futures.
+        """
+        try:
+            try:
+                with STAGE_SECONDS.labels("ack_wait").time():
+                    _wait(self._pending)
+            except BaseException:
+                self._release(self._pending_batch)
+                raise
+            ROWS.labels("published").inc(self.count - self._acknowledged)
+            self._acknowledged = self.count
+            self._save_checkpoint()
+            self._pending = []
+            self._pending_batch = None
+        finally:
+            if self.dead_letter:
+                self.dead_letter.close()
+            if self.deduplicator:
+                self.deduplicator.save()
+
+        if self.progress:
+            self.progress(self.count + self.rejected + self.duplicates, self.count)
+
+        return {
+            "count": self.count,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+        }
+
+    def _release(self, *batches: Optional[TripBatch]) -> None:
+        """
+        Releases the records claimed by batches that may not have been delivered, if any.
+        """
+        if self.deduplicator:
+            for batch in batches:
+                if batch is not None:
+                    self.deduplicator.release(batch)
+
+    def _save_checkpoint(self) -> None:
+        """
+        Records the batch that was just acknowledged in the checkpoint, if any.
+        """
+        if self.checkpoint and self._pending_checkpoint:
+            self.checkpoint.update(**self._pending_checkpoint)
+            self._pending_checkpoint = None
+
+
+def _wait(publish_futures: List[futures.Future]) -> None:
+    """
+    Blocks until every given publish future is resolved, re-raising the first failure.
+    """
+    for future in futures.as_completed(publish_futures):
+        future.result()
+
+
+def ingest_files_in_parallel(
+    directory: str,
+    files: List[Path],
+    has_header: bool,
+    chunk_size: int,
+    parallelism: int,
+    publisher_config: Dict[str, Any],
+    rejected_folder: str,
+    manifest_path: Path,
+    dedup_config: Optional[Dict[str, Any]] = None,
+) -> Generator:
+    """
+    Streams many input files through a pool of worker processes, one file per task.
+
+    Every worker process owns its own `ShardedPubSubService`, built from `publisher_config`,
+    and every file gets its own `DataFormatter`, hence its own ingestion ID. A file
+    is reported as ingested only after all of its events were acknowledged by
+    Pub/Sub; a failing file is reported with its error and does not affect the others.
+
+    Progress is checkpointed in the manifest, keyed by the content hash of each file: an
+    interrupted file resumes from its last acknowledged chunk under the same ingestion ID,
+    and a file that was already fully ingested is not read again. Files with the same
+    content share their entry, and the worker streaming one of them holds its lock: the
+    other copies wait for it, then publish nothing more under the same ingestion ID.
+
+    Args:
+        directory (str): The directory of the files, relative to the `FileHandler` base path.
+        files (List[Path]): The files to ingest.
+        has_header (bool): If True, the first line of every file is skipped.
+        chunk_size (int): The number of lines parsed and published at a time.
+        parallelism (int): The maximum number of worker processes.
+        publisher_config (Dict[str, Any]): The keyword arguments of the workers'
+            `ShardedPubSubService`.
+        rejected_folder (str): The directory under the base path where the dead-letter file
+            of each file is written.
+        manifest_path (Path): The folder of the `IngestionManifest`.
+        dedup_config (Dict[str, Any], optional): The keyword arguments of the workers'
+            `TripDeduplicator`, which share its index. No deduplication when not given.
+
+    Yields:
+        Dict[str, Any]: A result per file, in completion order, with the 'file' and either
+        its 'ingestion_id', 'count', 'rejected' and 'duplicates' counts, or the 'error' that
+        stopped it.
+        Successful results also carry the 'digest' of the file, to mark it as completed once
+        its status is published, and 'skipped' when it was already completed before.
+    """
+    with futures.ProcessPoolExecutor(
+        max_workers=max(1, min(parallelism, len(files))),
+        # gRPC channels of the parent process must not be shared with forked children.
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(publisher_config, dedup_config),
+    ) as pool:
+        tasks = {
+            pool.submit(
+                _ingest_file,
+                directory,
+                file,
+                has_header,
+                chunk_size,
+                rejected_folder,
+                manifest_path,
+            ): file
+            for file in files
+        }
+
+        for task in futures.as_completed(tasks):
+            try:
+                yield task.result()
+            except Exception as e:  # the worker process itself died
+                yield {"file": tasks[task], "error": repr(e)}
+
+
+def _init_worker(
+    publisher_config: Dict[str, Any], dedup_config: Optional[Dict[str, Any]]
+) -> None:
+    """
+    Creates the publisher and the deduplicator of a worker process.
+    """
+    global _worker_publisher, _worker_deduplicator
+    _worker_publisher = ShardedPubSubService(**publisher_config)
+    _worker_deduplicator = TripDeduplicator(**dedup_config) if dedup_config else None
+
+
+def _ingest_file(
+    directory: str,
+    file: Path,
+    has_header: bool,
+    chunk_size: int,
+    rejected_folder: str,
+    manifest_path: Path,
+) -> Dict[str, Any]:
+    """
+    Streams a single file with the publisher of the current worker process, holding the lock
+    of its manifest entry, so a copy of the file in the same directory is skipped.
+    """
+    file_handler = FileHandler(dir=directory)
+    manifest = IngestionManifest(manifest_path)
+    digest = manifest.file_digest(file_handler.path / file)
+
+    with manifest.lock(digest):
+        return _ingest_checkpointed_file(
+            file_handler, file, has_header, chunk_size, rejected_folder, manifest.get(digest)
+        )
+
+
+def _ingest_checkpointed_file(
+    file_handler: FileHandler,
+    file: Path,
+    has_header: bool,
+    chunk_size: int,
+    rejected_folder: str,
+    checkpoint: FileCheckpoint,
+) -> Dict[str, Any]:
+    """
+    Streams a single file from its checkpoint, unless it was already completed.
+    """
+
+    if checkpoint.completed:
+        return {
+            "file": file,
+            "digest": checkpoint.digest,
+            "skipped": True,
+            **checkpoint.status,
+        }
+
+    formatter = DataFormatter(ingestion_id=checkpoint.ingestion_id)
+    checkpoint.start(file, formatter.ingestion_id)
+
+    try:
+        counts = stream_file(
+            file_handler=file_handler,
+            file=file,
+            has_header=has_header,
+            formatter=formatter,
+            publisher=_worker_publisher,
+            chunk_size=chunk_size,
+            dead_letter=DeadLetterSink(
+                file_handler.dead_letter_path(file, rejected_folder=rejected_folder)
+            ),
+            checkpoint=checkpoint,
+            deduplicator=_worker_deduplicator,
+        )
+    except Exception as e:
+        return {"file": file, "ingestion_id": formatter.ingestion_id, "error": repr(e)}
+
+    return {
+        "file": file,
+        "digest": checkpoint.digest,
+        **formatter.generate_ingestion_status(**counts),
+    }
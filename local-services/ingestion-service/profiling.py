@@ -0,0 +1,76 @@
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Optional
+
+
+def sample_stacks(
+    seconds: float,
+    interval: float = 0.01,
+    thread_ids: Optional[Iterable[int]] = None,
+    top: int = 50,
+) -> Dict[str, Any]:
+    """
+    Profiles running threads by sampling their Python stacks at a fixed interval.
+
+    Sampling only reads the frames of the other threads, so the sampled code runs unchanged
+    and at full speed; the cost is one stack walk per thread every `interval` seconds.
+
+    Args:
+        seconds (float): How long to sample for.
+        interval (float, optional): The seconds between two samples. Defaults to 0.01.
+        thread_ids (Iterable[int], optional): The threads to sample. Defaults to every thread
+            but the sampling one.
+        top (int, optional): The number of stacks and functions returned. Defaults to 50.
+
+    Returns:
+        Dict[str, Any]: The number of 'samples' taken, the sampled 'duration_seconds', the most
+        frequent 'stacks' in the collapsed format of flame graph tools ("outer;...;inner") with
+        their sample counts, and the 'functions' seen the most, with the number of samples
+        where they were running ('self') and on the stack ('total').
+    """
+    current = threading.get_ident()
+    thread_ids = set(thread_ids) if thread_ids is not None else None
+    stacks: Counter = Counter()
+    own: Counter = Counter()
+    total: Counter = Counter()
+    samples = 0
+
+    start = time.monotonic()
+    deadline = start + seconds
+
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == current or (
+                thread_ids is not None and thread_id not in thread_ids
+            ):
+                continue
+
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            names.reverse()
+
+            stacks[";".join(names)] += 1
+            own[names[-1]] += 1
+            total.update(set(names))
+            samples += 1
+
+        time.sleep(interval)
+
+    return {
+        "samples": samples,
+        "duration_seconds": round(time.monotonic() - start, 3),
+        "stacks": [
+            {"stack": stack, "count": count} for stack, count in stacks.most_common(top)
+        ],
+        "functions": [
+            {"function": function, "self": own[function], "total": count}
+            for function, count in total.most_common(top)
+        ],
+    }
@@ -0,0 +1,184 @@
+import io
+import itertools
+import json
+from typing import Any, Dict, Iterable, List
+
+import fastavro
+
+# DATETIME has no Avro logical type, so datetimes are kept as the text BigQuery parses.
+BIGQUERY_TO_AVRO_TYPES = {
+    "STRING": "string",
+    "DATETIME": "string",
+    "TIMESTAMP": "string",
+    "DATE": "string",
+    "FLOAT": "double",
+    "FLOAT64": "double",
+    "INTEGER": "long",
+    "INT64": "long",
+    "BOOLEAN": "boolean",
+    "BOOL": "boolean",
+}
+
+
+def avro_schema_from_bigquery(
+    fields: List[Dict[str, str]], name: str = "Trip"
+) -> Dict[str, Any]:
+    """
+    Builds an Avro record schema from a BigQuery table schema.
+
+    Args:
+        fields (List[Dict[str, str]]): BigQuery schema fields, as found in
+            `infra-code/assets/trips_schema.json`.
+        name (str, optional): The name of the Avro record. Defaults to "Trip".
+
+    Returns:
+        Dict[str, Any]: An Avro record schema. NULLABLE fields become unions with null.
+
+    Raises:
+        ValueError: If a field has a BigQuery type without an Avro counterpart.
+    """
+    avro_fields = []
+
+    for field in fields:
+        if field["type"] not in BIGQUERY_TO_AVRO_TYPES:
+            raise ValueError(
+                f"Field {field['name']} has an unsupported type {field['type']}"
+            )
+
+        avro_type = BIGQUERY_TO_AVRO_TYPES[field["type"]]
+
+        if field.get("mode", "NULLABLE") == "NULLABLE":
+            avro_fields.append(
+                {"name": field["name"], "type": ["null", avro_type], "default": None}
+            )
+        else:
+            avro_fields.append({"name": field["name"], "type": avro_type})
+
+    return {"type": "record", "name": name, "fields": avro_fields}
+
+
+class JsonSerializer:
+    """
+    Encodes every record as its own JSON message. This is the format expected by the
+    BigQuery subscription of the events topic.
+    """
+
+    encoding = "json"
+
+    def encode(self, records: Iterable[Dict[str, Any]]) -> Iterable[tuple]:
+        """
+        Encodes records as JSON messages.
+
+        Args:
+            records (Iterable[Dict[str, Any]]): The records to encode.
+
+        Yields:
+            tuple: A `(message, count_of_records)` pair per record.
+        """
+        for record in records:
+            yield json.dumps(record, default=str).encode("utf-8"), 1
+
+    def decode(self, message: bytes) -> List[Dict[str, Any]]:
+        """
+        Decodes a JSON message back into its record.
+
+        Args:
+            message (bytes): A message produced by `encode`.
+
+        Returns:
+            List[Dict[str, Any]]: A list holding the single record of the message.
+        """
+        return [json.loads(message)]
+
+    def attributes(self, count: int) -> Dict[str, str]:
+        """
+        Returns the message attributes of an encoded message. JSON messages carry none,
+        so they are written as-is by the BigQuery subscription.
+        """
+        return {}
+
+
+class AvroPackedSerializer:
+    """
+    Packs many records into each message as a deflate-compressed Avro object container,
+    whose schema is built from the BigQuery table schema.
+    """
+
+    encoding = "avro-ocf"
+
+    def __init__(self, schema_path: str, records_per_message: int = 1000) -> None:
+        """
+        Initializes the AvroPackedSerializer with the BigQuery schema of the trips table.
+
+        Args:
+            schema_path (str): The path of the BigQuery schema file (`trips_schema.json`).
+            records_per_message (int, optional): The maximum number of records packed in a
+                single message. Defaults to 1000.
+        """
+        with open(schema_path, mode="r") as schema_file:
+            fields = json.load(schema_file)
+
+        self.schema = fastavro.parse_schema(avro_schema_from_bigquery(fields))
+        self.records_per_message = records_per_message
+        self._string_fields = [
+            field["name"]
+            for field in fields
+            if field["type"] in ("STRING", "DATETIME", "TIMESTAMP", "DATE")
+        ]
+
+    def _to_avro(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Converts values such as the UUID ingestion ID into their string representation.
+        """
+        for name in self._string_fields:
+            value = record.get(name)
+            if value is not None and not isinstance(value, str):
+                record[name] = str(value)
+
+        return record
+
+    def encode(self, records: Iterable[Dict[str, Any]]) -> Iterable[tuple]:
+        """
+        Packs records into Avro object container messages.
+
+        Args:
+            records (Iterable[Dict[str, Any]]): The records to encode.
+
+        Yields:
+            tuple: A `(message, count_of_records)` pair per packed message.
+        """
+        records = iter(records)
+
+        while chunk := [
+            self._to_avro(record)
+            for record in itertools.islice(records, self.records_per_message)
+        ]:
+            yield self._pack(chunk), len(chunk)
+
+    def _pack(self, records: List[Dict[str, Any]]) -> bytes:
+        """
+        Writes records into a single deflate-compressed Avro object container.
+        """
+        buffer = io.BytesIO()
+        fastavro.writer(buffer, self.schema, records, codec="deflate")
+
+        return buffer.getvalue()
+
+    def decode(self, message: bytes) -> List[Dict[str, Any]]:
+        """
+        Unpacks the records of a message produced by `encode`.
+
+        Args:
+            message (bytes): An Avro object container message.
+
+        Returns:
+            List[Dict[str, Any]]: The records packed in the message, in publish order.
+        """
+        return list(fastavro.reader(io.BytesIO(message)))
+
+    def attributes(self, count: int) -> Dict[str, str]:
+        """
+        Returns the message attributes of a packed message, which let consumers pick the
+        decoder and know how many records the message holds before decoding it.
+        """
+        return {"encoding": self.encoding, "records": str(count)}
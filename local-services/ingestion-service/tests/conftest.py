@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The service modules are imported by their flat names, as in the container.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
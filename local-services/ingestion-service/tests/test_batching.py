@@ -0,0 +1,92 @@
+import pytest
+
+from batching import (
+    BULK_LATENCY,
+    INTERACTIVE_LATENCY,
+    MAX_BYTES,
+    MAX_MESSAGES,
+    MIN_BYTES,
+    MIN_MESSAGES,
+    AdaptiveBatchSettings,
+)
+
+
+def observe_window(settings, latency=0.1, failures=0):
+    changed = [
+        settings.observe(latency=latency, failed=i < failures)
+        for i in range(settings.window)
+    ]
+    # Batch sizes are only adjusted once per window.
+    assert not any(changed[:-1])
+    return changed[-1]
+
+
+@pytest.fixture
+def settings():
+    return AdaptiveBatchSettings(target_latency=1.0, max_error_rate=0.01, window=100)
+
+
+def test_starts_with_small_interactive_batches(settings):
+    assert settings.max_messages == MIN_MESSAGES
+    assert settings.max_latency == INTERACTIVE_LATENCY
+    assert settings.batch_settings.max_messages == MIN_MESSAGES
+
+
+def test_grows_while_publishes_are_fast_and_successful(settings):
+    assert observe_window(settings)
+    assert (settings.max_messages, settings.max_bytes) == (
+        2 * MIN_MESSAGES,
+        2 * 1024 * 1024,
+    )
+
+    while observe_window(settings):
+        pass
+
+    assert (settings.max_messages, settings.max_bytes) == (MAX_MESSAGES, MAX_BYTES)
+    assert settings.last_adjustment.startswith("grow")
+
+
+@pytest.mark.parametrize(
+    "latency, failures", [(0.1, 2), (5.0, 0)], ids=["errors", "latency"]
+)
+def test_shrinks_on_errors_or_latency(settings, latency, failures):
+    observe_window(settings)
+    observe_window(settings)
+
+    assert observe_window(settings, latency=latency, failures=failures)
+    assert settings.max_messages == 2 * MIN_MESSAGES
+    assert settings.last_adjustment.startswith("shrink")
+
+    while observe_window(settings, latency=latency, failures=failures):
+        pass
+
+    assert (settings.max_messages, settings.max_bytes) == (MIN_MESSAGES, MIN_BYTES)
+
+
+def test_switches_latency_with_the_size_of_the_calls(settings):
+    # A single large call does not flip the mode.
+    assert not settings.observe_send(records=200)
+
+    while not settings.observe_send(records=1000):
+        pass
+    assert settings.max_latency == BULK_LATENCY
+    assert settings.stats()["mode"] == "bulk"
+
+    while not settings.observe_send(records=1):
+        pass
+    assert settings.max_latency == INTERACTIVE_LATENCY
+
+
+def test_stats_summarize_recent_messages(settings):
+    for latency in (0.1, 0.2, 0.3, 0.4):
+        settings.observe(latency=latency, failed=latency == 0.4)
+
+    recent = settings.stats()["recent"]
+
+    assert recent == {
+        "messages": 4,
+        "error_rate": 0.25,
+        "p50_latency_seconds": 0.3,
+        "p95_latency_seconds": 0.4,
+        "max_latency_seconds": 0.4,
+    }
@@ -0,0 +1,154 @@
+import uuid
+
+import pyarrow as pa
+import pytest
+
+import dedup
+from dedup import BloomFilter, TripDeduplicator
+from utils import CSV_COLUMNS, TRIP_SCHEMA, TripBatch
+
+
+def trips(*regions, ingestion_id=None, first_line=1):
+    rows = [
+        {
+            "region": region,
+            "origin_coord": "POINT (4.9 52.3)",
+            "destination_coord": "POINT (4.8 52.4)",
+            "datetime": "2018-05-28 09:03:40",
+            "datasource": "funny_car",
+        }
+        for region in regions
+    ]
+    return TripBatch(
+        pa.Table.from_pylist(rows, schema=TRIP_SCHEMA),
+        ingestion_id=ingestion_id or uuid.uuid4(),
+        first_line=first_line,
+    )
+
+
+def regions(batch):
+    return batch.table.column("region").to_pylist()
+
+
+@pytest.fixture
+def deduplicator(tmp_path):
+    return TripDeduplicator(tmp_path, capacity=1000)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=100, error_rate=0.01)
+    digests = [uuid.uuid4().bytes for _ in range(100)]
+    for digest in digests:
+        bloom.add(digest)
+
+    assert all(digest in bloom for digest in digests)
+
+
+def test_bloom_filter_merges_only_filters_of_the_same_size():
+    bloom = BloomFilter(capacity=100, error_rate=0.01)
+    other = BloomFilter(capacity=100, error_rate=0.01)
+    other.add(b"k" * 16)
+
+    assert bloom.merge(other.to_bytes())
+    assert b"k" * 16 in bloom
+    assert not bloom.merge(BloomFilter(capacity=10, error_rate=0.01).to_bytes())
+
+
+def test_digests_depend_on_every_field():
+    batch = trips("NL", "NL")
+    table = batch.table.set_column(
+        CSV_COLUMNS.index("datasource"),
+        "datasource",
+        pa.array(["funny_car", "cheap_mobile"]),
+    )
+
+    digests = TripDeduplicator.digests(TripBatch(table, ingestion_id=uuid.uuid4()))
+
+    assert len(digests) == 2 and digests[0] != digests[1]
+    assert all(len(digest) == 16 for digest in digests)
+
+
+def test_filter_batch_claims_new_trips(deduplicator):
+    batch, duplicates = deduplicator.filter_batch(trips("NL", "DE"))
+
+    assert (regions(batch), duplicates) == (["NL", "DE"], 0)
+
+
+def test_filter_batch_drops_duplicates_within_a_batch(deduplicator):
+    batch, duplicates = deduplicator.filter_batch(trips("NL", "DE", "NL"))
+
+    assert (regions(batch), duplicates) == (["NL", "DE"], 1)
+    assert batch.line_numbers.to_pylist() == [1, 2]
+
+
+def test_filter_batch_drops_trips_claimed_by_another_ingestion(deduplicator):
+    deduplicator.filter_batch(trips("NL", "DE"))
+
+    batch, duplicates = deduplicator.filter_batch(trips("DE", "FR"))
+
+    assert (regions(batch), duplicates) == (["FR"], 1)
+
+
+def test_resumed_ingestion_keeps_its_own_rows(deduplicator):
+    ingestion_id = uuid.uuid4()
+    deduplicator.filter_batch(trips("NL", "DE", ingestion_id=ingestion_id))
+
+    # The same rows read again, at the same lines, by the same ingestion.
+    batch, duplicates = deduplicator.filter_batch(
+        trips("NL", "DE", ingestion_id=ingestion_id)
+    )
+    assert (regions(batch), duplicates) == (["NL", "DE"], 0)
+
+    # The same trips at other lines of the same ingestion are duplicates.
+    batch, duplicates = deduplicator.filter_batch(
+        trips("NL", ingestion_id=ingestion_id, first_line=10)
+    )
+    assert (regions(batch), duplicates) == ([], 1)
+
+
+def test_released_trips_can_be_claimed_again(deduplicator):
+    batch, _ = deduplicator.filter_batch(trips("NL", "DE", "NL"))
+
+    deduplicator.release(batch)
+
+    batch, duplicates = deduplicator.filter_batch(trips("NL", "DE"))
+    assert (regions(batch), duplicates) == (["NL", "DE"], 0)
+
+
+def test_release_reuses_the_digests_of_filter_batch(deduplicator, monkeypatch):
+    batch, _ = deduplicator.filter_batch(trips("NL", "DE", "NL"))
+    monkeypatch.setattr(
+        TripDeduplicator, "digests", staticmethod(lambda batch: pytest.fail("rehashed"))
+    )
+
+    deduplicator.release(batch)
+
+
+@pytest.mark.parametrize("keep_filter", [True, False])
+def test_claims_survive_a_restart(tmp_path, keep_filter):
+    deduplicator = TripDeduplicator(tmp_path, capacity=1000)
+    deduplicator.filter_batch(trips("NL", "DE"))
+    deduplicator.save()
+    if not keep_filter:
+        # The filter only saves lookups: it is rebuilt from the index.
+        (tmp_path / "trips.bloom").unlink()
+
+    batch, duplicates = TripDeduplicator(tmp_path, capacity=1000).filter_batch(
+        trips("DE", "FR")
+    )
+
+    assert (regions(batch), duplicates) == (["FR"], 1)
+
+
+def test_prune_forgets_expired_trips(tmp_path, monkeypatch):
+    deduplicator = TripDeduplicator(tmp_path, capacity=1000, retention_days=1)
+    deduplicator.filter_batch(trips("NL"))
+    now = dedup.time.time()
+    monkeypatch.setattr(dedup.time, "time", lambda: now + 2 * 86400)
+    deduplicator.filter_batch(trips("DE"))
+
+    deduplicator.prune()
+
+    assert dedup.DEDUP_KEYS._value.get() == 1
+    batch, duplicates = deduplicator.filter_batch(trips("NL", "DE"))
+    assert (regions(batch), duplicates) == (["NL"], 1)
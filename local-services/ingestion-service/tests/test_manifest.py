@@ -0,0 +1,139 @@
+import threading
+from concurrent import futures
+
+import pytest
+
+from manifest import IngestionManifest
+from pipeline import stream_file
+from utils import DataFormatter, FileHandler
+
+LINE = "NL,POINT (4.9 52.{0}),POINT (4.8 52.4),2018-05-28 09:03:40,funny_car\n"
+
+
+class FlakyPublisher:
+    """
+    Records the published records, and fails the futures of the `fail_on`-th send.
+    """
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.sends = 0
+        self.records = []
+
+    def send(self, records):
+        self.sends += 1
+        future = futures.Future()
+        if self.sends == self.fail_on:
+            future.set_exception(RuntimeError("publish failed"))
+        else:
+            self.records.extend(records)
+            future.set_result("message-id")
+        return [future]
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return IngestionManifest(tmp_path / "manifest")
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    (tmp_path / "trips.csv").write_text(
+        "region,origin_coord,destination_coord,datetime,datasource\n"
+        + "".join(LINE.format(i) for i in range(10))
+    )
+    return tmp_path / "trips.csv"
+
+
+def test_new_file_has_an_empty_checkpoint(manifest, csv_file):
+    checkpoint = manifest.open(csv_file)
+
+    assert checkpoint.ingestion_id is None
+    assert not checkpoint.completed
+    assert checkpoint.rows == 0
+    assert checkpoint.counts == {"count": 0, "rejected": 0, "duplicates": 0}
+
+
+def test_checkpoint_is_saved_and_keyed_by_content(manifest, csv_file, tmp_path):
+    formatter = DataFormatter()
+    checkpoint = manifest.open(csv_file)
+    checkpoint.start(csv_file.name, formatter.ingestion_id)
+    checkpoint.update(rows=4, count=3, rejected=1)
+
+    copy = tmp_path / "renamed.csv"
+    copy.write_bytes(csv_file.read_bytes())
+    reloaded = IngestionManifest(manifest.path).open(copy)
+
+    assert reloaded.ingestion_id == formatter.ingestion_id
+    assert reloaded.rows == 4
+    assert reloaded.status == {
+        "ingestion_id": str(formatter.ingestion_id),
+        "count": 3,
+        "rejected": 1,
+        "duplicates": 0,
+    }
+    assert not list(manifest.path.glob("*.tmp"))
+
+    reloaded.complete()
+    assert manifest.open(csv_file).completed
+
+
+def test_interrupted_ingestion_resumes_from_its_checkpoint(manifest, csv_file):
+    file_handler = FileHandler(dir=str(csv_file.parent))
+    checkpoint = manifest.open(csv_file)
+    formatter = DataFormatter()
+    checkpoint.start(csv_file.name, formatter.ingestion_id)
+    publisher = FlakyPublisher(fail_on=3)
+
+    with pytest.raises(RuntimeError):
+        stream_file(
+            file_handler=file_handler,
+            file=csv_file.name,
+            has_header=True,
+            formatter=formatter,
+            publisher=publisher,
+            chunk_size=3,
+            checkpoint=checkpoint,
+        )
+
+    # The first two chunks were acknowledged before the third one failed.
+    checkpoint = manifest.open(csv_file)
+    assert checkpoint.rows == 6
+    assert checkpoint.counts["count"] == 6
+
+    resumed = DataFormatter(ingestion_id=checkpoint.ingestion_id)
+    counts = stream_file(
+        file_handler=file_handler,
+        file=csv_file.name,
+        has_header=True,
+        formatter=resumed,
+        publisher=publisher,
+        chunk_size=3,
+        checkpoint=checkpoint,
+    )
+
+    assert counts == {"count": 10, "rejected": 0, "duplicates": 0}
+    # The last chunk was sent before the failure surfaced, and is sent again on resume:
+    # delivery is at-least-once.
+    assert [record["origin_coord"] for record in publisher.records] == [
+        f"POINT (4.9 52.{i})" for i in [0, 1, 2, 3, 4, 5, 9, 6, 7, 8, 9]
+    ]
+    assert {record["ingestion_id"] for record in publisher.records} == {
+        formatter.ingestion_id
+    }
+
+
+def test_lock_serializes_ingestions_of_the_same_content(manifest):
+    acquired = threading.Event()
+
+    def ingest_copy():
+        with manifest.lock("digest"):
+            acquired.set()
+
+    with manifest.lock("digest"):
+        copy = threading.Thread(target=ingest_copy)
+        copy.start()
+        assert not acquired.wait(0.2)
+
+    copy.join(5)
+    assert acquired.is_set()
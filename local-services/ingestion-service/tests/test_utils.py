@@ -0,0 +1,53 @@
+import pytest
+
+from geo import add_geo_columns
+from utils import CSV_COLUMNS, DataFormatter
+
+LINES = [
+    "NL,POINT (4.9 52.3),POINT (4.8 52.4),2018-05-28 09:03:40,funny_car\n",
+    "DE,POINT (13.4 52.5),POINT (13.3 52.6),2018-05-29 10:00:00,cheap_mobile\r\n",
+    "IT,POINT (12.5 41.9),POINT (12.4 41.8),2018-05-30 11:30:00,baba_car,extra,fields\n",
+    "  FR,POINT (2.3 48.8),POINT (2.4 48.9),2018-05-31 12:00:00,pt_search_app  \r\n",
+    "CZ,POINT (14.4 50.0),POINT (14.5 50.1),2018-06-01 13:00:00,bad_diesel_vehicles",
+]
+
+
+@pytest.fixture
+def formatter():
+    return DataFormatter()
+
+
+def test_from_csv_batch_matches_from_csv(formatter):
+    batch = formatter.from_csv_batch(LINES)
+    batch.table = add_geo_columns(batch.table)
+
+    assert list(batch.to_records()) == [formatter.from_csv(line) for line in LINES]
+    assert batch.line_numbers.to_pylist() == [1, 2, 3, 4, 5]
+    assert batch.rejected == []
+
+
+def test_from_csv_batch_skips_blank_lines(formatter):
+    batch = formatter.from_csv_batch(
+        [LINES[0], "\n", "  \r\n", LINES[1]], first_line=10
+    )
+
+    assert [record["region"] for record in batch.to_records()] == ["NL", "DE"]
+    assert batch.line_numbers.to_pylist() == [10, 13]
+    assert batch.rejected == []
+
+
+def test_from_csv_batch_rejects_lines_with_missing_fields(formatter):
+    batch = formatter.from_csv_batch(
+        [LINES[0], "NL,POINT (4.9 52.3),2018-05-28 09:03:40\r\n", LINES[1]],
+        first_line=2,
+    )
+
+    assert batch.table.column_names == CSV_COLUMNS
+    assert batch.line_numbers.to_pylist() == [2, 4]
+    assert batch.rejected == [
+        {
+            "line": 3,
+            "reason": "expected 5 fields, found 3",
+            "record": "NL,POINT (4.9 52.3),2018-05-28 09:03:40",
+        }
+    ]
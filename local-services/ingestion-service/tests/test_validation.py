@@ -0,0 +1,104 @@
+import csv
+import uuid
+
+import pyarrow as pa
+import pytest
+
+from utils import TRIP_SCHEMA, DataFormatter, TripBatch
+from validation import BatchValidator, DeadLetterSink
+
+VALID = {
+    "region": "NL",
+    "origin_coord": "POINT (4.9 52.3)",
+    "destination_coord": "POINT (-74.0 40.7)",
+    "datetime": "2018-05-28 09:03:40",
+    "datasource": "funny_car",
+}
+
+
+def batch_of(*rows):
+    return TripBatch(
+        pa.Table.from_pylist([{**VALID, **row} for row in rows], schema=TRIP_SCHEMA),
+        ingestion_id=uuid.uuid4(),
+    )
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        {},
+        {"origin_coord": "POINT (-180 -90)", "destination_coord": "POINT (180 90)"},
+        {"origin_coord": "POINT(4.9 52.3)"},
+        {"datetime": "2018-05-28T09:03:40"},
+        {"datetime": "2018-05-28 09:03:40.123456"},
+        {"datetime": "2020-02-29 23:59:59"},
+    ],
+)
+def test_accepts_valid_rows(row):
+    batch = batch_of(row)
+
+    assert BatchValidator().validate(batch) is batch
+
+
+@pytest.mark.parametrize(
+    "row, reason",
+    [
+        ({"origin_coord": "POINT (181 52.3)"}, "invalid origin_coord"),
+        ({"origin_coord": "POINT (4.9 -90.5)"}, "invalid origin_coord"),
+        ({"origin_coord": "4.9 52.3"}, "invalid origin_coord"),
+        ({"origin_coord": None}, "invalid origin_coord"),
+        ({"destination_coord": "POINT (4.9)"}, "invalid destination_coord"),
+        ({"datetime": "2018-02-30 09:03:40"}, "invalid datetime"),
+        ({"datetime": "2018-05-28 24:00:00"}, "invalid datetime"),
+        ({"datetime": "2018-05-28"}, "invalid datetime"),
+        ({"datetime": "28/05/2018 09:03:40"}, "invalid datetime"),
+        ({"datetime": None}, "invalid datetime"),
+        # The first invalid column gives the reason.
+        ({"origin_coord": "x", "datetime": "x"}, "invalid origin_coord"),
+    ],
+)
+def test_rejects_invalid_rows(row, reason):
+    batch = BatchValidator().validate(batch_of({}, row, {}))
+
+    assert len(batch) == 2
+    assert batch.line_numbers.to_pylist() == [1, 3]
+    assert [(rejected["line"], rejected["reason"]) for rejected in batch.rejected] == [
+        (2, reason)
+    ]
+
+
+def test_keeps_the_rows_rejected_by_the_parser():
+    batch = DataFormatter().from_csv_batch(
+        [
+            "NL,POINT (4.9 52.3),POINT (4.8 52.4),2018-05-28 09:03:40,funny_car\n",
+            "NL,POINT (4.9 52.3)\n",
+            "NL,POINT (4.9 52.3),POINT (4.8 52.4),2018-13-28 09:03:40,funny_car\n",
+        ]
+    )
+
+    validated = BatchValidator().validate(batch)
+
+    assert len(validated) == 1
+    assert [rejected["line"] for rejected in validated.rejected] == [2, 3]
+    assert validated.rejected[1]["record"] == (
+        "NL,POINT (4.9 52.3),POINT (4.8 52.4),2018-13-28 09:03:40,funny_car"
+    )
+
+
+def test_dead_letter_sink_appends_to_a_single_file(tmp_path):
+    path = tmp_path / "trips.rejected.csv"
+    sink = DeadLetterSink(path)
+    sink.write([])
+    assert not path.exists()
+
+    sink.write([{"line": 2, "reason": "invalid datetime", "record": "a,b"}])
+    sink.close()
+    sink.write([{"line": 7, "reason": "invalid origin_coord", "record": "c"}])
+    sink.close()
+
+    with open(path, newline="") as f:
+        assert list(csv.DictReader(f)) == [
+            {"line": "2", "reason": "invalid datetime", "record": "a,b"},
+            {"line": "7", "reason": "invalid origin_coord", "record": "c"},
+        ]
+    assert sink.count == 2
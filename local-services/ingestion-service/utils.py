@@ -1,11 +1,101 @@
-import copy
+import gzip
+import io
+import itertools
+import mmap
+import os
 import shutil
 import uuid
 from pathlib import Path
-from typing import Dict, Generator, List
+from typing import Any, Dict, Generator, List, Optional, Union
 
+import pyarrow as pa
+import pyarrow.compute as pc
+from geo import point_fields
+from pyarrow import json as pa_json
+from pyarrow import parquet as pq
 from pydantic import BaseModel
 
+CSV_COLUMNS = ["region", "origin_coord", "destination_coord", "datetime", "datasource"]
+TRIP_SCHEMA = pa.schema([(column, pa.string()) for column in CSV_COLUMNS])
+# Base path of every `FileHandler` directory.
+BASE_DIR = Path(os.environ.get("FILES_BASE_DIR", "/home/user"))
+
+# Input formats, by file name suffix and by leading magic bytes.
+FILE_SUFFIXES = {
+    ".csv": "csv",
+    ".gz": "gzip",
+    ".zst": "zstd",
+    ".parquet": "parquet",
+}
+FILE_MAGIC_BYTES = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"PAR1": "parquet",
+}
+FILE_PATTERNS = ["*.csv", "*.csv.gz", "*.csv.zst", "*.parquet"]
+
+
+class TripBatch:
+    """
+    A compact columnar batch of trips backed by an Arrow table. The ingestion ID is
+    stored once for the whole batch instead of being copied into every record.
+    """
+
+    def __init__(
+        self,
+        table: pa.Table,
+        ingestion_id: uuid.UUID,
+        first_line: int = 1,
+        line_numbers: Optional[pa.Array] = None,
+        rejected: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        """
+        Initializes the TripBatch with its columns and the ingestion ID shared by all rows.
+
+        Args:
+            table (pa.Table): An Arrow table with one string column per entry of `CSV_COLUMNS`.
+            ingestion_id (uuid.UUID): The ingestion ID of every record in the batch.
+            first_line (int, optional): The line (or record) number of the first row in its
+                source, used when `line_numbers` is not given. Defaults to 1.
+            line_numbers (pa.Array, optional): The line number of every row in its source,
+                when rows are not contiguous lines. Defaults to consecutive numbers.
+            rejected (List[Dict[str, Any]], optional): The rows of the source left out of the
+                batch, each with its 'line', the 'reason' and the raw 'record'. Defaults to none.
+        """
+        self.table = table
+        self.ingestion_id = ingestion_id
+        self.first_line = first_line
+        self._line_numbers = line_numbers
+        self.rejected = rejected or []
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def line_numbers(self) -> pa.Array:
+        """
+        The line number of every row in its source.
+        """
+        if self._line_numbers is None:
+            self._line_numbers = pa.array(
+                range(self.first_line, self.first_line + len(self)), type=pa.int64()
+            )
+
+        return self._line_numbers
+
+    def to_records(self) -> Generator:
+        """
+        Materializes the batch as records, one at a time.
+
+        Yields:
+            Dict[str, str]: A dictionary per row, with the columns of the table of the batch
+            and its 'ingestion_id'. The coordinates and cells of `DataFormatter.from_csv` are
+            only there when `add_geo_columns` was applied to the table.
+        """
+        for record in self.table.to_pylist():
+            record["ingestion_id"] = self.ingestion_id
+            yield record
+
 
 class DataFormatter:
     """
@@ -13,11 +103,15 @@ class DataFormatter:
     from different sources, such as CSV strings or Pydantic models into JSON.
     """
 
-    def __init__(self):
+    def __init__(self, ingestion_id: Optional[uuid.UUID] = None):
         """
         Initializes the DataFormatter instance with a unique ingestion ID.
+
+        Args:
+            ingestion_id (uuid.UUID, optional): The ID of an interrupted ingestion to resume.
+                A new ID is generated when not given.
         """
-        self.ingestion_id = uuid.uuid4()
+        self.ingestion_id = ingestion_id or uuid.uuid4()
 
     def _add_ingestion_id(self, data: Dict[str, str]) -> Dict[str, str]:
         """
@@ -30,10 +124,7 @@ class DataFormatter:
             Dict[str, str]: A new dictionary containing the original data with an added
             'ingestion_id' field.
         """
-        new_data = copy.deepcopy(data)
-        new_data["ingestion_id"] = self.ingestion_id
-
-        return new_data
+        return {**data, "ingestion_id": self.ingestion_id}
 
     def from_csv(self, data: str):
         """
@@ -44,7 +135,8 @@ class DataFormatter:
 
         Returns:
             Dict[str, str]: A dictionary with keys for 'region', 'origin_coord',
-            'destination_coord', 'datetime', and 'datasource', with an added 'ingestion_id'.
+            'destination_coord', 'datetime', and 'datasource', the coordinates and cells derived
+            from them (see `geo.GEO_COLUMNS`), and an added 'ingestion_id'.
         """
         items = data.strip().split(",")
 
@@ -55,9 +147,126 @@ class DataFormatter:
                 "destination_coord": items[2],
                 "datetime": items[3],
                 "datasource": items[4],
+                **point_fields("origin_coord", items[1]),
+                **point_fields("destination_coord", items[2]),
             }
         )
 
+    def from_csv_batch(self, data: List[str], first_line: int = 1) -> TripBatch:
+        """
+        Parses many CSV lines at once into a columnar batch.
+
+        The lines are split with Arrow compute kernels, which avoids splitting lines and
+        building dictionaries in Python, with the same rules as `from_csv`: surrounding
+        whitespace (including the "\\r" of CRLF line endings) is stripped from every line,
+        quotes are not interpreted, fields are kept as strings and fields beyond the entries
+        of `CSV_COLUMNS` are ignored. Blank lines are skipped, and lines with fewer fields
+        are left out of the batch and reported in its `rejected` rows instead of failing the
+        whole chunk.
+
+        Args:
+            data (List[str]): CSV-formatted lines, each one representing a single record.
+            first_line (int, optional): The line number of the first line in its file.
+                Defaults to 1.
+
+        Returns:
+            TripBatch: A batch with one column per entry of `CSV_COLUMNS` and the ingestion ID
+            of this formatter.
+        """
+        lines = pc.utf8_trim_whitespace(pa.array(data, type=pa.string()))
+        line_numbers = pa.array(
+            range(first_line, first_line + len(data)), type=pa.int64()
+        )
+
+        not_blank = pc.not_equal(lines, "")
+        lines = lines.filter(not_blank)
+        line_numbers = line_numbers.filter(not_blank)
+
+        # At most one more split than columns, so extra fields end up in an ignored element.
+        fields = pc.split_pattern(lines, ",", max_splits=len(CSV_COLUMNS))
+        found = pc.list_value_length(fields)
+        complete = pc.greater_equal(found, len(CSV_COLUMNS))
+
+        malformed = []
+        if pc.all(complete).as_py() is False:
+            incomplete = pc.invert(complete)
+            malformed = [
+                {
+                    "line": line,
+                    "reason": f"expected {len(CSV_COLUMNS)} fields, found {count}",
+                    "record": record,
+                }
+                for line, count, record in zip(
+                    line_numbers.filter(incomplete).to_pylist(),
+                    found.filter(incomplete).to_pylist(),
+                    lines.filter(incomplete).to_pylist(),
+                )
+            ]
+            fields = fields.filter(complete)
+            line_numbers = line_numbers.filter(complete)
+
+        table = pa.table(
+            [pc.list_element(fields, index) for index in range(len(CSV_COLUMNS))],
+            schema=TRIP_SCHEMA,
+        )
+
+        return TripBatch(
+            table=table,
+            ingestion_id=self.ingestion_id,
+            first_line=first_line,
+            line_numbers=line_numbers,
+            rejected=malformed,
+        )
+
+    def from_ndjson_batch(self, data: bytes, first_line: int = 1) -> TripBatch:
+        """
+        Parses many newline-delimited JSON records at once into a columnar batch.
+
+        Args:
+            data (bytes): Complete NDJSON lines, each one representing a single record.
+                Fields other than `CSV_COLUMNS` are ignored.
+            first_line (int, optional): The line number of the first line in its upload.
+                Defaults to 1.
+
+        Returns:
+            TripBatch: A batch with one column per entry of `CSV_COLUMNS` and the ingestion ID
+            of this formatter.
+        """
+        table = pa_json.read_json(
+            pa.BufferReader(data),
+            parse_options=pa_json.ParseOptions(
+                explicit_schema=TRIP_SCHEMA, unexpected_field_behavior="ignore"
+            ),
+        )
+
+        return self.from_arrow(table, first_line=first_line)
+
+    def from_arrow(
+        self, data: Union[pa.Table, pa.RecordBatch], first_line: int = 1
+    ) -> TripBatch:
+        """
+        Turns Arrow data, such as a batch read from an Arrow IPC stream or a Parquet file,
+        into a batch of trips.
+
+        Args:
+            data (Union[pa.Table, pa.RecordBatch]): Arrow data holding at least the columns
+                of `CSV_COLUMNS`. Other columns are dropped and values are cast to strings.
+            first_line (int, optional): The record number of the first row in its source.
+                Defaults to 1.
+
+        Returns:
+            TripBatch: A batch with one column per entry of `CSV_COLUMNS` and the ingestion ID
+            of this formatter.
+        """
+        if isinstance(data, pa.RecordBatch):
+            data = pa.Table.from_batches([data])
+
+        return TripBatch(
+            table=data.select(CSV_COLUMNS).cast(TRIP_SCHEMA),
+            ingestion_id=self.ingestion_id,
+            first_line=first_line,
+        )
+
     def from_pydantic(self, data: List[BaseModel]) -> Generator:
         """
         Converts a list of Pydantic model instances into dictionaries with an ingestion ID.
@@ -66,47 +275,99 @@ class DataFormatter:
             data (List[BaseModel]): A list of Pydantic model instances to convert.
 
         Yields:
-            Dict[str, str]: A dictionary representation of each model instance with
-            an added 'ingestion_id'.
+            Dict[str, str]: A dictionary representation of each model instance with the
+            coordinates and cells derived from its points and an added 'ingestion_id'.
         """
         for d in data:
-            yield self._add_ingestion_id(d.__dict__)
-
-    def generate_ingestion_status(self, data: List[Dict[str, str]]) -> Dict[str, str]:
+            yield self._add_ingestion_id(
+                {
+                    **d.__dict__,
+                    **point_fields("origin_coord", d.origin_coord),
+                    **point_fields("destination_coord", d.destination_coord),
+                }
+            )
+
+    def generate_ingestion_status(
+        self, count: int, rejected: int = 0, duplicates: int = 0
+    ) -> Dict[str, str]:
         """
         Generates a summary status for the ingestion, including the ingestion ID
         and the count of records sent by the invoker.
 
         Args:
-            data (List[Dict[str, str]]): A list of ingested data dictionaries.
+            count (int): The total number of records published for this ingestion. Streaming
+            callers pass their running count, so the whole dataset never needs to be held in memory.
+            rejected (int, optional): The number of records rejected by validation and written to
+            a dead-letter file instead of being published. Defaults to 0.
+            duplicates (int, optional): The number of records dropped because they were already
+            ingested. Defaults to 0.
 
         Returns:
-            Dict[str, str]: A dictionary with the 'ingestion_id' and 'count' of ingested records.
+            Dict[str, str]: A dictionary with the 'ingestion_id', the 'count' of accepted (ingested)
+            records, the number of 'rejected' records and the number of 'duplicates' suppressed.
         """
-        return {"ingestion_id": self.ingestion_id, "count": len(data)}
+        return {
+            "ingestion_id": self.ingestion_id,
+            "count": count,
+            "rejected": rejected,
+            "duplicates": duplicates,
+        }
 
 
 class FileHandler:
     """
-    Handles file operations such as reading CSV files, listing files in a directory,
-    and moving files to a specified processed folder.
+    Handles file operations such as reading CSV files (plain, gzip or zstd compressed)
+    and Parquet files, listing files in a directory, and moving files to a specified
+    processed folder.
     """
 
-    def __init__(self, dir: str) -> None:
+    def __init__(self, dir: str, mmap_threshold: int = 64 * 1024 * 1024) -> None:
         """
         Initializes the FileHandler with a specified directory path.
 
         Args:
             dir (str): The directory relative to the base path where files are located.
+            mmap_threshold (int, optional): The size in bytes from which uncompressed CSV
+            files are read through a memory map. Defaults to 64 MB.
         """
         self.dir = dir
-        self.base_dir_path = Path("/home/user")
+        self.base_dir_path = BASE_DIR
         self.path = self.base_dir_path / dir
+        self.mmap_threshold = mmap_threshold
+
+    def detect_format(self, file: str) -> str:
+        """
+        Detects the format of a file from its extension or, failing that, its magic bytes.
+
+        Args:
+            file (str): The name of the file.
+
+        Returns:
+            str: One of "csv", "gzip" (gzip-compressed CSV), "zstd" (zstd-compressed CSV)
+            or "parquet". Files that match none of them are read as plain CSV.
+        """
+        suffix = Path(file).suffix.lower()
+
+        if suffix in FILE_SUFFIXES:
+            return FILE_SUFFIXES[suffix]
+
+        with open(self.path / file, mode="rb") as f:
+            head = f.read(4)
+
+        for magic, file_format in FILE_MAGIC_BYTES.items():
+            if head.startswith(magic):
+                return file_format
+
+        return "csv"
 
     def read_csv(self, file: str, has_header=False) -> Generator:
         """
         Reads lines from a CSV file, optionally skipping the header row.
 
+        Gzip and zstd compressed files are decompressed on the fly, and uncompressed
+        files larger than `mmap_threshold` are read through a memory map, so none of
+        them needs to be copied or decompressed to disk first.
+
         Args:
             file (str): The name of the CSV file to read.
             has_header (bool, optional): If True, skips the first line of the file
@@ -115,19 +376,112 @@ class FileHandler:
         Yields:
             str: Each line in the CSV file after optional header removal.
         """
-        with open(file=self.path / file, mode="r") as lines:
-            for line_no, line in enumerate(lines):
-                if (has_header and line_no > 0) or (not has_header):  # skip first line
-                    yield line
+        for line_no, line in enumerate(self._read_lines(file)):
+            if (has_header and line_no > 0) or (not has_header):  # skip first line
+                yield line
+
+    def _read_lines(self, file: str) -> Generator:
+        """
+        Yields the decoded lines of a CSV file, whatever its compression.
+        """
+        file_path = self.path / file
+        file_format = self.detect_format(file)
+
+        if file_format == "gzip":
+            with gzip.open(file_path, mode="rt") as lines:
+                yield from lines
+
+        elif file_format == "zstd":
+            import zstandard
+
+            with open(file_path, mode="rb") as compressed:
+                reader = zstandard.ZstdDecompressor().stream_reader(compressed)
+                with io.TextIOWrapper(reader, encoding="utf-8") as lines:
+                    yield from lines
+
+        elif file_path.stat().st_size >= self.mmap_threshold:
+            with (
+                open(file_path, mode="rb") as f,
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            ):
+                for line in iter(mapped.readline, b""):
+                    yield line.decode("utf-8")
+
+        else:
+            with open(file=file_path, mode="r") as lines:
+                yield from lines
+
+    def read_parquet(
+        self, file: str, batch_size: int = 10000, skip_rows: int = 0
+    ) -> Generator:
+        """
+        Reads a Parquet file in record batches, loading only the trip columns.
+
+        Args:
+            file (str): The name of the Parquet file to read.
+            batch_size (int, optional): The maximum number of rows per batch. Defaults to 10000.
+            skip_rows (int, optional): The number of leading rows to skip. Row groups made only
+                of skipped rows are not read at all. Defaults to 0.
+
+        Yields:
+            pa.RecordBatch: Batches of at most `batch_size` rows with the `CSV_COLUMNS` columns.
+        """
+        parquet_file = pq.ParquetFile(self.path / file, memory_map=True)
+        row_groups = []
+
+        for row_group in range(parquet_file.num_row_groups):
+            num_rows = parquet_file.metadata.row_group(row_group).num_rows
+            if skip_rows >= num_rows and not row_groups:
+                skip_rows -= num_rows
+            else:
+                row_groups.append(row_group)
+
+        for batch in parquet_file.iter_batches(
+            batch_size=batch_size, row_groups=row_groups, columns=CSV_COLUMNS
+        ):
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+
+            yield batch.slice(skip_rows)
+            skip_rows = 0
+
+    def read_csv_chunks(
+        self, file: str, has_header=False, chunk_size: int = 10000, skip_rows: int = 0
+    ) -> Generator:
+        """
+        Reads a CSV file in fixed-size chunks of lines, so callers can process files of
+        any size with a bounded amount of memory.
+
+        Args:
+            file (str): The name of the CSV file to read.
+            has_header (bool, optional): If True, skips the first line of the file
+            (header). Defaults to False.
+            chunk_size (int, optional): The maximum number of lines per chunk. Defaults to 10000.
+            skip_rows (int, optional): The number of lines to skip after the header, when resuming
+                an interrupted ingestion. Skipped lines are read but not returned. Defaults to 0.
+
+        Yields:
+            List[str]: Lists of at most `chunk_size` lines, in file order.
+        """
+        lines = itertools.islice(
+            self.read_csv(file=file, has_header=has_header), skip_rows, None
+        )
+
+        while chunk := list(itertools.islice(lines, chunk_size)):
+            yield chunk
 
     def list_files(self) -> Generator:
         """
-        Lists all CSV files in the directory and its subdirectories.
+        Lists all CSV (plain, .csv.gz and .csv.zst) and Parquet files in the directory and
+        its subdirectories.
 
         Yields:
-            Path: Each path object representing a CSV file in the directory.
+            Path: Each path object representing an input file in the directory.
         """
-        return self.path.rglob("*.csv")
+        return itertools.chain.from_iterable(
+            self.path.rglob(pattern) for pattern in FILE_PATTERNS
+        )
 
     def move_file(self, file: str, processed_folder: str) -> None:
         """
@@ -149,6 +503,23 @@ class FileHandler:
 
         shutil.move(file_path, dst_path.as_posix())
 
+    def dead_letter_path(self, file: str, rejected_folder: str) -> Path:
+        """
+        Returns the path of the dead-letter file collecting the rejected rows of a file.
+
+        Args:
+            file (str): The name of the ingested file.
+            rejected_folder (str): The directory under the base path where dead-letter files
+            are written.
+
+        Side Effects:
+            - Creates the rejected folder if it doesn't exist.
+        """
+        dst_path = self.base_dir_path / rejected_folder
+        Path.mkdir(dst_path, exist_ok=True)
+
+        return dst_path / f"{Path(file).name}.rejected.csv"
+
     def move_files(self, files: List[str], processed_folder: str) -> None:
         """
         Moves multiple files to a specified processed folder.
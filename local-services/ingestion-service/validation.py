@@ -0,0 +1,171 @@
+import csv
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from geo import parse_points
+from utils import CSV_COLUMNS, TripBatch
+
+# Formats accepted by the BigQuery DATETIME column.
+DATETIME_PATTERN = r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?$"
+
+
+class BatchValidator:
+    """
+    Validates whole batches of trips at once, with Arrow compute kernels, against the
+    constraints of the BigQuery `trips` table.
+    """
+
+    def validate(self, batch: TripBatch) -> TripBatch:
+        """
+        Splits a batch into its valid rows and its rejected rows.
+
+        A row is rejected when `origin_coord` or `destination_coord` is not a `POINT (lon lat)`
+        WKT with a longitude in [-180, 180] and a latitude in [-90, 90], or when `datetime` is
+        not a valid `YYYY-MM-DD HH:MM:SS[.ffffff]` timestamp.
+
+        Args:
+            batch (TripBatch): The batch to validate.
+
+        Returns:
+            TripBatch: A batch holding the valid rows only. The rejected rows are appended to
+            its `rejected` rows, with their line number and the reason of the rejection.
+        """
+        table = batch.table
+        reasons = pa.nulls(table.num_rows, type=pa.string())
+
+        for column in ("origin_coord", "destination_coord"):
+            reasons = self._reject(reasons, self._valid_point(table[column]), column)
+
+        reasons = self._reject(
+            reasons, self._valid_datetime(table["datetime"]), "datetime"
+        )
+
+        valid = pc.is_null(reasons)
+
+        if pc.all(valid).as_py() is not False:
+            return batch
+
+        invalid = pc.invert(valid)
+        line_numbers = batch.line_numbers
+
+        return TripBatch(
+            table=table.filter(valid),
+            ingestion_id=batch.ingestion_id,
+            line_numbers=line_numbers.filter(valid),
+            rejected=batch.rejected
+            + self._rejected_rows(
+                table.filter(invalid),
+                line_numbers.filter(invalid),
+                reasons.filter(invalid),
+            ),
+        )
+
+    def _valid_point(self, coords: pa.ChunkedArray) -> pa.ChunkedArray:
+        """
+        Checks that every value is a POINT WKT with coordinates within range.
+        """
+        lon, lat = parse_points(coords)
+
+        in_range = pc.and_kleene(
+            pc.and_kleene(pc.greater_equal(lon, -180), pc.less_equal(lon, 180)),
+            pc.and_kleene(pc.greater_equal(lat, -90), pc.less_equal(lat, 90)),
+        )
+
+        return pc.fill_null(in_range, False)
+
+    def _valid_datetime(self, values: pa.ChunkedArray) -> pa.ChunkedArray:
+        """
+        Checks that every value is a well-formed timestamp of an existing calendar date and time.
+        """
+        well_formed = pc.match_substring_regex(values, DATETIME_PATTERN)
+        seconds = pc.utf8_slice_codeunits(pc.replace_substring(values, "T", " "), 0, 19)
+        parsed = pc.strptime(
+            seconds, format="%Y-%m-%d %H:%M:%S", unit="s", error_is_null=True
+        )
+        # strptime rolls impossible days over (2018-02-30 becomes 2018-03-02), so the parsed
+        # value must format back to the original text.
+        round_trip = pc.equal(pc.strftime(parsed, format="%Y-%m-%d %H:%M:%S"), seconds)
+
+        return pc.and_(
+            pc.fill_null(well_formed, False), pc.fill_null(round_trip, False)
+        )
+
+    def _reject(
+        self, reasons: pa.Array, valid: pa.ChunkedArray, column: str
+    ) -> pa.ChunkedArray:
+        """
+        Sets the rejection reason of the invalid rows that were not rejected yet.
+        """
+        return pc.if_else(
+            pc.and_(pc.is_null(reasons), pc.invert(valid)),
+            pa.scalar(f"invalid {column}"),
+            reasons,
+        )
+
+    def _rejected_rows(
+        self, table: pa.Table, line_numbers: pa.Array, reasons: pa.Array
+    ) -> List[Dict[str, Any]]:
+        """
+        Describes rejected rows, rebuilding their CSV record from their columns.
+        """
+        records = pc.binary_join_element_wise(
+            *[table[column] for column in CSV_COLUMNS], ","
+        )
+
+        return [
+            {"line": line, "reason": reason, "record": record}
+            for line, reason, record in zip(
+                line_numbers.to_pylist(), reasons.to_pylist(), records.to_pylist()
+            )
+        ]
+
+
+class DeadLetterSink:
+    """
+    Appends rejected rows to a CSV dead-letter file, created on the first rejection.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        Initializes the DeadLetterSink.
+
+        Args:
+            path (Path): The path of the dead-letter file.
+        """
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, rejected: List[Dict[str, Any]]) -> None:
+        """
+        Appends rejected rows to the dead-letter file.
+
+        Args:
+            rejected (List[Dict[str, Any]]): Rows with their 'line', 'reason' and 'record'.
+        """
+        if not rejected:
+            return
+
+        if self._writer is None:
+            is_new = not self.path.exists()
+            self._file = open(self.path, mode="a", newline="")
+            self._writer = csv.DictWriter(
+                self._file, fieldnames=["line", "reason", "record"]
+            )
+            if is_new:
+                self._writer.writeheader()
+
+        self._writer.writerows(rejected)
+        self.count += len(rejected)
+
+    def close(self) -> None:
+        """
+        Closes the dead-letter file, if any row was written to it.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
@@ -0,0 +1,193 @@
+import fnmatch
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from utils import FILE_PATTERNS, FileHandler
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # inotify is only available on Linux
+    INotify = None
+
+WATCH_FLAGS = (
+    flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+    if INotify
+    else 0
+)
+
+
+class DirectoryWatcher:
+    """
+    Watches a directory tree and hands every new input file over for ingestion as soon
+    as it is fully written, instead of waiting for `/ingest/dir/{directory}` to be called.
+
+    On Linux, inotify reports files as they are closed after writing, or moved into the
+    tree. Elsewhere, or when inotify cannot be used, the tree is polled and a file is
+    considered complete once its size and modification time stop changing between two
+    polls. Files already in the tree when the watcher starts go through the same check.
+    """
+
+    def __init__(
+        self,
+        file_handler: FileHandler,
+        on_file: Callable[[Path], bool],
+        poll_interval: float = 2.0,
+        use_inotify: bool = True,
+    ) -> None:
+        """
+        Initializes the DirectoryWatcher.
+
+        Args:
+            file_handler (FileHandler): The handler pointing to the watched directory.
+            on_file (Callable[[Path], bool]): Called with the path of every complete file,
+                relative to the watched directory. Returns False when the file cannot be taken
+                yet, in which case it is offered again on the next poll.
+            poll_interval (float, optional): The seconds between two polls, and between two
+                retries of the files that were not taken. Defaults to 2.0.
+            use_inotify (bool, optional): If False, polling is used even where inotify is
+                available. Defaults to True.
+        """
+        self.file_handler = file_handler
+        self.on_file = on_file
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and INotify is not None
+        self._candidates: Dict[Path, Optional[Tuple[int, int]]] = {}
+        self._dispatched: Set[Path] = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"watcher-{file_handler.dir}", daemon=True
+        )
+
+    def start(self) -> None:
+        """
+        Starts watching in a background thread.
+        """
+        self.file_handler.path.mkdir(parents=True, exist_ok=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops watching and waits for the background thread to finish.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        if self.use_inotify:
+            try:
+                self._watch()
+                return
+            except OSError:  # e.g. fs.inotify.max_user_watches was reached
+                pass
+
+        self._poll()
+
+    def _watch(self) -> None:
+        """
+        Dispatches the files reported by inotify, and re-checks the candidates on every timeout.
+        """
+        with INotify() as inotify:
+            directories = {}
+
+            def add_watch(directory: Path) -> None:
+                directories[inotify.add_watch(directory, WATCH_FLAGS)] = directory
+                for subdirectory in directory.rglob("*"):
+                    if subdirectory.is_dir():
+                        directories[inotify.add_watch(subdirectory, WATCH_FLAGS)] = (
+                            subdirectory
+                        )
+
+            add_watch(self.file_handler.path)
+            # Files written before the watches were added produce no event.
+            for path in self.file_handler.list_files():
+                self._add_candidate(path)
+            checked_at = time.monotonic()
+
+            while not self._stop.is_set():
+                for event in inotify.read(timeout=int(self.poll_interval * 1000)):
+                    if event.wd not in directories:
+                        continue
+
+                    path = directories[event.wd] / event.name
+                    is_dir = event.mask & flags.ISDIR
+
+                    if is_dir and event.mask & (flags.CREATE | flags.MOVED_TO):
+                        add_watch(path)
+                        for file in path.rglob("*"):
+                            self._add_candidate(file)
+                    elif is_dir:
+                        continue
+                    elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                        self._candidates.pop(path, None)
+                        self._dispatch(path)
+                    elif event.mask & (flags.MOVED_FROM | flags.DELETE):
+                        self._candidates.pop(path, None)
+                        self._dispatched.discard(path)
+
+                # Events wake the loop up early, so candidates are checked at the poll interval.
+                if time.monotonic() - checked_at >= self.poll_interval:
+                    self._check_candidates()
+                    checked_at = time.monotonic()
+
+    def _poll(self) -> None:
+        """
+        Lists the tree every `poll_interval` seconds, dispatching the files that stopped changing.
+        """
+        for path in self.file_handler.list_files():
+            self._add_candidate(path)
+
+        while not self._stop.wait(self.poll_interval):
+            files = set(self.file_handler.list_files())
+
+            self._dispatched &= files
+            for path in files - self._dispatched:
+                if path not in self._candidates:
+                    self._add_candidate(path)
+
+            self._check_candidates()
+
+    def _add_candidate(self, path: Path) -> None:
+        if self._is_input_file(path) and path not in self._dispatched:
+            self._candidates[path] = _signature(path)
+
+    def _check_candidates(self) -> None:
+        """
+        Dispatches the candidates that did not change since they were last seen.
+        """
+        for path, signature in list(self._candidates.items()):
+            current = _signature(path)
+
+            if current is None:
+                del self._candidates[path]
+            elif current != signature:
+                self._candidates[path] = current
+            else:
+                del self._candidates[path]
+                self._dispatch(path)
+
+    def _dispatch(self, path: Path) -> None:
+        if path in self._dispatched or not self._is_input_file(path):
+            return
+
+        if self.on_file(path.relative_to(self.file_handler.path)):
+            self._dispatched.add(path)
+        else:
+            self._candidates[path] = _signature(path)
+
+    @staticmethod
+    def _is_input_file(path: Path) -> bool:
+        return any(fnmatch.fnmatch(path.name, pattern) for pattern in FILE_PATTERNS)
+
+
+def _signature(path: Path) -> Optional[Tuple[int, int]]:
+    """
+    Returns the size and modification time of a file, or None if it no longer exists.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,107 @@
+"""
+Measures the latency of area queries on the local backend, without any cloud resource.
+
+Random squares are drawn around the trips of the table, from a few hundred meters to
+`--max-size-km` wide, and each one is answered by `LocalQueryService`. Reports the time to
+load the table and the p50/p95/p99 latency of the queries.
+
+Usage (from `local-services/ui-service`, with `pyarrow` and `numpy` installed):
+
+    python ../ingestion-service/benchmarks/generate_trips.py \
+        /tmp/bench/trips/trips/000.parquet --rows 5000000
+    python benchmarks/area_query.py /tmp/bench --queries 500
+"""
+
+import argparse
+import math
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from local import LocalQueryService  # noqa: E402
+from models import Square  # noqa: E402
+
+
+def random_square(
+    rand: random.Random, lon: float, lat: float, max_size_km: float
+) -> Square:
+    """
+    Draws a square rotated by a random angle, centered on a point.
+    """
+    half = rand.uniform(0.2, max_size_km) / 2 / 111.0
+    angle = rand.uniform(0, math.pi / 2)
+    corners = [
+        (
+            lon
+            + half * math.cos(angle + k * math.pi / 2) / math.cos(math.radians(lat)),
+            lat + half * math.sin(angle + k * math.pi / 2),
+        )
+        for k in range(4)
+    ]
+    upper_left, upper_right, bottom_right, bottom_left = (
+        f"{x} {y}" for x, y in corners
+    )
+
+    return Square(
+        upper_left=upper_left,
+        upper_right=upper_right,
+        bottom_left=bottom_left,
+        bottom_right=bottom_right,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "data_dir", type=Path, help="The folder with {dataset_id}/{table_id} folders"
+    )
+    parser.add_argument("--dataset-id", default="trips")
+    parser.add_argument("--table-id", default="trips")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-size-km", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    service = LocalQueryService(str(args.data_dir))
+    rand = random.Random(args.seed)
+
+    start = time.perf_counter()
+    trips = service._load(args.dataset_id, args.table_id)
+    load_seconds = time.perf_counter() - start
+    rows = len(trips["seconds"])
+    print(f"loaded {rows} trips in {load_seconds:.3f}s")
+
+    if not rows:
+        return
+
+    latencies, counted = [], 0
+    for _ in range(args.queries):
+        i = rand.randrange(rows)
+        square = random_square(
+            rand,
+            float(trips["origin_lon"][i]),
+            float(trips["origin_lat"][i]),
+            args.max_size_km,
+        )
+
+        start = time.perf_counter()
+        result = service.get_average_trips_by_area(
+            "local", args.dataset_id, args.table_id, square
+        )
+        latencies.append(time.perf_counter() - start)
+        counted += sum(row["count_of_trips"] for row in result)
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{args.queries} queries, {counted / args.queries:.1f} trips per square: "
+        f"p50 {percentiles[49] * 1000:.2f} ms  p95 {percentiles[94] * 1000:.2f} ms  "
+        f"p99 {percentiles[98] * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
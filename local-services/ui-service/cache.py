@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from metrics import RESULT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    An LRU cache of query results with a time to live, shared by the requests of the app.
+
+    Concurrent requests for the same key share a single in-flight query. The whole cache is
+    invalidated when the fingerprint of the underlying data changes, such as when new
+    ingestions land in the table. The fingerprint is only checked by the requests, at most
+    once per `fingerprint_interval` seconds, so an idle instance runs no check at all, while
+    an entry is not served more than `fingerprint_interval` seconds after the data it was
+    computed from changed, except to the requests concurrent with the check.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 300.0,
+        fingerprint: Optional[Callable[[], Any]] = None,
+        fingerprint_interval: float = 10.0,
+    ) -> None:
+        """
+        Initializes the QueryCache.
+
+        Args:
+            max_entries (int, optional): The maximum number of entries. The least recently used
+                entries are evicted beyond it. Defaults to 1024.
+            ttl (float, optional): The seconds an entry stays valid. Defaults to 300.
+            fingerprint (Callable[[], Any], optional): Returns a value that changes whenever the
+                data changes, such as the row count of the table. It is called by the first
+                request after `fingerprint_interval` seconds, before its lookup.
+            fingerprint_interval (float, optional): The minimum seconds between two
+                fingerprint checks. Defaults to 10.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fingerprint = fingerprint
+        self.fingerprint_interval = fingerprint_interval
+
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._generation = 0
+        self._version: Any = None
+        self._checked_at: Optional[float] = None
+        self._checking = False
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached result of a key, or computes it once for all concurrent callers.
+
+        Args:
+            key (Hashable): The normalized key of the query.
+            compute (Callable[[], Any]): Runs the query. Its errors are raised to every caller
+                waiting on it and are not cached.
+
+        Returns:
+            Any: The result of the query.
+        """
+        self._check_fingerprint()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                RESULT_CACHE_REQUESTS.labels("hit").inc()
+                return entry[1]
+
+            future = self._inflight.get(key)
+            owner = future is None
+
+            if owner:
+                future = self._inflight[key] = Future()
+                generation = self._generation
+
+            RESULT_CACHE_REQUESTS.labels("miss" if owner else "shared").inc()
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            # Results of queries started before an invalidation may already be stale.
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        future.set_result(value)
+        return value
+
+    def get_many(
+        self, keys: List[Hashable], compute: Callable[[List[Hashable]], List[Any]]
+    ) -> List[Any]:
+        """
+        Returns the cached results of several keys, computing the missing ones together.
+
+        Keys already being computed by another caller are waited on rather than computed
+        again, so every key still has a single query in flight.
+
+        Args:
+            keys (List[Hashable]): The normalized keys of the queries.
+            compute (Callable[[List[Hashable]], List[Any]]): Runs the queries of the missing
+                keys, returning their results in the same order.
+
+        Returns:
+            List[Any]: The results, in the order of `keys`.
+        """
+        results: Dict[Hashable, Any] = {}
+        owned: Dict[Hashable, Future] = {}
+        waiting: Dict[Hashable, Future] = {}
+
+        self._check_fingerprint()
+
+        with self._lock:
+            now = time.monotonic()
+            generation = self._generation
+
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    results[key] = entry[1]
+                    RESULT_CACHE_REQUESTS.labels("hit").inc()
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                    RESULT_CACHE_REQUESTS.labels("shared").inc()
+                else:
+                    owned[key] = self._inflight[key] = Future()
+                    RESULT_CACHE_REQUESTS.labels("miss").inc()
+
+        if owned:
+            try:
+                values = compute(list(owned))
+            except BaseException as e:
+                with self._lock:
+                    for key in owned:
+                        del self._inflight[key]
+                for future in owned.values():
+                    future.set_exception(e)
+                raise
+
+            with self._lock:
+                for key, value in zip(owned, values):
+                    del self._inflight[key]
+                    if generation == self._generation:
+                        self._entries[key] = (time.monotonic() + self.ttl, value)
+                        self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+            for (key, future), value in zip(owned.items(), values):
+                future.set_result(value)
+                results[key] = value
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+
+        return [results[key] for key in keys]
+
+    def invalidate(self) -> None:
+        """
+        Drops every entry, and the results of the queries in flight once they finish.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Summarizes the cache.
+
+        Returns:
+            Dict[str, Any]: The number of 'entries', of queries 'inflight', the data 'version'
+            the entries were computed from and the number of 'invalidations'.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "inflight": len(self._inflight),
+                "version": self._version,
+                "invalidations": self._generation,
+            }
+
+    def _check_fingerprint(self) -> None:
+        """
+        Checks the fingerprint if it was not checked over the last `fingerprint_interval`
+        seconds, invalidating the cache when it changed. A single caller checks it at a time,
+        the others go on without waiting for it.
+        """
+        if not self.fingerprint:
+            return
+
+        with self._lock:
+            if self._checking or (
+                self._checked_at is not None
+                and time.monotonic() - self._checked_at < self.fingerprint_interval
+            ):
+                return
+            self._checking = True
+
+        try:
+            version = self.fingerprint()
+        except Exception:
+            logger.exception("Could not check the data fingerprint")
+            version = self._version
+
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self._entries.clear()
+                    self._generation += 1
+                self._version = version
+
+            self._checked_at = time.monotonic()
+            self._checking = False
@@ -1,6 +1,15 @@
+import math
+import time
+from datetime import datetime, timedelta
+
+from geo import bounding_box, cell_ranges, classify_cells, edge_margin, merge_ranges
 from google.cloud import bigquery
+from metrics import BIGQUERY_BYTES_PROCESSED, BIGQUERY_CACHE_HITS, BIGQUERY_QUERY_SECONDS
 from models import Square
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# The origin of TIMESTAMP_BUCKET, so weeks start on Sundays.
+WEEK_ORIGIN = datetime(1950, 1, 1)
 
 
 class BigQueryService:
@@ -16,7 +25,12 @@ class BigQueryService:
         self.__client = bigquery.Client()
 
     def get_average_trips_by_area(
-        self, project_id: str, dataset_id: str, table_id: str, square: Square
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        square: Square,
+        rollup_table_id: Optional[str] = None,
     ) -> List[bigquery.Row]:
         """
         Retrieves the weekly average count of trips occurring within a specified geographic area.
@@ -29,47 +43,416 @@ class BigQueryService:
             dataset_id (str): The dataset ID containing the table.
             table_id (str): The table ID with trip data.
             square (Square): An object defining the coordinates of the area's boundaries, with
-                `upper_left`, `upper_right`, `bottom_right`, and `bottom_left` properties.
+                `upper_left`, `upper_right`, `bottom_right`, and `bottom_left` properties, and
+                an optional `start` and `end` of the trips to count.
+            rollup_table_id (str, optional): The table ID of the weekly rollup of trips per
+                origin and destination cell, in the same dataset. Not used when not given.
 
         Returns:
             List[bigquery.Row]: A list of rows where each row represents the count of trips
-            for a specific week within the defined area.
+            for a specific week within the defined area, by week.
 
         Raises:
             google.cloud.exceptions.GoogleCloudError: If the query fails due to issues with
             BigQuery service.
 
         Note:
-            The SQL query uses spatial functions to identify trips within the area defined
-            by the provided `Square` object.
+            The trips are first narrowed down with range predicates on the geohash cells
+            (the clustering columns, which prune whole blocks) and on the numeric coordinates
+            of their origin and destination, so no WKT is parsed. The exact check against the
+            polygon of the `Square` is only made on the rows left. The `start` and `end` of
+            the square filter on `datetime`, the partitioning column, so only the days in
+            between are read.
+
+            With a rollup table, trips between two cells fully inside the square are summed
+            from the rollup, and only the trips starting or ending in a cell on the edge of the
+            square, or from ingestions not added to the rollup yet, are read from the raw
+            table, so the exact polygon check only runs along the edge of the square. Only the
+            weeks fully within the time range of the square are read from the rollup.
+        """
+        return list(
+            self.iter_average_trips_by_area(
+                project_id, dataset_id, table_id, square, rollup_table_id
+            )
+        )
+
+    def iter_average_trips_by_area(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        square: Square,
+        rollup_table_id: Optional[str] = None,
+        page_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Runs the query of `get_average_trips_by_area`, yielding its rows as the pages of
+        `page_size` rows are fetched, so long time ranges are never held in memory at once.
         """
         self.core_table = f"`{project_id}.{dataset_id}.{table_id}`"
-        query = f"""
+        corners = square.corners()
+        start, end = square.time_range()
+        min_lon, min_lat, max_lon, max_lat = bounding_box(
+            corners, margin=edge_margin(corners)
+        )
+        ranges = cell_ranges((min_lon, min_lat, max_lon, max_lat))
+        cells = classify_cells(corners) if rollup_table_id else None
+        inner_cells = cells[0] if cells else []
+        rollup_start, rollup_end = _full_weeks(start, end)
+        if rollup_start and rollup_end and rollup_start >= rollup_end:
+            inner_cells = []
+        rollup_table = f"{project_id}.{dataset_id}.{rollup_table_id}"
+        # Trips between two inner cells are counted by the rollup, once their ingestion was
+        # added to it. Both tables are read from the same snapshot, so none is counted twice.
+        edge_filter = (
+            f"""AND (
+                    NOT (origin_cell IN UNNEST(@inner_cells)
+                        AND destination_cell IN UNNEST(@inner_cells))
+                    OR ingestion_id NOT IN (
+                        SELECT ingestion_id FROM `{rollup_table}_ingestions`
+                    )
+                    {"OR datetime < @rollup_start" if rollup_start else ""}
+                    {"OR datetime >= @rollup_end" if rollup_end else ""}
+                )"""
+            if inner_cells
+            else ""
+        )
+
+        raw_query = f"""
             SELECT
                 COUNT(1) AS count_of_trips,
                 TIMESTAMP_BUCKET(TIMESTAMP(datetime), INTERVAL 1 WEEK) AS time
             FROM {self.core_table}
             WHERE
-                ST_CONTAINS(
+                ({_cell_filter("origin_cell", ranges)})
+                AND ({_cell_filter("destination_cell", ranges)})
+                {"AND datetime >= @start" if start else ""}
+                {"AND datetime < @end" if end else ""}
+                AND origin_lon BETWEEN @min_lon AND @max_lon
+                AND origin_lat BETWEEN @min_lat AND @max_lat
+                AND destination_lon BETWEEN @min_lon AND @max_lon
+                AND destination_lat BETWEEN @min_lat AND @max_lat
+                {edge_filter}
+                AND ST_CONTAINS(
                     ST_MAKEPOLYGON(ST_MAKELINE([
-                        ST_GEOGFROMTEXT('POINT({square.upper_left})'),
-                        ST_GEOGFROMTEXT('POINT({square.upper_right})'),
-                        ST_GEOGFROMTEXT('POINT({square.bottom_right})'),
-                        ST_GEOGFROMTEXT('POINT({square.bottom_left})')
+                        {", ".join(f"ST_GEOGPOINT(@lon_{i}, @lat_{i})" for i in range(4))}
                     ])),
                     ST_MAKELINE(
-                        ST_GEOGFROMTEXT(origin_coord),
-                        ST_GEOGFROMTEXT(destination_coord)
+                        ST_GEOGPOINT(origin_lon, origin_lat),
+                        ST_GEOGPOINT(destination_lon, destination_lat)
                     )
                 )
             GROUP BY
                 time
             """
 
-        query_job = self.__client.query(query)
-        rows = [
-            {"count_of_trips": row.count_of_trips, "time":row.time}
-            for row in query_job.result()
+        if inner_cells:
+            query = f"""
+            SELECT
+                SUM(count_of_trips) AS count_of_trips,
+                time
+            FROM (
+                SELECT
+                    count_of_trips,
+                    week AS time
+                FROM `{rollup_table}`
+                WHERE
+                    origin_cell IN UNNEST(@inner_cells)
+                    AND destination_cell IN UNNEST(@inner_cells)
+                    {"AND week >= TIMESTAMP(@rollup_start)" if rollup_start else ""}
+                    {"AND week < TIMESTAMP(@rollup_end)" if rollup_end else ""}
+                UNION ALL
+                {raw_query}
+            )
+            GROUP BY
+                time
+            ORDER BY
+                time
+            """
+        else:
+            query = f"""{raw_query}
+            ORDER BY
+                time
+            """
+
+        parameters = {
+            "min_lon": min_lon,
+            "min_lat": min_lat,
+            "max_lon": max_lon,
+            "max_lat": max_lat,
+            **{f"lon_{i}": lon for i, (lon, _) in enumerate(corners)},
+            **{f"lat_{i}": lat for i, (_, lat) in enumerate(corners)},
+        }
+        query_parameters = [
+            bigquery.ScalarQueryParameter(name, "FLOAT64", value)
+            for name, value in parameters.items()
         ]
+        times = {"start": start, "end": end}
+        if inner_cells:
+            query_parameters.append(
+                bigquery.ArrayQueryParameter("inner_cells", "STRING", inner_cells)
+            )
+            times.update(rollup_start=rollup_start, rollup_end=rollup_end)
+        query_parameters.extend(
+            bigquery.ScalarQueryParameter(name, "DATETIME", value)
+            for name, value in times.items()
+            if value
+        )
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+
+        started = time.perf_counter()
+        query_job = self.__client.query(query, job_config=job_config)
+        for row in query_job.result(page_size=page_size):
+            yield {"count_of_trips": row.count_of_trips, "time":row.time}
+        self._observe(
+            "avg_trip_by_area_rollup" if inner_cells else "avg_trip_by_area",
+            query_job,
+            time.perf_counter() - started,
+        )
+
+    def get_average_trips_by_areas(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        squares: List[Square],
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieves the weekly count of trips within each of several areas, in a single query.
+
+        The table is read once, narrowed down to the union of the geohash cell covers of the
+        squares. Every trip left is joined to the squares whose bounding box holds both of
+        its ends, then checked against their polygons, so a trip is counted for every square
+        it falls in.
+
+        Args:
+            project_id (str): The Google Cloud project ID where the BigQuery table resides.
+            dataset_id (str): The dataset ID containing the table.
+            table_id (str): The table ID with trip data.
+            squares (List[Square]): The areas, each with `upper_left`, `upper_right`,
+                `bottom_right`, and `bottom_left` properties, and an optional `start` and `end`.
+
+        Returns:
+            List[List[Dict[str, Any]]]: The rows of each square, in the order of `squares`,
+            like the rows returned by `get_average_trips_by_area`.
+
+        Raises:
+            google.cloud.exceptions.GoogleCloudError: If the query fails due to issues with
+            BigQuery service.
+        """
+        self.core_table = f"`{project_id}.{dataset_id}.{table_id}`"
+        areas, ranges, time_ranges = [], [], []
+        # Keeps the predicate on the cells about as long as for a single square.
+        max_cells = max(4, 64 // len(squares))
+
+        for index, square in enumerate(squares):
+            corners = square.corners()
+            bbox = bounding_box(corners, margin=edge_margin(corners))
+            ranges.extend(cell_ranges(bbox, max_cells=max_cells))
+            time_ranges.append(square.time_range())
+            fields = {
+                "min_lon": bbox[0],
+                "min_lat": bbox[1],
+                "max_lon": bbox[2],
+                "max_lat": bbox[3],
+                **{f"lon_{i}": lon for i, (lon, _) in enumerate(corners)},
+                **{f"lat_{i}": lat for i, (_, lat) in enumerate(corners)},
+            }
+            areas.append(
+                bigquery.StructQueryParameter(
+                    None,
+                    bigquery.ScalarQueryParameter("square", "INT64", index),
+                    *(
+                        bigquery.ScalarQueryParameter(name, "FLOAT64", value)
+                        for name, value in fields.items()
+                    ),
+                    bigquery.ScalarQueryParameter("start", "DATETIME", time_ranges[-1][0]),
+                    bigquery.ScalarQueryParameter("end", "DATETIME", time_ranges[-1][1]),
+                )
+            )
+        ranges = merge_ranges(ranges)
+        # The partitions read are bounded when every square is.
+        starts, ends = zip(*time_ranges)
+        start = min(starts) if all(starts) else None
+        end = max(ends) if all(ends) else None
+
+        query = f"""
+            WITH trips AS (
+                SELECT
+                    origin_lon,
+                    origin_lat,
+                    destination_lon,
+                    destination_lat,
+                    datetime,
+                    TIMESTAMP_BUCKET(TIMESTAMP(datetime), INTERVAL 1 WEEK) AS time
+                FROM {self.core_table}
+                WHERE
+                    ({_cell_filter("origin_cell", ranges)})
+                    AND ({_cell_filter("destination_cell", ranges)})
+                    {"AND datetime >= @start" if start else ""}
+                    {"AND datetime < @end" if end else ""}
+            )
+            SELECT
+                area.square,
+                COUNT(1) AS count_of_trips,
+                trips.time
+            FROM trips
+            JOIN UNNEST(@areas) AS area
+                ON trips.origin_lon BETWEEN area.min_lon AND area.max_lon
+                AND trips.origin_lat BETWEEN area.min_lat AND area.max_lat
+                AND trips.destination_lon BETWEEN area.min_lon AND area.max_lon
+                AND trips.destination_lat BETWEEN area.min_lat AND area.max_lat
+                AND (area.start IS NULL OR trips.datetime >= area.start)
+                AND (area.end IS NULL OR trips.datetime < area.end)
+            WHERE
+                ST_CONTAINS(
+                    ST_MAKEPOLYGON(ST_MAKELINE([
+                        {", ".join(f"ST_GEOGPOINT(area.lon_{i}, area.lat_{i})" for i in range(4))}
+                    ])),
+                    ST_MAKELINE(
+                        ST_GEOGPOINT(trips.origin_lon, trips.origin_lat),
+                        ST_GEOGPOINT(trips.destination_lon, trips.destination_lat)
+                    )
+                )
+            GROUP BY
+                area.square,
+                trips.time
+            ORDER BY
+                area.square,
+                trips.time
+            """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("areas", "STRUCT", areas),
+                *(
+                    bigquery.ScalarQueryParameter(name, "DATETIME", value)
+                    for name, value in (("start", start), ("end", end))
+                    if value
+                ),
+            ]
+        )
+
+        started = time.perf_counter()
+        query_job = self.__client.query(query, job_config=job_config)
+        results = [[] for _ in squares]
+        for row in query_job.result():
+            results[row.square].append({"count_of_trips": row.count_of_trips, "time": row.time})
+        self._observe("avg_trip_by_areas", query_job, time.perf_counter() - started)
+
+        return results
+
+    def get_similar_trips(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        min_size: int = 2,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the largest groups of similar trips, precomputed by
+        `infra-code/assets/similar_trips.sql`.
+
+        Args:
+            project_id (str): The Google Cloud project ID where the BigQuery table resides.
+            dataset_id (str): The dataset ID containing the table.
+            table_id (str): The table ID with the groups of similar trips.
+            min_size (int, optional): The minimum number of trips of a group. Defaults to 2.
+            limit (int, optional): The maximum number of groups. Defaults to 100.
+
+        Returns:
+            List[Dict[str, Any]]: The `origin_cell`, `destination_cell`, `time_bucket` and
+            `count_of_trips` of every group, with the `origin_coord`, `destination_coord`
+            and `datetime` of its representative trip, by decreasing size.
+        """
+        query = f"""
+            SELECT
+                origin_cell,
+                destination_cell,
+                time_bucket,
+                count_of_trips,
+                origin_coord,
+                destination_coord,
+                datetime
+            FROM `{project_id}.{dataset_id}.{table_id}`
+            WHERE
+                count_of_trips >= @min_size
+            ORDER BY
+                count_of_trips DESC
+            LIMIT @limit
+            """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("min_size", "INT64", min_size),
+                bigquery.ScalarQueryParameter("limit", "INT64", limit),
+            ]
+        )
+
+        start = time.perf_counter()
+        query_job = self.__client.query(query, job_config=job_config)
+        rows = [dict(row.items()) for row in query_job.result()]
+        self._observe("similar_trips", query_job, time.perf_counter() - start)
 
         return rows
+
+    def get_table_fingerprint(self, project_id: str, dataset_id: str, table_id: str) -> int:
+        """
+        Counts the rows of a table, which grows with every ingestion that lands in it.
+
+        A `COUNT(1)` over a whole table is answered from its metadata: it scans no bytes and,
+        unlike the table metadata itself, includes the rows streamed by the BigQuery
+        Subscription.
+
+        Args:
+            project_id (str): The Google Cloud project ID where the BigQuery table resides.
+            dataset_id (str): The dataset ID containing the table.
+            table_id (str): The table ID with trip data.
+
+        Returns:
+            int: The number of rows of the table.
+        """
+        query = f"SELECT COUNT(1) AS count_of_rows FROM `{project_id}.{dataset_id}.{table_id}`"
+
+        start = time.perf_counter()
+        query_job = self.__client.query(query)
+        (row,) = list(query_job.result())
+        self._observe("table_fingerprint", query_job, time.perf_counter() - start)
+
+        return row.count_of_rows
+
+    def _observe(self, query: str, query_job: bigquery.QueryJob, seconds: float) -> None:
+        """
+        Records the duration, bytes processed and cache use of a finished query job.
+        """
+        BIGQUERY_QUERY_SECONDS.labels(query).observe(seconds)
+        BIGQUERY_BYTES_PROCESSED.labels(query).inc(query_job.total_bytes_processed or 0)
+        if query_job.cache_hit:
+            BIGQUERY_CACHE_HITS.labels(query).inc()
+
+
+def _full_weeks(
+    start: Optional[datetime], end: Optional[datetime]
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Narrows a time range to the weeks of `TIMESTAMP_BUCKET` that are fully within it.
+    """
+    if start:
+        weeks = math.ceil((start - WEEK_ORIGIN) / timedelta(weeks=1))
+        start = WEEK_ORIGIN + timedelta(weeks=weeks)
+    if end:
+        weeks = (end - WEEK_ORIGIN) // timedelta(weeks=1)
+        end = WEEK_ORIGIN + timedelta(weeks=weeks)
+
+    return start, end
+
+
+def _cell_filter(column: str, ranges: List[Tuple[str, Optional[str]]]) -> str:
+    """
+    Builds the predicate matching a cell column against ranges from `cell_ranges`.
+
+    Cells only hold geohash characters, so they are safe to inline.
+    """
+    return " OR ".join(
+        f"({column} >= '{start}' AND {column} < '{end}')" if end else f"{column} >= '{start}'"
+        for start, end in ranges
+    )
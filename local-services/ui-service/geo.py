@@ -0,0 +1,227 @@
+import math
+from typing import List, Optional, Tuple
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Precision of the `origin_cell` and `destination_cell` columns written by the ingestion.
+STORED_PRECISION = 6
+# Geodesic edges bow away from the straight lines between the corners, by a few meters at
+# the scale of a city; the bounding box is widened by at least about 100 m to cover them.
+BBOX_MARGIN = 0.001
+
+
+def parse_corner(corner: str) -> Tuple[float, float]:
+    """
+    Parses a "lon lat" corner.
+
+    Args:
+        corner (str): The longitude and latitude, separated by whitespace.
+
+    Returns:
+        Tuple[float, float]: The longitude and latitude.
+
+    Raises:
+        ValueError: If the corner is not two numbers within longitude and latitude ranges.
+    """
+    lon, lat = (float(value) for value in corner.split())
+
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError(f"{corner} is out of the longitude/latitude ranges")
+
+    return lon, lat
+
+
+def edge_margin(corners: List[Tuple[float, float]]) -> float:
+    """
+    Bounds how far, in degrees, the geodesic edges of a polygon can bow away from the straight
+    lines between its corners in longitude/latitude space, plus `BBOX_MARGIN`.
+
+    The sagitta of a great circle arc of length L at latitude lat is about L^2 tan(lat) / 8.
+    """
+    length = max(math.dist(corner, corners[i - 1]) for i, corner in enumerate(corners))
+    latitude = min(89.0, max(abs(lat) for _, lat in corners))
+
+    return BBOX_MARGIN + math.degrees(
+        math.radians(length) ** 2 * math.tan(math.radians(latitude)) / 8
+    )
+
+
+def bounding_box(
+    corners: List[Tuple[float, float]], margin: float = BBOX_MARGIN
+) -> Tuple[float, float, float, float]:
+    """
+    Computes the bounding box of some corners, widened by a margin.
+
+    Returns:
+        Tuple[float, float, float, float]: The min longitude, min latitude, max longitude
+        and max latitude.
+    """
+    lons, lats = zip(*corners)
+
+    return (
+        max(-180.0, min(lons) - margin),
+        max(-90.0, min(lats) - margin),
+        min(180.0, max(lons) + margin),
+        min(90.0, max(lats) + margin),
+    )
+
+
+def cell_ranges(
+    bbox: Tuple[float, float, float, float], max_cells: int = 64
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Covers a bounding box with geohash cells, as ranges of the stored cell values.
+
+    The finest precision, up to `STORED_PRECISION`, whose cover has at most `max_cells`
+    cells is used. Cells that are next to each other in geohash order are merged, so every
+    range is a `[start, end)` interval of cell strings that BigQuery can prune clustered
+    blocks with.
+
+    Args:
+        bbox (Tuple[float, float, float, float]): The min longitude, min latitude, max
+            longitude and max latitude.
+        max_cells (int, optional): The maximum number of cells of the cover. Defaults to 64.
+
+    Returns:
+        List[Tuple[str, Optional[str]]]: The ranges, as the first cell prefix and the first
+        prefix after the range, or None when the range runs to the end.
+    """
+    for precision in range(STORED_PRECISION, 0, -1):
+        bits = precision * 5
+        lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+        x0, x1 = (_quantize(lon, -180, 360, lon_bits) for lon in (bbox[0], bbox[2]))
+        y0, y1 = (_quantize(lat, -90, 180, lat_bits) for lat in (bbox[1], bbox[3]))
+
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_cells or precision == 1:
+            break
+
+    codes = sorted(
+        _interleave(x, y, lon_bits, lat_bits)
+        for x in range(x0, x1 + 1)
+        for y in range(y0, y1 + 1)
+    )
+
+    ranges = []
+    for code in codes:
+        if ranges and ranges[-1][1] == code:
+            ranges[-1][1] = code + 1
+        else:
+            ranges.append([code, code + 1])
+
+    return [
+        (
+            _encode(start, precision),
+            _encode(end, precision) if end < 1 << bits else None,
+        )
+        for start, end in ranges
+    ]
+
+
+def merge_ranges(
+    ranges: List[Tuple[str, Optional[str]]],
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Merges overlapping or touching ranges from `cell_ranges`, such as the covers of several
+    areas, so every cell is matched by a single range.
+    """
+    merged: List[List] = []
+
+    for start, end in sorted(ranges):
+        if merged and (merged[-1][1] is None or start <= merged[-1][1]):
+            if merged[-1][1] is not None and (end is None or end > merged[-1][1]):
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    return [(start, end) for start, end in merged]
+
+
+def _quantize(value: float, start: float, span: float, bits: int) -> int:
+    return min(int((value - start) / span * (1 << bits)), (1 << bits) - 1)
+
+
+def _interleave(x: int, y: int, lon_bits: int, lat_bits: int) -> int:
+    code = 0
+    for i in range(lon_bits + lat_bits):
+        if i % 2 == 0:
+            lon_bits -= 1
+            code = (code << 1) | ((x >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            code = (code << 1) | ((y >> lat_bits) & 1)
+
+    return code
+
+
+def _encode(code: int, precision: int) -> str:
+    return "".join(
+        GEOHASH_ALPHABET[(code >> (5 * (precision - 1 - i))) & 31]
+        for i in range(precision)
+    )
+
+
+def classify_cells(
+    corners: List[Tuple[float, float]], max_cells: int = 20000
+) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    Splits the `STORED_PRECISION` cells covering a polygon into the cells fully inside it and
+    the cells on its edge.
+
+    A cell is inside when all of its corners are inside the polygon by at least the
+    `edge_margin`, so it stays inside whichever way the geodesic edges bow.
+
+    Args:
+        corners (List[Tuple[float, float]]): The corners of the polygon, in order.
+        max_cells (int, optional): The maximum number of cells of the cover. Defaults to 20000.
+
+    Returns:
+        Optional[Tuple[List[str], List[str]]]: The inner and edge cells, or None when the
+        polygon is not convex or needs more than `max_cells` cells.
+    """
+    margin = edge_margin(corners)
+    edges = [
+        (corner, corners[(i + 1) % len(corners)]) for i, corner in enumerate(corners)
+    ]
+    turns = [
+        _cross(a, b, corners[(i + 2) % len(corners)]) for i, (a, b) in enumerate(edges)
+    ]
+
+    if not (all(t > 0 for t in turns) or all(t < 0 for t in turns)):
+        return None
+
+    orientation = 1 if turns[0] > 0 else -1
+    bits = STORED_PRECISION * 5
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    lon_step, lat_step = 360 / (1 << lon_bits), 180 / (1 << lat_bits)
+    min_lon, min_lat, max_lon, max_lat = bounding_box(corners, margin=margin)
+    x0, x1 = (_quantize(lon, -180, 360, lon_bits) for lon in (min_lon, max_lon))
+    y0, y1 = (_quantize(lat, -90, 180, lat_bits) for lat in (min_lat, max_lat))
+
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > max_cells:
+        return None
+
+    def inside(point: Tuple[float, float]) -> bool:
+        return all(
+            orientation * _cross(a, b, point) / math.dist(a, b) >= margin
+            for a, b in edges
+        )
+
+    inner, edge = [], []
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            lon, lat = x * lon_step - 180, y * lat_step - 90
+            cell = _encode(_interleave(x, y, lon_bits, lat_bits), STORED_PRECISION)
+            cell_corners = [
+                (lon, lat),
+                (lon + lon_step, lat),
+                (lon + lon_step, lat + lat_step),
+                (lon, lat + lat_step),
+            ]
+            (inner if all(map(inside, cell_corners)) else edge).append(cell)
+
+    return inner, edge
+
+
+def _cross(
+    a: Tuple[float, float], b: Tuple[float, float], p: Tuple[float, float]
+) -> float:
+    return (b[0] - a[0]) * (p[1] - a[1]) - (b[1] - a[1]) * (p[0] - a[0])
@@ -0,0 +1,383 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from geo import bounding_box
+from metrics import LOCAL_QUERY_SECONDS
+from models import Square
+
+NUMBER_PATTERN = r"[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?"
+POINT_PATTERN = (
+    rf"^POINT ?\(\s*(?P<lon>{NUMBER_PATTERN})\s+(?P<lat>{NUMBER_PATTERN})\s*\)$"
+)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# The origin of BigQuery TIMESTAMP_BUCKET, so weeks start on the same Sundays.
+WEEK_ORIGIN = datetime(1950, 1, 1, tzinfo=timezone.utc)
+COORD_COLUMNS = ("origin_lon", "origin_lat", "destination_lon", "destination_lat")
+
+
+class LocalQueryService:
+    """
+    Runs the queries of `BigQueryService` on local Parquet files instead of BigQuery, with
+    vectorized filters over columns held in memory.
+
+    A table is the `*.parquet` files under `{data_dir}/{dataset_id}/{table_id}`, such as an
+    export of the BigQuery table or the Parquet output of
+    `ingestion-service/benchmarks/generate_trips.py`. Its columns
+    are loaded once, sorted by origin longitude, and reloaded when its files change.
+
+    Requires `pyarrow` and `numpy`. They are imported when the service is created, so a
+    missing one fails the startup of the app rather than its first query.
+    """
+
+    def __init__(self, data_dir: str) -> None:
+        """
+        Initializes the LocalQueryService instance with the folder of the tables.
+
+        Args:
+            data_dir (str): The folder with a `{dataset_id}/{table_id}` folder per table.
+
+        Raises:
+            ImportError: If `pyarrow` or `numpy` is not installed.
+        """
+        import numpy  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+
+        self.data_dir = Path(data_dir)
+        self._tables: Dict[Path, Tuple[tuple, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get_average_trips_by_area(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        square: Square,
+        rollup_table_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the weekly count of trips that start and end within a specified geographic
+        area, like `BigQueryService.get_average_trips_by_area`.
+
+        The trips are narrowed down to the bounding box of the square with a binary search on
+        the sorted origin longitudes and comparisons on the other coordinates. Only the rows
+        left are checked against the polygon: both ends inside it, and the trip crossing none
+        of its edges.
+
+        Args:
+            project_id (str): Not used, kept for the interface of `BigQueryService`.
+            dataset_id (str): The folder of the dataset, under the data folder.
+            table_id (str): The folder of the table, under the dataset folder.
+            square (Square): An object defining the coordinates of the area's boundaries, with
+                `upper_left`, `upper_right`, `bottom_right`, and `bottom_left` properties, and
+                an optional `start` and `end` of the trips to count.
+            rollup_table_id (str, optional): Not used: every trip is read from the table.
+
+        Returns:
+            List[Dict[str, Any]]: The `count_of_trips` and `time` (start of the week, in UTC)
+            of every week with trips within the area, by week.
+
+        Note:
+            The polygon is checked with straight lines in longitude/latitude space, whereas
+            BigQuery follows geodesics: trips within a few meters of a long edge of the square
+            may be counted differently.
+        """
+        import numpy as np
+
+        start = time.perf_counter()
+        trips = self._load(dataset_id, table_id)
+        corners = square.corners()
+        min_lon, min_lat, max_lon, max_lat = bounding_box(corners, margin=0)
+        start_seconds, end_seconds = (
+            value.replace(tzinfo=timezone.utc).timestamp() if value else None
+            for value in square.time_range()
+        )
+
+        first = np.searchsorted(trips["origin_lon"], min_lon, side="left")
+        last = np.searchsorted(trips["origin_lon"], max_lon, side="right")
+        rows = slice(first, last)
+        origin_lat = trips["origin_lat"][rows]
+        destination_lon = trips["destination_lon"][rows]
+        destination_lat = trips["destination_lat"][rows]
+        mask = (
+            (origin_lat >= min_lat)
+            & (origin_lat <= max_lat)
+            & (destination_lon >= min_lon)
+            & (destination_lon <= max_lon)
+            & (destination_lat >= min_lat)
+            & (destination_lat <= max_lat)
+        )
+        if start_seconds is not None:
+            mask &= trips["seconds"][rows] >= start_seconds
+        if end_seconds is not None:
+            mask &= trips["seconds"][rows] < end_seconds
+        candidates = np.flatnonzero(mask) + first
+
+        inside = _contains(
+            corners,
+            trips["origin_lon"][candidates],
+            trips["origin_lat"][candidates],
+            trips["destination_lon"][candidates],
+            trips["destination_lat"][candidates],
+        )
+        weeks, counts = np.unique(
+            (trips["seconds"][candidates[inside]] - int(WEEK_ORIGIN.timestamp()))
+            // (7 * 24 * 3600),
+            return_counts=True,
+        )
+        LOCAL_QUERY_SECONDS.labels("avg_trip_by_area").observe(
+            time.perf_counter() - start
+        )
+
+        return [
+            {
+                "count_of_trips": int(count),
+                "time": WEEK_ORIGIN + timedelta(weeks=int(week)),
+            }
+            for week, count in zip(weeks, counts)
+        ]
+
+    def iter_average_trips_by_area(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        square: Square,
+        rollup_table_id: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the rows of `get_average_trips_by_area`, like
+        `BigQueryService.iter_average_trips_by_area`.
+        """
+        yield from self.get_average_trips_by_area(
+            project_id, dataset_id, table_id, square
+        )
+
+    def get_average_trips_by_areas(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        squares: List[Square],
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieves the weekly count of trips within each of several areas, like
+        `BigQueryService.get_average_trips_by_areas`.
+
+        Every square is answered from the same columns in memory.
+
+        Returns:
+            List[List[Dict[str, Any]]]: The rows of each square, in the order of `squares`.
+        """
+        return [
+            self.get_average_trips_by_area(project_id, dataset_id, table_id, square)
+            for square in squares
+        ]
+
+    def get_similar_trips(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        min_size: int = 2,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the largest groups of similar trips, written by `similar.py`, like
+        `BigQueryService.get_similar_trips`.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        files = self._files(self.data_dir / dataset_id / table_id)
+        if not files:
+            return []
+
+        groups = pa.concat_tables(pq.read_table(file) for file in files)
+        groups = groups.filter(pc.greater_equal(groups["count_of_trips"], min_size))
+        indices = pc.select_k_unstable(
+            groups,
+            k=min(limit, groups.num_rows),
+            sort_keys=[("count_of_trips", "descending")],
+        )
+
+        return groups.take(indices).to_pylist()
+
+    def get_table_fingerprint(
+        self, project_id: str, dataset_id: str, table_id: str
+    ) -> int:
+        """
+        Counts the rows of a table from the metadata of its files, without reading them.
+
+        Args:
+            project_id (str): Not used, kept for the interface of `BigQueryService`.
+            dataset_id (str): The folder of the dataset, under the data folder.
+            table_id (str): The folder of the table, under the dataset folder.
+
+        Returns:
+            int: The number of rows of the table.
+        """
+        import pyarrow.parquet as pq
+
+        return sum(
+            pq.ParquetFile(file).metadata.num_rows
+            for file in self._files(self.data_dir / dataset_id / table_id)
+        )
+
+    def _files(self, path: Path) -> List[Path]:
+        return sorted(path.rglob("*.parquet"))
+
+    def _load(self, dataset_id: str, table_id: str) -> Dict[str, Any]:
+        """
+        Returns the columns of a table, loading them again if its files changed.
+        """
+        path = self.data_dir / dataset_id / table_id
+        files = self._files(path)
+        signature = tuple(
+            (str(file), file.stat().st_mtime_ns, file.stat().st_size) for file in files
+        )
+
+        with self._lock:
+            loaded = self._tables.get(path)
+
+            if loaded is None or loaded[0] != signature:
+                start = time.perf_counter()
+                loaded = self._tables[path] = (signature, read_trips(files))
+                LOCAL_QUERY_SECONDS.labels("load").observe(time.perf_counter() - start)
+
+        return loaded[1]
+
+
+def read_trips(files: List[Path]) -> Dict[str, Any]:
+    """
+    Reads the coordinates and times (in seconds since the epoch) of the trips of some Parquet files into NumPy arrays,
+    sorted by origin longitude.
+
+    The numeric coordinate columns are used when the files have them, otherwise the
+    `origin_coord` and `destination_coord` WKT points are parsed. Trips with a malformed
+    point or datetime, or coordinates out of range, are skipped, as the ingestion rejects them.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    columns: Dict[str, List[Any]] = {
+        column: [] for column in (*COORD_COLUMNS, "seconds")
+    }
+
+    for file in files:
+        names = pq.read_schema(file).names
+        numeric = all(column in names for column in COORD_COLUMNS)
+        table = pq.read_table(
+            file,
+            columns=[
+                *(COORD_COLUMNS if numeric else ("origin_coord", "destination_coord")),
+                "datetime",
+            ],
+        )
+
+        if numeric:
+            coords = {
+                column: pc.cast(table[column], pa.float64()) for column in COORD_COLUMNS
+            }
+        else:
+            coords = {}
+            for column in ("origin", "destination"):
+                points = pc.extract_regex(table[f"{column}_coord"], POINT_PATTERN)
+                for axis in ("lon", "lat"):
+                    coords[f"{column}_{axis}"] = pc.cast(
+                        pc.struct_field(points, axis), pa.float64()
+                    )
+
+        timestamps = table["datetime"]
+        if pa.types.is_string(timestamps.type) or pa.types.is_large_string(
+            timestamps.type
+        ):
+            text = timestamps
+            timestamps = pc.strptime(
+                text, format=DATETIME_FORMAT, unit="s", error_is_null=True
+            )
+            # strptime rolls impossible days over (2018-02-30 becomes 2018-03-02), so the
+            # parsed value must format back to the original text.
+            timestamps = pc.if_else(
+                pc.equal(pc.strftime(timestamps, format=DATETIME_FORMAT), text),
+                timestamps,
+                pa.scalar(None, timestamps.type),
+            )
+        seconds = pc.cast(
+            pc.cast(timestamps, pa.timestamp("s"), safe=False), pa.int64()
+        )
+
+        valid = pc.is_valid(seconds)
+        for column, values in coords.items():
+            limit = 180 if column.endswith("_lon") else 90
+            valid = pc.and_(valid, pc.less_equal(pc.abs(values), limit))
+        for column, values in coords.items():
+            columns[column].append(pc.filter(values, valid).to_numpy())
+        columns["seconds"].append(pc.filter(seconds, valid).to_numpy())
+
+    trips = {
+        column: np.concatenate(chunks) if chunks else np.empty(0)
+        for column, chunks in columns.items()
+    }
+    order = np.argsort(trips["origin_lon"], kind="stable")
+
+    return {column: values[order] for column, values in trips.items()}
+
+
+def _contains(
+    corners: List[Tuple[float, float]],
+    origin_lon: Any,
+    origin_lat: Any,
+    destination_lon: Any,
+    destination_lat: Any,
+) -> Any:
+    """
+    Checks which trips lie within a polygon: both ends inside it, and the straight line
+    between them crossing none of its edges.
+    """
+    contained = _inside(corners, origin_lon, origin_lat) & _inside(
+        corners, destination_lon, destination_lat
+    )
+
+    for i, (a_lon, a_lat) in enumerate(corners):
+        b_lon, b_lat = corners[(i + 1) % len(corners)]
+        # The ends of the trip are on both sides of the edge, and the other way around.
+        origin_side = _side(a_lon, a_lat, b_lon, b_lat, origin_lon, origin_lat)
+        destination_side = _side(
+            a_lon, a_lat, b_lon, b_lat, destination_lon, destination_lat
+        )
+        a_side = _side(
+            origin_lon, origin_lat, destination_lon, destination_lat, a_lon, a_lat
+        )
+        b_side = _side(
+            origin_lon, origin_lat, destination_lon, destination_lat, b_lon, b_lat
+        )
+        contained &= ~((origin_side * destination_side < 0) & (a_side * b_side < 0))
+
+    return contained
+
+
+def _inside(corners: List[Tuple[float, float]], lon: Any, lat: Any) -> Any:
+    """
+    Checks which points are inside a polygon, counting the edges a ray going east crosses.
+    """
+    inside = lon < lon  # All False, with the shape of the points.
+
+    for i, (a_lon, a_lat) in enumerate(corners):
+        b_lon, b_lat = corners[(i + 1) % len(corners)]
+        if a_lat == b_lat:
+            continue
+        spans = (a_lat > lat) != (b_lat > lat)
+        crossing = a_lon + (lat - a_lat) * (b_lon - a_lon) / (b_lat - a_lat)
+        inside ^= spans & (lon < crossing)
+
+    return inside
+
+
+def _side(a_lon: Any, a_lat: Any, b_lon: Any, b_lat: Any, lon: Any, lat: Any) -> Any:
+    return (b_lon - a_lon) * (lat - a_lat) - (b_lat - a_lat) * (lon - a_lon)
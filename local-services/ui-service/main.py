@@ -1,15 +1,49 @@
+import functools
+import json
 import os
 
-from fastapi import FastAPI
+from cache import QueryCache
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from gcp import BigQueryService
+from local import LocalQueryService
 from models import Square
-from typing import Any, List, Dict
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import Any, List, Dict, Optional, Tuple
 
 PROJECT_ID = os.environ["PROJECT_ID"]
 DATASET_ID = os.environ["DATASET_ID"]
 TABLE_ID = os.environ["TABLE_ID"]
+ROLLUP_TABLE_ID = os.environ.get("ROLLUP_TABLE_ID")
+SIMILAR_TRIPS_TABLE_ID = os.environ.get("SIMILAR_TRIPS_TABLE_ID", "trips_similar_groups")
+# "bigquery", or "local" to query the Parquet files under LOCAL_DATA_DIR instead.
+QUERY_BACKEND = os.environ.get("QUERY_BACKEND", "bigquery")
+LOCAL_DATA_DIR = os.environ.get("LOCAL_DATA_DIR", "/home/user/data")
+BATCH_MAX_SQUARES = int(os.environ.get("BATCH_MAX_SQUARES", 100))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 1024))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", 300))
+RESULT_CACHE_FINGERPRINT_SECONDS = float(
+    os.environ.get("RESULT_CACHE_FINGERPRINT_SECONDS", 10)
+)
 
 app = FastAPI()
+bq = LocalQueryService(LOCAL_DATA_DIR) if QUERY_BACKEND == "local" else BigQueryService()
+result_cache = (
+    QueryCache(
+        max_entries=RESULT_CACHE_MAX_ENTRIES,
+        ttl=RESULT_CACHE_TTL_SECONDS,
+        fingerprint=functools.partial(
+            bq.get_table_fingerprint,
+            project_id=PROJECT_ID,
+            dataset_id=DATASET_ID,
+            table_id=TABLE_ID,
+        ),
+        fingerprint_interval=RESULT_CACHE_FINGERPRINT_SECONDS,
+    )
+    if RESULT_CACHE_MAX_ENTRIES
+    else None
+)
 
 
 @app.get("/")
@@ -18,21 +52,27 @@ def read_root():
 
 
 @app.post("/avg_trip_by_area")
-def avg_by_area(square: Square) -> List[Dict[str,Any]]:
+def avg_by_area(
+    square: Square, accept: Optional[str] = Header(default=None)
+) -> List[Dict[str,Any]]:
     """
     Endpoint to retrieve the weekly average count of trips within a specified geographic area.
 
     This endpoint accepts a `Square` object defining a geographic area, and it returns
     the weekly count of trips that occur within this area. The method uses the BigQueryService
-    to query a BigQuery table for the relevant data.
+    to query a BigQuery table for the relevant data, or the LocalQueryService to query local
+    Parquet files when `QUERY_BACKEND` is "local".
 
     Args:
         square (Square): An object defining the coordinates of the area's boundaries, with
-            `upper_left`, `upper_right`, `bottom_right`, and `bottom_left` properties.
+            `upper_left`, `upper_right`, `bottom_right`, and `bottom_left` properties, and an
+            optional `start` and `end` of the trips to count.
+        accept (str, optional): The Accept header. With `application/x-ndjson`, the rows are
+            streamed, one JSON object per line, as they are fetched from BigQuery.
 
     Returns:
         List[Dict[str,Any]]: A list of rows where each row includes the count of trips
-        for each week within the specified area.
+        for each week within the specified area, by week.
 
     Raises:
         HTTPException: If any error occurs during the BigQuery query execution.
@@ -40,11 +80,142 @@ def avg_by_area(square: Square) -> List[Dict[str,Any]]:
     Note:
         - This method relies on a BigQuery table with trip data specified by constants
             PROJECT_ID, DATASET_ID, and TABLE_ID.
+        - Results are cached per normalized square for `RESULT_CACHE_TTL_SECONDS`, identical
+            concurrent requests share one query, and the cache is dropped as soon as the row
+            count of the table changes (checked by the requests, at most every
+            `RESULT_CACHE_FINGERPRINT_SECONDS`).
+        - With `ROLLUP_TABLE_ID`, trips between cells fully inside the square are summed from
+            the weekly rollup maintained by the notification service.
+        - Streamed responses skip the result cache, so long time ranges are never built as a
+            single list.
+    """
+    query = functools.partial(
+        bq.get_average_trips_by_area,
+        project_id=PROJECT_ID,
+        dataset_id=DATASET_ID,
+        table_id=TABLE_ID,
+        square=square,
+        rollup_table_id=ROLLUP_TABLE_ID,
+    )
+
+    if accept and "application/x-ndjson" in accept:
+        rows = bq.iter_average_trips_by_area(
+            project_id=PROJECT_ID,
+            dataset_id=DATASET_ID,
+            table_id=TABLE_ID,
+            square=square,
+            rollup_table_id=ROLLUP_TABLE_ID,
+        )
+        return StreamingResponse(
+            (json.dumps(jsonable_encoder(row)) + "\n" for row in rows),
+            media_type="application/x-ndjson",
+        )
+
+    if result_cache is None:
+        return query()
+
+    return result_cache.get(("avg_trip_by_area", *square.cache_key()), query)
+
+
+@app.post("/avg_trip_by_areas")
+def avg_by_areas(squares: List[Square]) -> List[List[Dict[str, Any]]]:
+    """
+    Endpoint to retrieve the weekly count of trips within each of several geographic areas.
+
+    All the squares are answered by a single query, which reads the table once instead of
+    once per square. Squares already in the result cache are not queried again.
+
+    Args:
+        squares (List[Square]): The areas, each with `upper_left`, `upper_right`,
+            `bottom_right`, and `bottom_left` properties. At most `BATCH_MAX_SQUARES`.
+
+    Returns:
+        List[List[Dict[str, Any]]]: The weekly rows of each square, in the order of `squares`,
+        as returned by `/avg_trip_by_area`.
+
+    Raises:
+        HTTPException: If no square, or more than `BATCH_MAX_SQUARES`, are given.
+    """
+    if not 0 < len(squares) <= BATCH_MAX_SQUARES:
+        raise HTTPException(
+            status_code=422, detail=f"Send between 1 and {BATCH_MAX_SQUARES} squares."
+        )
+
+    keys = [("avg_trip_by_area", *square.cache_key()) for square in squares]
+    by_key = dict(zip(keys, squares))
+
+    def query(missing: List[Tuple]) -> List[List[Dict[str, Any]]]:
+        return bq.get_average_trips_by_areas(
+            project_id=PROJECT_ID,
+            dataset_id=DATASET_ID,
+            table_id=TABLE_ID,
+            squares=[by_key[key] for key in missing],
+        )
+
+    if result_cache is None:
+        return query(keys)
+
+    return result_cache.get_many(keys, query)
+
+
+@app.get("/similar_trips")
+def similar_trips(min_size: int = 2, limit: int = 100) -> List[Dict[str, Any]]:
     """
-    bq = BigQueryService()
+    Endpoint to retrieve the largest groups of similar trips: the trips between the same
+    origin and destination geohash cells (about 1.2 km x 0.6 km), in the same hour of the day.
+
+    The groups are precomputed by an offline job, `infra-code/assets/similar_trips.sql` on
+    BigQuery or `similar.py` on the local backend, into `SIMILAR_TRIPS_TABLE_ID`.
+
+    Args:
+        min_size (int, optional): The minimum number of trips of a group. Defaults to 2.
+        limit (int, optional): The maximum number of groups, up to 1000. Defaults to 100.
+
+    Returns:
+        List[Dict[str, Any]]: The cells, `time_bucket` and `count_of_trips` of every group,
+        with the `origin_coord`, `destination_coord` and `datetime` of its most typical
+        trip, by decreasing size.
 
-    result = bq.get_average_trips_by_area(
-        project_id=PROJECT_ID, dataset_id=DATASET_ID, table_id=TABLE_ID, square=square
+    Raises:
+        HTTPException: If `limit` is not between 1 and 1000.
+    """
+    if not 0 < limit <= 1000:
+        raise HTTPException(status_code=422, detail="limit must be between 1 and 1000.")
+
+    query = functools.partial(
+        bq.get_similar_trips,
+        project_id=PROJECT_ID,
+        dataset_id=DATASET_ID,
+        table_id=SIMILAR_TRIPS_TABLE_ID,
+        min_size=min_size,
+        limit=limit,
     )
 
-    return result
+    if result_cache is None:
+        return query()
+
+    return result_cache.get(("similar_trips", min_size, limit), query)
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Reports the state of the result cache.
+
+    Returns:
+        dict: The number of cached entries and queries in flight, the row count of the table the
+        entries were computed from, and the number of invalidations so far.
+    """
+    return result_cache.stats() if result_cache else {"enabled": False}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Exposes the UI service metrics in the Prometheus text format.
+
+    Returns:
+        Response: The duration (`ui_bigquery_query_seconds`), bytes processed
+        (`ui_bigquery_bytes_processed_total`) and cache hits of the BigQuery queries.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,30 @@
+from prometheus_client import Counter, Histogram
+
+BIGQUERY_QUERY_SECONDS = Histogram(
+    "ui_bigquery_query_seconds",
+    "Time between submitting a BigQuery query and fetching all of its rows.",
+    ["query"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+BIGQUERY_BYTES_PROCESSED = Counter(
+    "ui_bigquery_bytes_processed_total",
+    "Bytes processed by BigQuery queries, as reported by their jobs.",
+    ["query"],
+)
+RESULT_CACHE_REQUESTS = Counter(
+    "ui_result_cache_requests_total",
+    "Requests to the result cache of the app, by result (hit, miss or shared, when waiting "
+    "on an identical query in flight).",
+    ["result"],
+)
+BIGQUERY_CACHE_HITS = Counter(
+    "ui_bigquery_cache_hits_total",
+    "BigQuery queries answered from the BigQuery results cache.",
+    ["query"],
+)
+LOCAL_QUERY_SECONDS = Histogram(
+    "ui_local_query_seconds",
+    "Time spent by the queries of the local backend, and loading its tables (query=load).",
+    ["query"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10),
+)
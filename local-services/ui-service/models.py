@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from geo import parse_corner
+from pydantic import BaseModel, field_validator, model_validator
 
 
 class Square(BaseModel):
@@ -7,3 +11,65 @@ class Square(BaseModel):
     upper_right: str
     bottom_left: str
     bottom_right: str
+    # The trips to count, from `start` (inclusive) to `end` (exclusive). All of them if unset.
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    @field_validator("upper_left", "upper_right", "bottom_left", "bottom_right")
+    @classmethod
+    def check_corner(cls, corner: str) -> str:
+        parse_corner(corner)
+        return corner
+
+    @model_validator(mode="after")
+    def check_time_range(self) -> "Square":
+        start, end = self.time_range()
+        if start and end and start >= end:
+            raise ValueError("start must be before end")
+        return self
+
+    def corners(self) -> List[Tuple[float, float]]:
+        """
+        Parses the corners, in the order they are joined into a polygon.
+
+        Returns:
+            List[Tuple[float, float]]: The longitude and latitude of the upper left, upper right,
+            bottom right and bottom left corners.
+        """
+        return [
+            parse_corner(corner)
+            for corner in (
+                self.upper_left,
+                self.upper_right,
+                self.bottom_right,
+                self.bottom_left,
+            )
+        ]
+
+    def time_range(self) -> Tuple[Optional[datetime], Optional[datetime]]:
+        """
+        Normalizes the time range to naive UTC datetimes, like the `datetime` column.
+
+        Returns:
+            Tuple[Optional[datetime], Optional[datetime]]: The start and end, None when unset.
+        """
+        return tuple(
+            value.astimezone(timezone.utc).replace(tzinfo=None)
+            if value and value.tzinfo
+            else value
+            for value in (self.start, self.end)
+        )
+
+    def cache_key(self) -> Tuple[str, ...]:
+        """
+        Normalizes the corners and time range, so squares that only differ by whitespace or
+        by the formatting of their numbers and datetimes share the same key.
+
+        Returns:
+            Tuple[str, ...]: The "lon lat" of each corner, with 7 decimals (about 1 cm), then
+            the start and end in ISO format, or empty.
+        """
+        return (
+            *(f"{lon:.7f} {lat:.7f}" for lon, lat in self.corners()),
+            *(value.isoformat() if value else "" for value in self.time_range()),
+        )
@@ -0,0 +1,230 @@
+"""
+Groups similar trips: the trips between the same origin and destination geohash cells, at
+the same time of day.
+
+This is the offline batch job behind `/similar_trips` for the local backend. It reads the
+Parquet files of a table, groups its trips and writes one row per group, with its size and
+its most typical trip, to the `SIMILAR_TRIPS_TABLE_ID` folder next to it. The BigQuery
+version of the job is `infra-code/assets/similar_trips.sql`.
+
+Usage (from `local-services/ui-service`, with `pyarrow` and `numpy` installed):
+
+    python similar.py /home/user/data --dataset-id trips --table-id trips
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from geo import GEOHASH_ALPHABET, STORED_PRECISION
+
+SIMILAR_TRIPS_TABLE_ID = "trips_similar_groups"
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def group_similar_trips(
+    trips: Dict[str, Any], bucket_minutes: int = 60, min_size: int = 2
+) -> Dict[str, Any]:
+    """
+    Groups trips by origin cell, destination cell and time of day bucket.
+
+    The cells and buckets of every trip are packed into integer keys, which are sorted, so
+    tens of millions of trips are grouped in O(n log n) vectorized steps, without any Python
+    loop over the trips. The representative of a group is its trip closest to the mean
+    origin and destination of the group.
+
+    Args:
+        trips (Dict[str, Any]): The `origin_lon`, `origin_lat`, `destination_lon`,
+            `destination_lat` and `seconds` (since the epoch) NumPy arrays of the trips, as
+            returned by `local.read_trips`.
+        bucket_minutes (int, optional): The length of the time of day buckets. Defaults to 60.
+        min_size (int, optional): The minimum number of trips of the groups kept.
+            Defaults to 2.
+
+    Returns:
+        Dict[str, Any]: The `origin_cell`, `destination_cell`, `time_bucket` ("HH:MM"),
+        `count_of_trips` arrays of the groups, and the `origin_lon`, `origin_lat`,
+        `destination_lon`, `destination_lat` and `seconds` arrays of their representatives,
+        by decreasing size.
+    """
+    import numpy as np
+
+    bits = STORED_PRECISION * 5
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    origin = _cell_key(trips["origin_lon"], trips["origin_lat"], lon_bits, lat_bits)
+    destination = _cell_key(
+        trips["destination_lon"], trips["destination_lat"], lon_bits, lat_bits
+    )
+    keys = (origin << bits) | destination
+    buckets = (trips["seconds"] % 86400) // (bucket_minutes * 60)
+    bucket_count = -(-24 * 60 // bucket_minutes)
+
+    # The 60 bits of the cells leave no room for the bucket: the cells are ranked first,
+    # and the rank and bucket packed into a second key.
+    order = np.argsort(keys)
+    ordered = keys[order]
+    ranks = np.empty_like(keys)
+    ranks[order] = np.cumsum(np.concatenate(([0], ordered[1:] != ordered[:-1])))
+    order = np.argsort(ranks * bucket_count + buckets)
+    keys, buckets = keys[order], buckets[order]
+
+    changes = (keys[1:] != keys[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(np.concatenate(([True], changes))) if len(order) else order
+    counts = np.diff(np.append(starts, len(order)))
+    groups = np.repeat(np.arange(len(starts)), counts)
+
+    distances = np.zeros(len(order))
+    for column in ("origin_lon", "origin_lat", "destination_lon", "destination_lat"):
+        values = trips[column][order]
+        means = np.add.reduceat(values, starts) / counts if len(order) else values
+        distances += (values - means[groups]) ** 2
+    # The first trip of every group at the smallest distance of the group.
+    closest = np.flatnonzero(
+        distances
+        == (np.minimum.reduceat(distances, starts)[groups] if len(order) else 0)
+    )
+    firsts = closest[
+        np.concatenate(([True], groups[closest][1:] != groups[closest][:-1]))[
+            : len(closest)
+        ]
+    ]
+    representatives = order[firsts]
+
+    kept = np.flatnonzero(counts >= min_size)
+    kept = kept[np.argsort(-counts[kept], kind="stable")]
+    cells = keys[starts[kept]]
+    labels = np.array(
+        [
+            f"{minutes // 60:02d}:{minutes % 60:02d}"
+            for minutes in range(0, 24 * 60, bucket_minutes)
+        ]
+    )
+
+    return {
+        "origin_cell": _encode(cells >> bits, lon_bits, lat_bits),
+        "destination_cell": _encode(cells & ((1 << bits) - 1), lon_bits, lat_bits),
+        "time_bucket": labels[buckets[starts[kept]]],
+        "count_of_trips": counts[kept],
+        **{
+            column: trips[column][representatives[kept]]
+            for column in (
+                "origin_lon",
+                "origin_lat",
+                "destination_lon",
+                "destination_lat",
+                "seconds",
+            )
+        },
+    }
+
+
+def _cell_key(lon: Any, lat: Any, lon_bits: int, lat_bits: int) -> Any:
+    """
+    Packs the column and row of the geohash cell of every point into an integer.
+    """
+    import numpy as np
+
+    x = np.clip(np.floor((lon + 180) / 360 * (1 << lon_bits)), 0, (1 << lon_bits) - 1)
+    y = np.clip(np.floor((lat + 90) / 180 * (1 << lat_bits)), 0, (1 << lat_bits) - 1)
+
+    return (x.astype(np.int64) << lat_bits) | y.astype(np.int64)
+
+
+def _encode(keys: Any, lon_bits: int, lat_bits: int) -> Any:
+    """
+    Encodes the keys of `_cell_key` as geohashes, interleaving the bits of the column and
+    the row, the column taking the first one.
+    """
+    import numpy as np
+
+    x, y = keys >> lat_bits, keys & ((1 << lat_bits) - 1)
+    code = np.zeros_like(keys)
+    for i in range(lon_bits + lat_bits):
+        if i % 2 == 0:
+            lon_bits -= 1
+            code = (code << 1) | ((x >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            code = (code << 1) | ((y >> lat_bits) & 1)
+
+    alphabet = np.array(list(GEOHASH_ALPHABET))
+    digits = [
+        (code >> (5 * (STORED_PRECISION - 1 - i))) & 31 for i in range(STORED_PRECISION)
+    ]
+    characters = np.stack([alphabet[digit] for digit in digits], axis=-1)
+
+    return np.ascontiguousarray(characters).view(f"<U{STORED_PRECISION}").reshape(-1)
+
+
+def write_groups(groups: Dict[str, Any], path: Path) -> None:
+    """
+    Writes groups to a Parquet file, with the columns of `infra-code/assets/similar_trips.sql`.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    def point(column: str) -> pa.Array:
+        return pc.binary_join_element_wise(
+            "POINT (",
+            pc.cast(pa.array(groups[f"{column}_lon"]), pa.string()),
+            " ",
+            pc.cast(pa.array(groups[f"{column}_lat"]), pa.string()),
+            ")",
+            "",
+        )
+
+    table = pa.table(
+        {
+            "origin_cell": pa.array(groups["origin_cell"], pa.string()),
+            "destination_cell": pa.array(groups["destination_cell"], pa.string()),
+            "time_bucket": pa.array(groups["time_bucket"], pa.string()),
+            "count_of_trips": pa.array(groups["count_of_trips"], pa.int64()),
+            "origin_coord": point("origin"),
+            "destination_coord": point("destination"),
+            "datetime": pc.strftime(
+                pa.array(groups["seconds"], pa.timestamp("s")),
+                format=DATETIME_FORMAT,
+            ),
+        }
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    pq.write_table(table, temporary)
+    temporary.replace(path)
+
+
+def main() -> None:
+    from local import read_trips
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "data_dir", type=Path, help="The folder with {dataset_id}/{table_id} folders"
+    )
+    parser.add_argument("--dataset-id", default="trips")
+    parser.add_argument("--table-id", default="trips")
+    parser.add_argument("--output-table-id", default=SIMILAR_TRIPS_TABLE_ID)
+    parser.add_argument("--bucket-minutes", type=int, default=60)
+    parser.add_argument("--min-size", type=int, default=2)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    trips = read_trips(
+        sorted((args.data_dir / args.dataset_id / args.table_id).rglob("*.parquet"))
+    )
+    loaded = time.perf_counter()
+    groups = group_similar_trips(trips, args.bucket_minutes, args.min_size)
+    grouped = time.perf_counter()
+
+    path = args.data_dir / args.dataset_id / args.output_table_id / "groups.parquet"
+    write_groups(groups, path)
+    print(
+        f"{len(trips['seconds'])} trips loaded in {loaded - start:.2f}s, "
+        f"{len(groups['count_of_trips'])} groups of {args.min_size}+ trips found in "
+        f"{grouped - loaded:.2f}s, written to {path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
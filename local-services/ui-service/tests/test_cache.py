@@ -0,0 +1,213 @@
+import threading
+
+import pytest
+
+import cache
+from cache import QueryCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+
+    return compute, calls
+
+
+def test_entries_are_served_until_their_ttl(clock):
+    query_cache = QueryCache(ttl=60)
+    compute, calls = counting("result")
+
+    assert query_cache.get("key", compute) == "result"
+    clock.now += 59
+    assert query_cache.get("key", compute) == "result"
+    assert len(calls) == 1
+
+    clock.now += 1
+    assert query_cache.get("key", compute) == "result"
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted():
+    query_cache = QueryCache(max_entries=2)
+    query_cache.get("a", lambda: 1)
+    query_cache.get("b", lambda: 2)
+    query_cache.get("a", lambda: 1)
+    query_cache.get("c", lambda: 3)
+
+    assert query_cache.get("a", lambda: "recomputed") == 1
+    assert query_cache.get("b", lambda: "recomputed") == "recomputed"
+
+
+def test_errors_are_raised_and_not_cached():
+    query_cache = QueryCache()
+
+    def fail():
+        raise RuntimeError("query failed")
+
+    with pytest.raises(RuntimeError):
+        query_cache.get("key", fail)
+
+    assert query_cache.get("key", lambda: "result") == "result"
+    assert query_cache.stats()["inflight"] == 0
+
+
+def test_concurrent_callers_share_one_query():
+    query_cache = QueryCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    owner = threading.Thread(
+        target=lambda: results.append(query_cache.get("key", slow))
+    )
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(
+        target=lambda: results.append(query_cache.get("key", slow))
+    )
+    waiter.start()
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert results == ["result", "result"]
+    assert len(calls) == 1
+
+
+def test_invalidate_drops_every_entry():
+    query_cache = QueryCache()
+    query_cache.get("key", lambda: "old")
+
+    query_cache.invalidate()
+
+    assert query_cache.get("key", lambda: "new") == "new"
+    assert query_cache.stats()["invalidations"] == 1
+
+
+def test_results_of_queries_started_before_an_invalidation_are_not_cached():
+    query_cache = QueryCache()
+
+    def stale():
+        query_cache.invalidate()
+        return "stale"
+
+    assert query_cache.get("key", stale) == "stale"
+    assert query_cache.get("key", lambda: "fresh") == "fresh"
+
+    def stale_many(keys):
+        query_cache.invalidate()
+        return ["stale"] * len(keys)
+
+    assert query_cache.get_many(["a", "b"], stale_many) == ["stale", "stale"]
+    assert query_cache.stats()["entries"] == 0
+
+
+def test_get_many_computes_only_the_missing_keys():
+    query_cache = QueryCache()
+    query_cache.get("a", lambda: "A")
+    computed = []
+
+    def compute(keys):
+        computed.append(keys)
+        return [key.upper() for key in keys]
+
+    assert query_cache.get_many(["a", "b", "c", "b"], compute) == ["A", "B", "C", "B"]
+    assert computed == [["b", "c"]]
+    assert query_cache.get_many(["c", "a"], compute) == ["C", "A"]
+    assert computed == [["b", "c"]]
+
+
+class Fingerprint:
+    def __init__(self):
+        self.version = 1
+        self.checks = 0
+
+    def __call__(self):
+        self.checks += 1
+        return self.version
+
+
+def test_fingerprint_is_only_checked_by_requests(clock):
+    fingerprint = Fingerprint()
+    query_cache = QueryCache(fingerprint=fingerprint, fingerprint_interval=10)
+
+    clock.now += 60
+    assert fingerprint.checks == 0
+
+    query_cache.get("key", lambda: "result")
+    query_cache.get("key", lambda: "result")
+    query_cache.get_many(["key"], lambda keys: ["result"])
+    assert fingerprint.checks == 1
+
+    clock.now += 10
+    query_cache.get_many(["key"], lambda keys: ["result"])
+    assert fingerprint.checks == 2
+
+
+def test_changed_fingerprint_invalidates_the_cache(clock):
+    fingerprint = Fingerprint()
+    query_cache = QueryCache(ttl=60, fingerprint=fingerprint, fingerprint_interval=10)
+    query_cache.get("key", lambda: "old")
+
+    fingerprint.version = 2
+    clock.now += 5
+    assert query_cache.get("key", lambda: "new") == "old"
+
+    clock.now += 5
+    assert query_cache.get("key", lambda: "new") == "new"
+    assert query_cache.stats()["version"] == 2
+    assert query_cache.stats()["invalidations"] == 1
+
+
+def test_failed_fingerprint_check_keeps_the_cache(clock):
+    def fail():
+        raise RuntimeError("metadata unavailable")
+
+    query_cache = QueryCache(fingerprint=fail, fingerprint_interval=10)
+
+    assert query_cache.get("key", lambda: "result") == "result"
+    assert query_cache.get("key", lambda: "recomputed") == "result"
+    assert query_cache.stats()["invalidations"] == 0
+
+
+def test_requests_do_not_wait_for_a_fingerprint_check():
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 1
+
+    query_cache = QueryCache(fingerprint=slow)
+    checker = threading.Thread(target=lambda: query_cache.get("a", lambda: "A"))
+    checker.start()
+    started.wait(5)
+
+    assert query_cache.get("b", lambda: "B") == "B"
+    release.set()
+    checker.join(5)
+    assert query_cache.stats()["version"] == 1
@@ -0,0 +1,151 @@
+import random
+
+import pytest
+
+from geo import (
+    GEOHASH_ALPHABET,
+    STORED_PRECISION,
+    bounding_box,
+    cell_ranges,
+    classify_cells,
+    merge_ranges,
+    parse_corner,
+)
+
+
+def geohash(lon, lat, precision=STORED_PRECISION):
+    """
+    Encodes a point the usual way, one bit at a time, as the ingestion stores its cell.
+    """
+    lon_range, lat_range = [-180.0, 180.0], [-90.0, 90.0]
+    code = 0
+
+    for i in range(precision * 5):
+        value, bounds = (lon, lon_range) if i % 2 == 0 else (lat, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        code <<= 1
+        if value >= middle:
+            code |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+
+    return "".join(
+        GEOHASH_ALPHABET[(code >> (5 * (precision - 1 - i))) & 31]
+        for i in range(precision)
+    )
+
+
+def random_points(bbox, count, seed=0):
+    rng = random.Random(seed)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return [
+        (rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat))
+        for _ in range(count)
+    ]
+
+
+def in_ranges(cell, ranges):
+    return any(start <= cell and (end is None or cell < end) for start, end in ranges)
+
+
+def in_bbox(point, bbox):
+    return bbox[0] <= point[0] <= bbox[2] and bbox[1] <= point[1] <= bbox[3]
+
+
+def in_polygon(point, corners):
+    # Ray casting on the straight edges.
+    inside = False
+    for i, (x1, y1) in enumerate(corners):
+        x2, y2 = corners[i - 1]
+        if (y1 > point[1]) != (y2 > point[1]):
+            if point[0] < x1 + (point[1] - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+def test_parse_corner():
+    assert parse_corner(" 4.9  52.3 ") == (4.9, 52.3)
+
+    for corner in ("181 0", "0 -91", "4.9", "a b"):
+        with pytest.raises(ValueError):
+            parse_corner(corner)
+
+
+def test_geohash_reference():
+    assert geohash(4.8936, 52.3730) == "u173zq"
+    assert geohash(-74.0060, 40.7128) == "dr5reg"
+
+
+@pytest.mark.parametrize(
+    "bbox",
+    [
+        (4.85, 52.33, 4.95, 52.40),
+        (-74.1, 40.6, -73.8, 40.9),
+        (13.0, 52.0, 14.0, 53.0),
+        # Straddles the first bit of both the longitude and the latitude.
+        (-0.05, -0.05, 0.05, 0.05),
+        (170.0, -80.0, 180.0, -60.0),
+    ],
+)
+@pytest.mark.parametrize("max_cells", [1, 8, 64])
+def test_cell_ranges_cover_every_point_of_the_bbox(bbox, max_cells):
+    ranges = cell_ranges(bbox, max_cells=max_cells)
+    # Points around the bbox too, to check the filter on cells keeps all and only them.
+    margin = (bbox[2] - bbox[0]) / 4
+    points = random_points(bounding_box([bbox[:2], bbox[2:]], margin=margin), 5000)
+
+    in_cover = [point for point in points if in_ranges(geohash(*point), ranges)]
+
+    assert sum(in_bbox(p, bbox) for p in points) == sum(
+        in_bbox(p, bbox) for p in in_cover
+    )
+    # Only the coarsest cells may exceed the limit.
+    assert len(ranges) <= max_cells or all(len(start) == 1 for start, _ in ranges)
+    assert all(end is None or start < end for start, end in ranges)
+
+
+def test_merge_ranges():
+    assert merge_ranges([("u2", "u4"), ("u0", "u1"), ("u3", "u5"), ("u5", "u6")]) == [
+        ("u0", "u1"),
+        ("u2", "u6"),
+    ]
+    assert merge_ranges([("z", None), ("zz", "zzz"), ("a", "b")]) == [
+        ("a", "b"),
+        ("z", None),
+    ]
+
+
+@pytest.mark.parametrize(
+    "corners",
+    [
+        [(4.85, 52.33), (4.95, 52.33), (4.95, 52.40), (4.85, 52.40)],
+        [(4.85, 52.33), (4.97, 52.35), (4.90, 52.41)],
+        [(-74.05, 40.70), (-73.95, 40.68), (-73.90, 40.78), (-74.02, 40.80)],
+    ],
+)
+def test_classify_cells_matches_a_brute_force_count(corners):
+    inner, edge = classify_cells(corners)
+    inner, edge = set(inner), set(edge)
+    points = random_points(bounding_box(corners, margin=0.02), 20000)
+
+    inside = [p for p in points if in_polygon(p, corners)]
+    # The area query: trips in inner cells are counted as is, trips in edge cells are
+    # checked against the polygon.
+    counted = [
+        p
+        for p in points
+        if geohash(*p) in inner or (geohash(*p) in edge and in_polygon(p, corners))
+    ]
+
+    assert inner and edge and not inner & edge
+    assert sorted(counted) == sorted(inside)
+    assert all(geohash(*p) in inner | edge for p in inside)
+
+
+def test_classify_cells_gives_up_on_concave_or_large_polygons():
+    concave = [(0.0, 0.0), (1.0, 0.0), (0.5, 0.2), (1.0, 1.0), (0.0, 1.0)]
+    square = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
+
+    assert classify_cells(concave) is None
+    assert classify_cells(square, max_cells=100) is None
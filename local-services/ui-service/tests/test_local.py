@@ -0,0 +1,155 @@
+import random
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from local import WEEK_ORIGIN, LocalQueryService
+from models import Square
+
+# A convex area, so a trip is within it when both of its ends are.
+AREA = dict(
+    upper_left="4.80 52.42",
+    upper_right="4.98 52.40",
+    bottom_right="4.96 52.30",
+    bottom_left="4.82 52.32",
+)
+
+
+def random_trips(count, seed):
+    rng = random.Random(seed)
+    start = datetime(2018, 5, 1)
+    return [
+        {
+            "origin_lon": rng.uniform(4.7, 5.1),
+            "origin_lat": rng.uniform(52.2, 52.5),
+            "destination_lon": rng.uniform(4.7, 5.1),
+            "destination_lat": rng.uniform(52.2, 52.5),
+            "datetime": (start + timedelta(seconds=rng.randrange(90 * 86400))).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            ),
+        }
+        for _ in range(count)
+    ]
+
+
+def inside(lon, lat, corners):
+    # Convex polygon: the point is on the same side of every edge.
+    sides = [
+        (b[0] - a[0]) * (lat - a[1]) - (b[1] - a[1]) * (lon - a[0])
+        for a, b in zip(corners, corners[1:] + corners[:1])
+    ]
+    return all(side > 0 for side in sides) or all(side < 0 for side in sides)
+
+
+def expected_weeks(trips, square):
+    """
+    The BigQuery query, by brute force: trips within the area and the time range, counted
+    by `TIMESTAMP_BUCKET(TIMESTAMP(datetime), INTERVAL 1 WEEK)`.
+    """
+    corners = square.corners()
+    start, end = square.time_range()
+    counts = {}
+
+    for trip in trips:
+        moment = datetime.strptime(trip["datetime"], "%Y-%m-%d %H:%M:%S")
+        if (start and moment < start) or (end and moment >= end):
+            continue
+        if not (
+            inside(trip["origin_lon"], trip["origin_lat"], corners)
+            and inside(trip["destination_lon"], trip["destination_lat"], corners)
+        ):
+            continue
+        week = (moment - WEEK_ORIGIN.replace(tzinfo=None)).days // 7
+        counts[week] = counts.get(week, 0) + 1
+
+    return [
+        {"count_of_trips": count, "time": WEEK_ORIGIN + timedelta(weeks=week)}
+        for week, count in sorted(counts.items())
+    ]
+
+
+def wkt(trip):
+    return {
+        "origin_coord": f"POINT ({trip['origin_lon']!r} {trip['origin_lat']!r})",
+        "destination_coord": f"POINT ({trip['destination_lon']!r} {trip['destination_lat']!r})",
+        "datetime": trip["datetime"],
+    }
+
+
+@pytest.fixture
+def table_dir(tmp_path):
+    path = tmp_path / "trips" / "trips"
+    path.mkdir(parents=True)
+    return path
+
+
+@pytest.fixture
+def service(tmp_path):
+    return LocalQueryService(str(tmp_path))
+
+
+def query(service, **times):
+    return service.get_average_trips_by_area(
+        "p", "trips", "trips", Square(**AREA, **times)
+    )
+
+
+@pytest.mark.parametrize(
+    "times",
+    [
+        {},
+        {"start": "2018-06-01T00:00:00"},
+        {"start": "2018-05-10T12:00:00", "end": "2018-07-01T00:00:00"},
+        {"end": "2018-05-20T00:00:00+02:00"},
+    ],
+)
+def test_area_query_matches_the_bigquery_semantics(service, table_dir, times):
+    numeric, text = random_trips(3000, seed=1), random_trips(3000, seed=2)
+    # Files with the numeric columns, and files of older ingestions with WKT points only.
+    pq.write_table(pa.Table.from_pylist(numeric), table_dir / "numeric.parquet")
+    pq.write_table(
+        pa.Table.from_pylist([wkt(trip) for trip in text]), table_dir / "text.parquet"
+    )
+
+    rows = query(service, **times)
+
+    assert rows == expected_weeks(numeric + text, Square(**AREA, **times))
+    assert all(row["time"].weekday() == 6 for row in rows)  # Weeks start on Sundays.
+
+
+def test_rows_rejected_by_the_ingestion_are_skipped(service, table_dir):
+    trip = random_trips(1, seed=3)[0]
+    trip.update(
+        origin_lon=4.9, origin_lat=52.36, destination_lon=4.91, destination_lat=52.37
+    )
+    rows = [
+        wkt(trip),
+        {**wkt(trip), "origin_coord": "POINT (4.9)"},
+        {**wkt(trip), "destination_coord": "POINT (4.9 95)"},
+        {**wkt(trip), "datetime": "2018-02-30 00:00:00"},
+    ]
+    pq.write_table(pa.Table.from_pylist(rows), table_dir / "trips.parquet")
+
+    assert [row["count_of_trips"] for row in query(service)] == [1]
+
+
+def test_table_is_reloaded_when_its_files_change(service, table_dir):
+    pq.write_table(
+        pa.Table.from_pylist(random_trips(500, seed=4)), table_dir / "a.parquet"
+    )
+    before = sum(row["count_of_trips"] for row in query(service))
+
+    pq.write_table(
+        pa.Table.from_pylist(random_trips(500, seed=5)), table_dir / "b.parquet"
+    )
+    after = sum(row["count_of_trips"] for row in query(service))
+
+    assert after > before
+    assert service.get_table_fingerprint("p", "trips", "trips") == 1000
+
+
+def test_missing_table_has_no_trips(service):
+    assert query(service) == []
+    assert service.get_table_fingerprint("p", "trips", "trips") == 0
@@ -0,0 +1,113 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from local import LocalQueryService
+from similar import SIMILAR_TRIPS_TABLE_ID, group_similar_trips, write_groups
+from test_geo import geohash
+
+COLUMNS = ("origin_lon", "origin_lat", "destination_lon", "destination_lat", "seconds")
+
+
+def random_trips(count, seed=0):
+    rng = random.Random(seed)
+    # A few hot spots, so many trips share their cells.
+    spots = [(4.89 + 0.01 * i, 52.37 + 0.01 * i) for i in range(4)]
+
+    def near(spot):
+        return spot[0] + rng.uniform(0, 0.004), spot[1] + rng.uniform(0, 0.004)
+
+    trips = {column: [] for column in COLUMNS}
+    for _ in range(count):
+        origin, destination = near(rng.choice(spots)), near(rng.choice(spots))
+        for column, value in zip(COLUMNS, (*origin, *destination)):
+            trips[column].append(value)
+        trips["seconds"].append(1527465600 + rng.randrange(3 * 86400))
+
+    return {
+        column: np.array(values, dtype=np.int64 if column == "seconds" else float)
+        for column, values in trips.items()
+    }
+
+
+def brute_force(trips, bucket_minutes):
+    groups = Counter()
+
+    for origin_lon, origin_lat, destination_lon, destination_lat, seconds in zip(
+        *trips.values()
+    ):
+        minutes = seconds % 86400 // (bucket_minutes * 60) * bucket_minutes
+        bucket = f"{minutes // 60:02d}:{minutes % 60:02d}"
+        groups[
+            geohash(origin_lon, origin_lat),
+            geohash(destination_lon, destination_lat),
+            bucket,
+        ] += 1
+
+    return groups
+
+
+def test_groups_match_a_brute_force_grouping():
+    trips = random_trips(5000)
+
+    groups = group_similar_trips(trips, bucket_minutes=90, min_size=2)
+
+    expected = {
+        key: count for key, count in brute_force(trips, 90).items() if count >= 2
+    }
+    found = {
+        (origin, destination, bucket): count
+        for origin, destination, bucket, count in zip(
+            groups["origin_cell"],
+            groups["destination_cell"],
+            groups["time_bucket"],
+            groups["count_of_trips"],
+        )
+    }
+    assert found == expected
+    assert list(groups["count_of_trips"]) == sorted(
+        groups["count_of_trips"], reverse=True
+    )
+
+
+def test_representatives_belong_to_their_group():
+    trips = random_trips(2000, seed=1)
+
+    groups = group_similar_trips(trips, bucket_minutes=60, min_size=3)
+
+    for i, origin in enumerate(groups["origin_cell"]):
+        assert geohash(groups["origin_lon"][i], groups["origin_lat"][i]) == origin
+        assert (
+            geohash(groups["destination_lon"][i], groups["destination_lat"][i])
+            == groups["destination_cell"][i]
+        )
+        assert (
+            f"{groups['seconds'][i] % 86400 // 3600:02d}:00" == groups["time_bucket"][i]
+        )
+
+
+def test_no_trips_make_no_groups():
+    assert len(group_similar_trips(random_trips(0))["count_of_trips"]) == 0
+
+
+def test_written_groups_are_served_by_the_local_backend(tmp_path):
+    groups = group_similar_trips(random_trips(3000, seed=2), min_size=2)
+    write_groups(groups, tmp_path / "trips" / SIMILAR_TRIPS_TABLE_ID / "groups.parquet")
+    service = LocalQueryService(str(tmp_path))
+
+    rows = service.get_similar_trips(
+        "p", "trips", SIMILAR_TRIPS_TABLE_ID, min_size=5, limit=10
+    )
+
+    assert len(rows) == min(10, sum(count >= 5 for count in groups["count_of_trips"]))
+    assert [row["count_of_trips"] for row in rows] == sorted(
+        groups["count_of_trips"], reverse=True
+    )[: len(rows)]
+    assert set(rows[0]) == set(
+        pq.read_schema(
+            tmp_path / "trips" / SIMILAR_TRIPS_TABLE_ID / "groups.parquet"
+        ).names
+    )
+    assert rows[0]["origin_coord"].startswith("POINT (")
@@ -0,0 +1,123 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+
+class IdBatcher:
+    """
+    Collects the ingestion IDs submitted by concurrent invocations over a short window, and
+    handles all of them with a single call.
+
+    The first invocation of a window leads it: it waits for `window` seconds, or until
+    `max_ids` IDs are collected, then calls `run` with the IDs and hands every invocation
+    its result. A failed call fails every invocation of its window, which Pub/Sub then
+    redelivers.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[List[str]], Any],
+        window: float = 1.0,
+        max_ids: int = 1000,
+    ) -> None:
+        """
+        Initializes the IdBatcher.
+
+        Args:
+            run (Callable[[List[str]], Any]): Handles several ingestion IDs at once, such as
+                `BigQueryService.add_to_rollups`.
+            window (float, optional): The seconds IDs are collected for. Defaults to 1.
+            max_ids (int, optional): The number of IDs that closes a window early.
+                Defaults to 1000.
+        """
+        self.run = run
+        self.window = window
+        self.max_ids = max_ids
+
+        self._batch: Optional[_Batch] = None
+        self._lock = threading.Lock()
+
+    def submit(self, ingestion_id: str) -> Any:
+        """
+        Adds an ingestion ID to the current window, and waits for the call of the window.
+
+        Args:
+            ingestion_id (str): The unique identifier of the ingestion.
+
+        Returns:
+            Any: The result of `run` for the IDs of the window.
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+
+            if leader:
+                batch = self._batch = _Batch()
+
+            batch.ids[ingestion_id] = None
+            # A full batch takes no more IDs: the next ones start another window.
+            if len(batch.ids) >= self.max_ids:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+
+            try:
+                batch.result.set_result(self.run(list(batch.ids)))
+            except Exception as e:
+                batch.result.set_exception(e)
+
+        return batch.result.result()
+
+
+class CountBatcher(IdBatcher):
+    """
+    Resolves the counts of the ingestion IDs checked by concurrent invocations with a single
+    query per window (see `IdBatcher`).
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[List[str]], Dict[str, int]],
+        window: float = 1.0,
+        max_ids: int = 1000,
+    ) -> None:
+        """
+        Initializes the CountBatcher.
+
+        Args:
+            fetch (Callable[[List[str]], Dict[str, int]]): Counts the records of several
+                ingestion IDs, such as `BigQueryService.get_counts`.
+            window (float, optional): The seconds IDs are collected for. Defaults to 1.
+            max_ids (int, optional): The number of IDs that closes a window early.
+                Defaults to 1000.
+        """
+        super().__init__(run=fetch, window=window, max_ids=max_ids)
+
+    def get_count(self, ingestion_id: str) -> int:
+        """
+        Returns the count of records of an ingestion ID, from the query of its window.
+
+        Args:
+            ingestion_id (str): The unique identifier of the ingestion.
+
+        Returns:
+            int: The count of records, 0 if none was found.
+        """
+        return self.submit(ingestion_id).get(ingestion_id, 0)
+
+
+class _Batch:
+    """
+    The ingestion IDs of a window, and the future of their result.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, None] = {}
+        self.result: Future = Future()
+        self.full = threading.Event()
@@ -1,5 +1,6 @@
+import threading
 from concurrent import futures
-from typing import Dict
+from typing import Dict, List, Optional
 
 from google.cloud import bigquery, pubsub_v1
 
@@ -10,7 +11,12 @@ class BigQueryService:
     """
 
     def __init__(
-        self, project_id: str, dataset_id: str, status_table_name: str
+        self,
+        project_id: str,
+        dataset_id: str,
+        status_table_name: str,
+        trips_table_name: str = "trips",
+        rollup_table_name: Optional[str] = None,
     ) -> None:
         """
         Initializes the BigQueryService instance with a specific BigQuery table.
@@ -19,9 +25,18 @@ class BigQueryService:
             project_id (str): The Google Cloud project ID where the BigQuery table resides.
             dataset_id (str): The dataset ID containing the table.
             status_table_name (str): The name of the table used for querying event counts.
+            trips_table_name (str, optional): The name of the raw trips table. Defaults to "trips".
+            rollup_table_name (str, optional): The name of the weekly rollup of trips per origin
+                and destination cell. Its `{rollup_table_name}_ingestions` table records the
+                ingestions already added to it.
         """
         self.__client = bigquery.Client()
         self.core_table = f"{project_id}.{dataset_id}.{status_table_name}"
+        self.trips_table = f"{project_id}.{dataset_id}.{trips_table_name}"
+        self.rollup_table = (
+            f"{project_id}.{dataset_id}.{rollup_table_name}" if rollup_table_name else None
+        )
+        self._rollup_lock = threading.Lock()
 
     def get_count(self, ingestion_id: str) -> int:
         """
@@ -37,22 +52,148 @@ class BigQueryService:
             int: The count of records found for the specified ingestion ID. Returns 0 if
             no matching records are found.
 
+        Raises:
+            google.cloud.exceptions.GoogleCloudError: If the query fails due to issues
+            with the BigQuery service.
+        """
+        return self.get_counts([ingestion_id]).get(ingestion_id, 0)
+
+    def get_counts(self, ingestion_ids: List[str]) -> Dict[str, int]:
+        """
+        Retrieves the count of records of several ingestion IDs with a single query.
+
+        The IDs filter the rows before the view groups them, so the query reads the same
+        `ingestion_id` column once, however many IDs are checked.
+
+        Args:
+            ingestion_ids (List[str]): The unique identifiers of the ingestions to query.
+
+        Returns:
+            Dict[str, int]: The count of records of every ingestion ID with records.
+
         Raises:
             google.cloud.exceptions.GoogleCloudError: If the query fails due to issues
             with the BigQuery service.
         """
         query = (
-            f"SELECT * FROM `{self.core_table}`"
-            f'WHERE ingestion_id = "{ingestion_id}"'
+            f"SELECT ingestion_id, count_of_records FROM `{self.core_table}` "
+            "WHERE ingestion_id IN UNNEST(@ingestion_ids)"
         )
 
-        query_job = self.__client.query(query, job_config=bigquery.QueryJobConfig(use_query_cache=False))
-        rows = query_job.result()
+        query_job = self.__client.query(
+            query,
+            job_config=bigquery.QueryJobConfig(
+                use_query_cache=False,
+                query_parameters=[
+                    bigquery.ArrayQueryParameter("ingestion_ids", "STRING", ingestion_ids)
+                ],
+            ),
+        )
 
-        for row in rows:
-            return row.get("count_of_records")
+        return {row.get("ingestion_id"): row.get("count_of_records") for row in query_job.result()}
 
-        return 0
+    def add_to_rollup(self, ingestion_id: str) -> None:
+        """
+        Adds the trips of a finished ingestion to the weekly rollup, once (see `add_to_rollups`).
+
+        Args:
+            ingestion_id (str): The ingestion ID whose trips were all written to BigQuery.
+        """
+        self.add_to_rollups([ingestion_id])
+
+    def add_to_rollups(self, ingestion_ids: List[str]) -> None:
+        """
+        Adds the trips of finished ingestions to the weekly rollup, once.
+
+        The trips are counted per origin cell, destination cell and week, and merged into the
+        rollup in the same transaction that records the ingestions as added, so a redelivered
+        status event never counts an ingestion twice. Concurrent transactions on the rollup
+        abort each other: the updates of a process run one at a time, and an aborted one is
+        retried with exponential backoff.
+
+        Args:
+            ingestion_ids (List[str]): The ingestion IDs whose trips were all written to
+                BigQuery.
+
+        Raises:
+            google.cloud.exceptions.GoogleCloudError: If the script fails due to issues
+            with the BigQuery service, or is still aborted after 90 seconds of retries.
+        """
+        from google.api_core import exceptions, retry
+
+        if not self.rollup_table:
+            return
+
+        script = f"""
+            DECLARE new_ingestion_ids ARRAY<STRING>;
+
+            BEGIN TRANSACTION;
+
+            SET new_ingestion_ids = ARRAY(
+                SELECT ingestion_id
+                FROM UNNEST(@ingestion_ids) AS ingestion_id
+                WHERE ingestion_id NOT IN (
+                    SELECT ingestion_id FROM `{self.rollup_table}_ingestions`
+                )
+            );
+
+            IF ARRAY_LENGTH(new_ingestion_ids) > 0 THEN
+                MERGE `{self.rollup_table}` AS rollup
+                USING (
+                    SELECT
+                        origin_cell,
+                        destination_cell,
+                        TIMESTAMP_BUCKET(TIMESTAMP(datetime), INTERVAL 1 WEEK) AS week,
+                        COUNT(1) AS count_of_trips
+                    FROM `{self.trips_table}`
+                    WHERE
+                        ingestion_id IN UNNEST(new_ingestion_ids)
+                        AND origin_cell IS NOT NULL
+                        AND destination_cell IS NOT NULL
+                    GROUP BY
+                        1, 2, 3
+                ) AS trips
+                ON rollup.origin_cell = trips.origin_cell
+                    AND rollup.destination_cell = trips.destination_cell
+                    AND rollup.week = trips.week
+                WHEN MATCHED THEN
+                    UPDATE SET count_of_trips = rollup.count_of_trips + trips.count_of_trips
+                WHEN NOT MATCHED THEN
+                    INSERT (origin_cell, destination_cell, week, count_of_trips)
+                    VALUES (trips.origin_cell, trips.destination_cell, trips.week, trips.count_of_trips);
+
+                INSERT INTO `{self.rollup_table}_ingestions` (ingestion_id, added_at)
+                SELECT ingestion_id, CURRENT_TIMESTAMP()
+                FROM UNNEST(new_ingestion_ids) AS ingestion_id;
+            END IF;
+
+            COMMIT TRANSACTION;
+        """
+
+        def run() -> None:
+            self.__client.query(
+                script,
+                job_config=bigquery.QueryJobConfig(
+                    query_parameters=[
+                        bigquery.ArrayQueryParameter(
+                            "ingestion_ids", "STRING", ingestion_ids
+                        )
+                    ]
+                ),
+            ).result()
+
+        # "Transaction is aborted due to concurrent update against table ..."
+        aborted = retry.Retry(
+            predicate=lambda e: isinstance(e, exceptions.GoogleAPICallError)
+            and "concurrent update" in str(e),
+            initial=1.0,
+            maximum=16.0,
+            multiplier=2.0,
+            timeout=90.0,
+        )
+
+        with self._rollup_lock:
+            aborted(run)()
 
 
 class PubSubService:
@@ -87,6 +228,7 @@ class PubSubService:
         """
         import json
 
+        # Waits for the publish, so the event is not lost when the function returns.
         self.__client.publish(
             topic=self._topic_path, data=json.dumps(event).encode("utf-8")
-        )
+        ).result()
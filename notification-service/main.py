@@ -5,39 +5,90 @@ import os
 import functions_framework
 from cloudevents.http import CloudEvent
 
-from gcp import BigQueryService, PubSubService
-from utils import JobFinishedFormat, JobInProgressFormat, MessageGenerator, SlackService
+from batching import CountBatcher, IdBatcher
+from gcp import BigQueryService
+from polling import JobInProgress, PollingSchedule
+from utils import (
+    JobFailedFormat,
+    JobFinishedFormat,
+    JobInProgressFormat,
+    MessageGenerator,
+    SlackService,
+)
+
+# Environment & General Variables
+project_id = "jobsity-challenge-vitor"
+dataset_id = "trips"
+status_bq_table_name = "ingestion_control"
+rollup_bq_table_name = "trips_weekly_rollup"
+
+# Shared by the concurrent invocations of an instance, so their checks are batched together.
+bq = BigQueryService(
+    project_id=project_id,
+    dataset_id=dataset_id,
+    status_table_name=status_bq_table_name,
+    rollup_table_name=rollup_bq_table_name,
+)
+count_batcher = CountBatcher(
+    fetch=bq.get_counts,
+    window=float(os.environ.get("COUNT_BATCH_WINDOW_SECONDS", 1)),
+    max_ids=int(os.environ.get("COUNT_BATCH_MAX_IDS", 1000)),
+)
+# Finished ingestions are added to the rollup together, as concurrent transactions on it abort.
+rollup_batcher = IdBatcher(
+    run=bq.add_to_rollups,
+    window=float(os.environ.get("COUNT_BATCH_WINDOW_SECONDS", 1)),
+    max_ids=int(os.environ.get("COUNT_BATCH_MAX_IDS", 1000)),
+)
 
 
 @functions_framework.cloud_event
 def subscribe(cloud_event: CloudEvent) -> None:
+    """
+    Checks the completion of the ingestion job of a status event, and notifies its outcome.
+
+    A finished job is added to the weekly rollup and notified. An unfinished one is nacked
+    (see `JobInProgress`) and checked again on its redelivery, until `POLL_DEADLINE_SECONDS`
+    after the event was published, when it is notified as failed and acked.
+
+    Args:
+        cloud_event (CloudEvent): The Pub/Sub push of the status event.
+
+    Raises:
+        JobInProgress: If the job is unfinished and its deadline has not passed.
+    """
 
     # Environment & General Variables
     slack_webhook = os.environ["SLACK_WEBHOOK"]
     slack_channel = "ingestion-jobs"
-    project_id = "jobsity-challenge-vitor"
-    dataset_id = "trips"
-    status_bq_table_name = "ingestion_control"
-    pubsub_topic_id = "status_topic"
-
-    event = json.loads(base64.b64decode(cloud_event.data["message"]["data"]).decode())
-
-    bq = BigQueryService(
-        project_id=project_id,
-        dataset_id=dataset_id,
-        status_table_name=status_bq_table_name,
+    schedule = PollingSchedule(
+        deadline=float(os.environ.get("POLL_DEADLINE_SECONDS", 6 * 3600))
     )
 
-    pubsub = PubSubService(project_id=project_id, topic_id=pubsub_topic_id)
+    event = json.loads(base64.b64decode(cloud_event.data["message"]["data"]).decode())
 
     slack = SlackService(webhook=slack_webhook, channel=slack_channel)
 
-    event["current_count"] = bq.get_count(ingestion_id=event["ingestion_id"])
+    schedule.start(event, published_at=cloud_event["time"])
+
+    event["current_count"] = count_batcher.get_count(ingestion_id=event["ingestion_id"])
 
     msg_format = MessageGenerator.generate(event)
 
+    if isinstance(msg_format, JobInProgressFormat) and schedule.expired(event):
+        msg_format = JobFailedFormat(event=event)
+
+    # Over-delivered jobs are finished as well (see `JobOverDeliveredFormat`).
     if isinstance(msg_format, JobFinishedFormat):
+        rollup_batcher.submit(ingestion_id=event["ingestion_id"])
+        slack.send(msg=msg_format.msg)
+
+    if isinstance(msg_format, JobFailedFormat):
         slack.send(msg=msg_format.msg)
 
+    # Nacked: Pub/Sub redelivers the event after the backoff of the subscription.
     if isinstance(msg_format, JobInProgressFormat):
-        pubsub.send(event=event)
+        raise JobInProgress(
+            f"Ingestion {event['ingestion_id']}: {event['current_count']} of "
+            f"{event['count']} events in BigQuery."
+        )
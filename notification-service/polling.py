@@ -0,0 +1,51 @@
+import time
+from datetime import datetime
+from typing import Dict
+
+
+class JobInProgress(Exception):
+    """
+    Raised to nack the status event of an unfinished ingestion job, so Pub/Sub redelivers it
+    once the backoff of the retry policy of the subscription has elapsed.
+    """
+
+
+class PollingSchedule:
+    """
+    Schedules the completion checks of an ingestion job.
+
+    An unfinished job is checked again by nacking its status event (see `JobInProgress`):
+    Pub/Sub redelivers it with the exponential backoff of the subscription's retry policy,
+    so no invocation waits for a check, and a job costs nothing between two checks. Every
+    delivery carries the same event, published once by the Ingestion API, so the deadline
+    of the job is counted from its publish time.
+    """
+
+    def __init__(self, deadline: float = 6 * 3600.0) -> None:
+        """
+        Initializes the PollingSchedule.
+
+        Args:
+            deadline (float, optional): The seconds after the status event was published when
+                an unfinished job is considered failed. Defaults to 6 hours.
+        """
+        self.deadline = deadline
+
+    def start(self, event: Dict[str, str], published_at: str) -> None:
+        """
+        Adds the 'deadline' of the job, and the hours it was 'checked_for', to its event.
+
+        Args:
+            event (Dict[str, str]): The status event, updated in place.
+            published_at (str): The RFC 3339 publish time of the event, such as the "time"
+                attribute of its CloudEvent.
+        """
+        published = datetime.fromisoformat(published_at.replace("Z", "+00:00"))
+        event["deadline"] = published.timestamp() + self.deadline
+        event["checked_for"] = round((time.time() - published.timestamp()) / 3600, 1)
+
+    def expired(self, event: Dict[str, str]) -> bool:
+        """
+        Checks whether the deadline of an event has passed.
+        """
+        return time.time() >= event["deadline"]
@@ -0,0 +1,89 @@
+import threading
+from collections import Counter
+from concurrent import futures
+
+import pytest
+
+from batching import CountBatcher, IdBatcher
+
+
+class Recorder:
+    """
+    Records the IDs of every call, and returns a count per ID.
+    """
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def __call__(self, ids):
+        with self._lock:
+            self.calls.append(list(ids))
+        if self.fail:
+            raise RuntimeError("query failed")
+        return {ingestion_id: len(ingestion_id) for ingestion_id in ids}
+
+
+def submit_all(batcher, ids, method="submit"):
+    with futures.ThreadPoolExecutor(max_workers=len(ids)) as pool:
+        return list(pool.map(getattr(batcher, method), ids))
+
+
+def test_ids_of_a_window_share_one_call():
+    fetch = Recorder()
+    batcher = CountBatcher(fetch=fetch, window=0.5, max_ids=100)
+    ids = [f"id-{'x' * i}" for i in range(10)]
+
+    assert submit_all(batcher, ids, "get_count") == [len(i) for i in ids]
+    assert len(fetch.calls) == 1
+    assert sorted(fetch.calls[0]) == sorted(ids)
+
+
+def test_full_windows_are_flushed_right_away():
+    run = Recorder()
+    batcher = IdBatcher(run=run, window=30, max_ids=5)
+
+    results = submit_all(batcher, [f"id-{i}" for i in range(10)])
+
+    # Both windows are flushed when full, long before their 30 seconds.
+    assert [len(call) for call in run.calls] == [5, 5]
+    assert sorted(Counter(id(result) for result in results).values()) == [5, 5]
+
+
+def test_a_window_is_flushed_after_its_duration():
+    run = Recorder()
+    batcher = IdBatcher(run=run, window=0.05, max_ids=100)
+
+    assert batcher.submit("a") == {"a": 1}
+    assert batcher.submit("b") == {"b": 1}
+    assert run.calls == [["a"], ["b"]]
+
+
+def test_duplicate_ids_are_sent_once():
+    fetch = Recorder()
+    batcher = CountBatcher(fetch=fetch, window=0.5, max_ids=100)
+
+    assert submit_all(batcher, ["a", "a", "bb"], "get_count") == [1, 1, 2]
+    assert sorted(fetch.calls[0]) == ["a", "bb"]
+
+
+def test_unknown_ids_count_zero():
+    batcher = CountBatcher(fetch=lambda ids: {}, window=0)
+
+    assert batcher.get_count("a") == 0
+
+
+def test_a_failed_call_fails_every_id_of_its_window():
+    batcher = IdBatcher(run=Recorder(fail=True), window=0.5, max_ids=100)
+
+    with futures.ThreadPoolExecutor(max_workers=3) as pool:
+        submitted = [pool.submit(batcher.submit, i) for i in ("a", "b", "c")]
+
+    for future in submitted:
+        with pytest.raises(RuntimeError):
+            future.result()
+
+    # The next window starts afresh.
+    batcher.run = Recorder()
+    assert batcher.submit("d") == {"d": 1}
@@ -0,0 +1,98 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from cloudevents.http import CloudEvent
+
+
+@pytest.fixture(scope="module")
+def main():
+    # The BigQuery client of the module is replaced, its queries are stubbed per test.
+    with mock.patch("google.cloud.bigquery.Client"):
+        import main
+
+    return main
+
+
+@pytest.fixture
+def function(main, monkeypatch):
+    """
+    Stubs the BigQuery counts, the rollup and Slack, and records the calls to them.
+    """
+    calls = {"counts": {}, "rollups": [], "slack": []}
+    monkeypatch.setenv("SLACK_WEBHOOK", "https://hooks.slack.test")
+    monkeypatch.delenv("POLL_DEADLINE_SECONDS", raising=False)
+    monkeypatch.setattr(
+        main.count_batcher,
+        "run",
+        lambda ids: {i: calls["counts"].get(i, 0) for i in ids},
+    )
+    monkeypatch.setattr(
+        main.rollup_batcher, "run", lambda ids: calls["rollups"].extend(ids)
+    )
+    monkeypatch.setattr(
+        main.SlackService, "send", lambda self, msg: calls["slack"].append(msg)
+    )
+    monkeypatch.setattr(main.count_batcher, "window", 0)
+    monkeypatch.setattr(main.rollup_batcher, "window", 0)
+
+    return main.subscribe, calls
+
+
+def status_event(count, hours_ago):
+    published = datetime.now(timezone.utc) - timedelta(hours=hours_ago)
+    data = json.dumps({"ingestion_id": "job-1", "count": count}).encode()
+
+    return CloudEvent(
+        {
+            "type": "google.cloud.pubsub.topic.v1.messagePublished",
+            "source": "//pubsub.googleapis.com/projects/p/topics/status_topic",
+            "time": published.isoformat().replace("+00:00", "Z"),
+        },
+        {"message": {"data": base64.b64encode(data).decode()}},
+    )
+
+
+def test_in_progress_job_is_nacked(main, function):
+    subscribe, calls = function
+    calls["counts"]["job-1"] = 40
+
+    with pytest.raises(main.JobInProgress, match="40 of 100"):
+        subscribe(status_event(count=100, hours_ago=1))
+
+    assert calls["slack"] == [] and calls["rollups"] == []
+
+
+def test_job_past_its_deadline_is_reported_as_failed(main, function):
+    subscribe, calls = function
+    calls["counts"]["job-1"] = 40
+
+    # Acked: Pub/Sub stops redelivering the event.
+    subscribe(status_event(count=100, hours_ago=7))
+
+    assert len(calls["slack"]) == 1
+    assert (
+        calls["slack"][0]
+        == main.JobFailedFormat(
+            event={
+                "ingestion_id": "job-1",
+                "count": 100,
+                "current_count": 40,
+                "checked_for": 7.0,
+            }
+        ).msg
+    )
+    assert calls["rollups"] == []
+
+
+@pytest.mark.parametrize("current_count", [100, 103])
+def test_finished_job_is_rolled_up_and_notified(function, current_count):
+    subscribe, calls = function
+    calls["counts"]["job-1"] = current_count
+
+    subscribe(status_event(count=100, hours_ago=7))
+
+    assert calls["rollups"] == ["job-1"]
+    assert len(calls["slack"]) == 1 and "has finished" in calls["slack"][0]
@@ -0,0 +1,40 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from polling import PollingSchedule
+
+
+def published(seconds_ago):
+    moment = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+def test_deadline_is_counted_from_the_publish_time():
+    event = {}
+
+    PollingSchedule(deadline=3600).start(event, published_at=published(1800))
+
+    assert abs(event["deadline"] - (time.time() + 1800)) < 5
+    assert event["checked_for"] == 0.5
+
+
+def test_redeliveries_of_an_event_share_its_deadline():
+    schedule = PollingSchedule(deadline=3600)
+    published_at = published(60)
+    first, redelivered = {}, {}
+
+    schedule.start(first, published_at=published_at)
+    schedule.start(redelivered, published_at=published_at)
+
+    assert first["deadline"] == redelivered["deadline"]
+
+
+def test_expired():
+    schedule = PollingSchedule(deadline=3600)
+    fresh, late = {}, {}
+
+    schedule.start(fresh, published_at=published(3000))
+    schedule.start(late, published_at=published(3700))
+
+    assert not schedule.expired(fresh)
+    assert schedule.expired(late)
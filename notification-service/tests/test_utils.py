@@ -0,0 +1,34 @@
+import pytest
+
+from utils import (
+    JobFinishedFormat,
+    JobInProgressFormat,
+    JobOverDeliveredFormat,
+    MessageGenerator,
+)
+
+
+@pytest.mark.parametrize(
+    "current_count, expected_format",
+    [
+        (100, JobFinishedFormat),
+        (40, JobInProgressFormat),
+        (0, JobInProgressFormat),
+        (130, JobOverDeliveredFormat),
+    ],
+)
+def test_generate_picks_the_format_of_the_counts(current_count, expected_format):
+    event = {"ingestion_id": "a", "count": 100, "current_count": current_count}
+
+    assert type(MessageGenerator.generate(event)) is expected_format
+
+
+def test_over_delivered_job_is_reported_as_finished():
+    event = {"ingestion_id": "a", "count": 100, "current_count": 130}
+
+    msg_format = MessageGenerator.generate(event)
+
+    assert isinstance(msg_format, JobFinishedFormat)
+    assert "has finished" in msg_format.msg
+    assert "more than once" in msg_format.msg
+    assert "*Current Count of Events:* 130" in msg_format.msg
@@ -48,6 +48,38 @@ class JobFinishedFormat(MessageFormat):
         )
 
 
+class JobOverDeliveredFormat(JobFinishedFormat):
+    """
+    Class for formatting messages when an ingestion job has finished with more events in
+    BigQuery than expected.
+
+    Events are delivered at least once: an ingestion resumed from its last checkpoint
+    publishes again the events of the chunk it was interrupted in.
+    """
+
+    def __init__(self, event: Dict[str, str]) -> None:
+        """
+        Initializes the JobOverDeliveredFormat with the provided event data and constructs
+        the completion message.
+
+        Args:
+            event (Dict[str, str]): A dictionary containing event information.
+        """
+
+        super().__init__(event=event)
+        self.msg_dict["message"] = (
+            "*Message:* The ingestion job has finished! "
+            "Some events were delivered more than once, probably by a resumed ingestion. \n"
+        )
+        self.msg = (
+            self.msg_dict["header"]
+            + self.msg_dict["message"]
+            + self.msg_dict["ingestion_id"]
+            + self.msg_dict["expected_count"]
+            + self.msg_dict["current_count"]
+        )
+
+
 class JobInProgressFormat(MessageFormat):
     """
     Class for formatting messages when an ingestion job is currently in progress.
@@ -89,6 +121,7 @@ class JobFailedFormat(MessageFormat):
         super().__init__(event=event)
         self.msg_dict["message"] = (
             "*Message:* The ingestion job started a long time and hasn't finished yet! Please take a look.! \n"
+            f"*Checked for:* {self.event.get('checked_for')} hours \n"
         )
         self.msg = (
             self.msg_dict["header"]
@@ -109,15 +142,15 @@ class MessageGenerator:
         Generates a message format based on the status of the ingestion job.
 
         This method determines the message format to use based on whether the
-        current count of events matches the expected count.
+        current count of events matches, exceeds or falls short of the expected count.
 
         Args:
             event (Dict[str, str]): A dictionary containing event information, including
             the expected count and the current count.
 
         Returns:
-            MessageFormat: An instance of JobFinishedFormat, JobInProgressFormat,
-            or JobFailedFormat based on the event status.
+            MessageFormat: An instance of JobFinishedFormat, JobOverDeliveredFormat or
+            JobInProgressFormat based on the event status.
         """
 
         # If all events sent by the invoker were successfully written in BigQuery
@@ -126,6 +159,9 @@ class MessageGenerator:
         # If ingestion into BigQuery is still in progress.
         elif event["current_count"] < event["count"]:
             return JobInProgressFormat(event=event)
+        # If some events were written more than once, as delivery is at-least-once.
+        else:
+            return JobOverDeliveredFormat(event=event)
 
 
 class SlackService: